@@ -123,6 +123,29 @@ def jsonify(func):
     return jsonified
 
 
+def jsonify_chunked(func):
+    """Like @jsonify, but returns a list of UTF-8 encoded chunks of JSON.
+
+    The result is encoded incrementally with api.jsonify.iterencode, so
+    large trees of models never get converted or joined into one string
+    all at once. The list is picklable, so put a layer_cache decorator
+    above this to cache the encoded body, and @jsonp above that to send
+    the chunks as they are.
+    """
+    @wraps(func)
+    def jsonified(*args, **kwargs):
+        obj = func(*args, **kwargs)
+
+        if isinstance(obj, current_app.response_class):
+            return obj
+
+        camel_cased = (has_flask_request_context() and
+                       flask.request.values.get("casing") == "camel")
+
+        return list(apijsonify.iterencode(obj, camel_cased=camel_cased))
+    return jsonified
+
+
 def jsonp(func):
     @wraps(func)
     def jsonp_enabled(*args, **kwargs):
@@ -132,7 +155,11 @@ def jsonp(func):
             return val
 
         callback = request.values.get("callback")
-        if callback:
+        if isinstance(val, list):
+            # Chunks from @jsonify_chunked are sent without being joined
+            if callback:
+                val = ["%s(" % callback] + val + [")"]
+        elif callback:
             val = "%s(%s)" % (callback, val)
         return current_app.response_class(
             val, mimetype="application/json; charset=utf-8")
@@ -220,7 +247,8 @@ def cache_with_key_fxn_and_param(
         expiration=DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
         layer=Layers.Memcache | Layers.InAppMemory,
         persist_across_app_versions=False,
-        permanent_key_fxn=None):
+        permanent_key_fxn=None,
+        use_chunks=False):
     def decorator(func):
         def wrapper(*args, **kwargs):
             def wrapped_key_fxn(*args, **kwargs):
@@ -235,6 +263,10 @@ def cache_with_key_fxn_and_param(
                                                 layer,
                                                 persist_across_app_versions,
                                                 permanent_key_fxn,
+                                                use_chunks,
+                                                True,  # compress_chunks
+                                                None,  # lease_seconds
+                                                None,  # soft_expiration
                                                 *args, **kwargs)
         return wrapper
     return decorator
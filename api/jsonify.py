@@ -9,7 +9,9 @@ except ImportError:
 
 from google.appengine.ext import db
 from datetime import datetime
+import inspect
 import re
+import types
 
 SIMPLE_TYPES = (int, long, float, bool, basestring)
 
@@ -17,7 +19,7 @@ SIMPLE_TYPES = (int, long, float, bool, basestring)
 def dumps(obj, camel_cased=False):
     if isinstance(obj, SIMPLE_TYPES):
         return obj
-    elif obj == None:
+    elif obj is None:
         return None
     elif isinstance(obj, list):
         return [dumps(item, camel_cased) for item in obj]
@@ -28,44 +30,147 @@ def dumps(obj, camel_cased=False):
         for key in obj:
             value = dumps(obj[key], camel_cased)
             if camel_cased:
-                properties[camel_casify(key)] = value
+                properties[_camel_cased_key(key)] = value
             else:
                 properties[key] = value
         return properties
 
-    properties = dict()
-    if isinstance(obj, db.Model):
-        properties['kind'] = obj.kind()
+    return _serializer_plan(obj.__class__).dumps(obj, camel_cased)
 
-    serialize_blacklist = []
-    if hasattr(obj, "_serialize_blacklist"):
-        serialize_blacklist = obj._serialize_blacklist
 
-    serialize_list = dir(obj)
-    if hasattr(obj, "_serialize_whitelist"):
-        serialize_list = obj._serialize_whitelist
+class _SerializerPlan(object):
+    """How to serialize instances of one class, worked out once.
 
-    for property in serialize_list:
-        if _is_visible_property(property, serialize_blacklist):
+    Which attributes an instance exposes only depends on its class (apart
+    from attributes set on the instance itself), so the class's dir(),
+    whitelist and blacklist are filtered here rather than on every call.
+    Class attributes that are plain functions can never produce a
+    serializable value and are dropped up front, and the output key of
+    every attribute is computed in both casings.
+    """
+
+    def __init__(self, cls):
+        self.kind = None
+        if isinstance(cls, type) and issubclass(cls, db.Model):
+            self.kind = cls.kind()
+
+        self.blacklist = frozenset(getattr(cls, "_serialize_blacklist", []))
+
+        if not isinstance(cls, type):
+            # Instances of old-style classes have no __getattribute__, so
+            # none of their attributes have ever been serialized
+            names = []
+            self.include_instance_attributes = False
+        elif hasattr(cls, "_serialize_whitelist"):
+            names = cls._serialize_whitelist
+            self.include_instance_attributes = False
+        else:
+            names = [name for name in dir(cls)
+                     if not _is_method(_class_attribute(cls, name))]
+            self.include_instance_attributes = True
+
+        self.attributes = [
+            (name, name, camel_casify(name))
+            for name in names
+            if _is_visible_property(name, self.blacklist)]
+        self.attribute_names = frozenset(
+            name for name, _, _ in self.attributes)
+        self.getattribute = getattr(cls, "__getattribute__", None)
+
+    def properties(self, obj, camel_cased):
+        """Return a dict of obj's visible attribute values, unconverted."""
+        properties = {}
+        if self.kind is not None:
+            properties['kind'] = self.kind
+
+        key_index = 2 if camel_cased else 1
+        for attribute in self.attributes:
+            self._add(properties, obj, attribute[0], attribute[key_index])
+
+        if self.include_instance_attributes:
+            # Attributes set on this instance but not defined on the class,
+            # or shadowing one of the class's methods
+            for name in getattr(obj, "__dict__", ()):
+                if (name not in self.attribute_names and
+                        _is_visible_property(name, self.blacklist)):
+                    key = _camel_cased_key(name) if camel_cased else name
+                    self._add(properties, obj, name, key)
+
+        return properties
+
+    def dumps(self, obj, camel_cased):
+        properties = {}
+        for key, value in self.properties(obj, camel_cased).iteritems():
             try:
-                value = obj.__getattribute__(property)
-                if not _is_visible_property_value(value):
-                    continue
-
-                valueClass = str(value.__class__)
-                if is_visible_class_name(valueClass):
-                    value = dumps(value, camel_cased)
-                    if camel_cased:
-                        properties[camel_casify(property)] = value
-                    else:
-                        properties[property] = value
+                properties[key] = dumps(value, camel_cased)
             except:
-                continue
+                pass
+
+        if len(properties) == 0:
+            return str(obj)
+        else:
+            return properties
+
+    def _add(self, properties, obj, name, key):
+        try:
+            value = self.getattribute(obj, name)
+            if _is_visible_class(value.__class__):
+                properties[key] = value
+        except:
+            pass
+
+
+_SERIALIZER_PLANS = {}
+
+
+def _serializer_plan(cls):
+    plan = _SERIALIZER_PLANS.get(cls)
+    if plan is None:
+        plan = _SERIALIZER_PLANS[cls] = _SerializerPlan(cls)
+    return plan
+
+
+def _class_attribute(cls, name):
+    """Return the attribute as stored on the class, before binding."""
+    for klass in inspect.getmro(cls):
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+
+def _is_method(attribute):
+    return isinstance(attribute,
+                      (types.FunctionType, staticmethod, classmethod))
+
+
+_VISIBLE_CLASSES = {}
+
+
+def _is_visible_class(cls):
+    """Whether values of class cls are serialized.
+
+    Equivalent to _is_visible_property_value and is_visible_class_name,
+    remembered per class.
+    """
+    visible = _VISIBLE_CLASSES.get(cls)
+    if visible is None:
+        visible = _VISIBLE_CLASSES[cls] = (
+            not (isinstance(cls, type) and issubclass(cls, db.Blob)) and
+            is_visible_class_name(str(cls)))
+    return visible
 
-    if len(properties) == 0:
-        return str(obj)
-    else:
-        return properties
+
+_CAMEL_CASED_KEYS = {}
+_MAX_CAMEL_CASED_KEYS = 10000
+
+
+def _camel_cased_key(key):
+    camel_cased_key = _CAMEL_CASED_KEYS.get(key)
+    if camel_cased_key is None:
+        if len(_CAMEL_CASED_KEYS) >= _MAX_CAMEL_CASED_KEYS:
+            _CAMEL_CASED_KEYS.clear()
+        camel_cased_key = _CAMEL_CASED_KEYS[key] = camel_casify(key)
+    return camel_cased_key
 
 UNDERSCORE_RE = re.compile("_([a-z])")
 
@@ -150,3 +255,153 @@ def jsonify(data, camel_cased=False):
                       ensure_ascii=False,
                       indent=4,
                       cls=encoder)
+
+
+# Roughly how many bytes iterencode() puts in each chunk it yields
+ENCODE_CHUNK_SIZE = 64 * 1024
+
+
+def iterencode(data, camel_cased=False, chunk_size=ENCODE_CHUNK_SIZE):
+    """Yield the same JSON as jsonify(data, camel_cased), as UTF-8 chunks.
+
+    Objects are converted with their serializer plans as the encoder
+    reaches them, rather than all up front by dumps(), so neither the
+    converted tree nor the whole JSON string has to be in memory at once.
+
+    One difference from jsonify(): an attribute whose value can't be
+    converted (e.g. a datetime before 1900, or a dict with non-string keys
+    when camel casing) raises here instead of being left out, since the
+    output before it has already been yielded.
+    """
+    buf = []
+    size = 0
+    for token in _iterencode(data, camel_cased, 0):
+        if isinstance(token, unicode):
+            token = token.encode("utf-8")
+        buf.append(token)
+        size += len(token)
+        if size >= chunk_size:
+            yield "".join(buf)
+            buf = []
+            size = 0
+
+    if buf:
+        yield "".join(buf)
+
+
+# These mirror the formatting of json.dumps(indent=4, sort_keys=True,
+# ensure_ascii=False, skipkeys=True) as used by jsonify(), including the
+# "</" escaping done by the encoder classes above.
+_INDENT = 4
+_ITEM_SEPARATOR = ", "
+_KEY_SEPARATOR = ": "
+
+
+def _encode_string(s):
+    return json.encoder.encode_basestring(s).replace("</", "<\\/")
+
+
+def _encode_float(f):
+    if f != f:
+        return "NaN"
+    elif f == json.encoder.INFINITY:
+        return "Infinity"
+    elif f == -json.encoder.INFINITY:
+        return "-Infinity"
+    return json.encoder.FLOAT_REPR(f)
+
+
+def _encode_key(key):
+    """Return the JSON for a dict key, or None if it should be skipped."""
+    if isinstance(key, basestring):
+        return _encode_string(key)
+    elif isinstance(key, float):
+        return _encode_string(_encode_float(key))
+    elif key is True:
+        return '"true"'
+    elif key is False:
+        return '"false"'
+    elif key is None:
+        return '"null"'
+    elif isinstance(key, (int, long)):
+        return '"%s"' % key
+    return None
+
+
+def _iterencode(obj, camel_cased, level):
+    if isinstance(obj, basestring):
+        yield _encode_string(obj)
+    elif obj is None:
+        yield "null"
+    elif obj is True:
+        yield "true"
+    elif obj is False:
+        yield "false"
+    elif isinstance(obj, (int, long)):
+        yield str(obj)
+    elif isinstance(obj, float):
+        yield _encode_float(obj)
+    elif isinstance(obj, list):
+        for token in _iterencode_list(obj, camel_cased, level):
+            yield token
+    elif isinstance(obj, datetime):
+        yield _encode_string(obj.strftime("%Y-%m-%dT%H:%M:%SZ"))
+    elif isinstance(obj, dict):
+        if camel_cased:
+            properties = {}
+            for key in obj:
+                properties[_camel_cased_key(key)] = obj[key]
+        else:
+            properties = obj
+        for token in _iterencode_dict(properties, camel_cased, level):
+            yield token
+    else:
+        properties = _serializer_plan(obj.__class__).properties(
+            obj, camel_cased)
+        if properties:
+            for token in _iterencode_dict(properties, camel_cased, level):
+                yield token
+        else:
+            yield _encode_string(str(obj))
+
+
+def _iterencode_list(lst, camel_cased, level):
+    if not lst:
+        yield "[]"
+        return
+
+    level += 1
+    newline_indent = "\n" + " " * (_INDENT * level)
+    yield "[" + newline_indent
+    first = True
+    for value in lst:
+        if first:
+            first = False
+        else:
+            yield _ITEM_SEPARATOR + newline_indent
+        for token in _iterencode(value, camel_cased, level):
+            yield token
+    yield "\n" + " " * (_INDENT * (level - 1)) + "]"
+
+
+def _iterencode_dict(dct, camel_cased, level):
+    if not dct:
+        yield "{}"
+        return
+
+    level += 1
+    newline_indent = "\n" + " " * (_INDENT * level)
+    yield "{" + newline_indent
+    first = True
+    for key, value in sorted(dct.items(), key=lambda kv: kv[0]):
+        key = _encode_key(key)
+        if key is None:
+            continue
+        if first:
+            first = False
+        else:
+            yield _ITEM_SEPARATOR + newline_indent
+        yield key + _KEY_SEPARATOR
+        for token in _iterencode(value, camel_cased, level):
+            yield token
+    yield "\n" + " " * (_INDENT * (level - 1)) + "}"
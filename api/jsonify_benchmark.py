@@ -0,0 +1,115 @@
+"""Compare api.jsonify.dumps with the implementation it replaced.
+
+legacy_dumps is the old dumps(), which called dir() on every object and
+checked every attribute value's class name. It's kept here so the two can
+be compared, both for speed and for producing the same output.
+
+To run against the real topic tree, from a remote_api shell
+(tools/devshell.py) or the dev server's interactive console:
+
+    from api import jsonify_benchmark
+    jsonify_benchmark.benchmark_topic_tree()
+"""
+
+import time
+
+import api.jsonify as apijsonify
+from api.jsonify import (SIMPLE_TYPES, camel_casify, _is_visible_property,
+                         _is_visible_property_value, is_visible_class_name)
+from google.appengine.ext import db
+from datetime import datetime
+
+
+def legacy_dumps(obj, camel_cased=False):
+    if isinstance(obj, SIMPLE_TYPES):
+        return obj
+    elif obj == None:
+        return None
+    elif isinstance(obj, list):
+        return [legacy_dumps(item, camel_cased) for item in obj]
+    elif isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%dT%H:%M:%SZ")
+    elif isinstance(obj, dict):
+        properties = {}
+        for key in obj:
+            value = legacy_dumps(obj[key], camel_cased)
+            if camel_cased:
+                properties[camel_casify(key)] = value
+            else:
+                properties[key] = value
+        return properties
+
+    properties = dict()
+    if isinstance(obj, db.Model):
+        properties['kind'] = obj.kind()
+
+    serialize_blacklist = []
+    if hasattr(obj, "_serialize_blacklist"):
+        serialize_blacklist = obj._serialize_blacklist
+
+    serialize_list = dir(obj)
+    if hasattr(obj, "_serialize_whitelist"):
+        serialize_list = obj._serialize_whitelist
+
+    for property in serialize_list:
+        if _is_visible_property(property, serialize_blacklist):
+            try:
+                value = obj.__getattribute__(property)
+                if not _is_visible_property_value(value):
+                    continue
+
+                valueClass = str(value.__class__)
+                if is_visible_class_name(valueClass):
+                    value = legacy_dumps(value, camel_cased)
+                    if camel_cased:
+                        properties[camel_casify(property)] = value
+                    else:
+                        properties[property] = value
+            except:
+                continue
+
+    if len(properties) == 0:
+        return str(obj)
+    else:
+        return properties
+
+
+def _time(fxn, obj, camel_cased, iterations):
+    """Return the best time of several runs, in seconds."""
+    best = None
+    for _ in xrange(iterations):
+        start = time.time()
+        fxn(obj, camel_cased)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(obj, camel_cased=False, iterations=5):
+    """Time legacy_dumps and jsonify.dumps on obj and check they agree.
+
+    Returns a dict with the best time in seconds of each.
+    """
+    if legacy_dumps(obj, camel_cased) != apijsonify.dumps(obj, camel_cased):
+        raise Exception("jsonify.dumps output differs from legacy_dumps")
+
+    return {
+        "legacy": _time(legacy_dumps, obj, camel_cased, iterations),
+        "compiled": _time(apijsonify.dumps, obj, camel_cased, iterations),
+    }
+
+
+def benchmark_topic_tree(version=None, camel_cased=False, iterations=5):
+    """Benchmark serializing the tree served by /api/v1/topictree."""
+    import topic_models
+
+    if version is None:
+        version = topic_models.TopicVersion.get_default_version()
+    tree = topic_models.Topic.get_by_id("root", version).make_tree()
+
+    results = benchmark(tree, camel_cased, iterations)
+    print "legacy:   %.3fs" % results["legacy"]
+    print "compiled: %.3fs" % results["compiled"]
+    print "speedup:  %.1fx" % (results["legacy"] / results["compiled"])
+    return results
@@ -1,7 +1,10 @@
 """ Unit tests for jsonify functionality """
 
+import datetime
 import unittest
-from jsonify import camel_casify, JSONModelEncoder, JSONModelEncoderCamelCased
+from jsonify import camel_casify, dumps, iterencode, jsonify, \
+    JSONModelEncoder, JSONModelEncoderCamelCased
+from jsonify_benchmark import legacy_dumps
 
 
 class JsonifyTest(unittest.TestCase):
@@ -50,5 +53,96 @@ class JsonifyTest(unittest.TestCase):
              })
         )
 
+
+class _Node(object):
+    _serialize_blacklist = ["secret_value"]
+
+    CLASS_CONSTANT = 3
+
+    def __init__(self, name, children=None):
+        self.name = name
+        self.child_nodes = children or []
+        self.secret_value = "hidden"
+        self._private = "hidden"
+        self.created_on = datetime.datetime(2012, 6, 1, 12, 30)
+
+    def method(self):
+        return "not serialized"
+
+    @staticmethod
+    def static_method():
+        return "not serialized"
+
+    @property
+    def display_name(self):
+        return self.name.title()
+
+    @property
+    def broken(self):
+        raise Exception("properties that raise are skipped")
+
+
+class _WhitelistedNode(_Node):
+    _serialize_whitelist = ["name", "display_name", "child_nodes", "missing"]
+
+
+class _OldStyle:
+    def __init__(self):
+        self.value = 1
+
+    def __str__(self):
+        return "old-style"
+
+
+class _Empty(object):
+    def __str__(self):
+        return "empty"
+
+
+class CompiledDumpsTest(unittest.TestCase):
+    def tree(self):
+        leaf = _Node("leaf_node")
+        leaf.method = "instance attributes shadow methods"
+        return {
+            "root_node": _Node("root", [
+                leaf, _WhitelistedNode("listed", [_Node("under_listed")]),
+                _OldStyle(), _Empty(), None, 1.5, [u"unicode"]]),
+        }
+
+    def test_matches_legacy_dumps(self):
+        for camel_cased in [False, True]:
+            self.assertEqual(legacy_dumps(self.tree(), camel_cased),
+                             dumps(self.tree(), camel_cased))
+
+    def test_output(self):
+        node = dumps(_Node("a_node", [_WhitelistedNode("listed")]),
+                     camel_cased=True)
+        self.assertEqual("a_node", node["name"])
+        self.assertEqual("A_Node", node["displayName"])
+        self.assertEqual(3, node["CLASS_CONSTANT"])
+        self.assertEqual("2012-06-01T12:30:00Z", node["createdOn"])
+        for missing in ["secretValue", "_private", "method", "staticMethod",
+                        "broken"]:
+            self.assertFalse(missing in node)
+
+        self.assertEqual(
+            {"name": "listed", "displayName": "Listed", "childNodes": []},
+            node["childNodes"][0])
+
+    def test_iterencode_matches_jsonify(self):
+        data = [self.tree(), u"unicod\xe9 </script>", {}, [], {"a": {}},
+                datetime.datetime(2012, 6, 1), float("inf"), 10 ** 20]
+        # Non-string keys can't be camel cased, so check them last
+        for camel_cased in [True, False]:
+            if not camel_cased:
+                data.append({1: "int", 2.5: "float", None: "none",
+                             (1, 2): "skipped"})
+            expected = jsonify(data, camel_cased=camel_cased).encode("utf-8")
+            for chunk_size in [1, 16, 1024 * 1024]:
+                chunks = list(iterencode(data, camel_cased, chunk_size))
+                self.assertEqual(expected, "".join(chunks))
+                if chunk_size == 16:
+                    self.assertTrue(len(chunks) > 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -25,6 +25,7 @@ import video_models
 import layer_cache
 import templatetags  # Must be imported to register template tags
 import exercises.exercise_util
+import exercises.progress_matrix
 import exercises.stacks
 from api.auth import facebook_utils
 from avatars import util_avatars
@@ -39,7 +40,7 @@ import notifications
 import user_models
 import coaches
 import gae_bingo.gae_bingo
-from autocomplete import video_title_dicts, topic_title_dicts, url_title_dicts
+from autocomplete import AutocompleteIndex
 from goals.models import (GoalList, Goal, GoalObjective,
     GoalObjectiveAnyExerciseProficiency, GoalObjectiveAnyVideo)
 import profiles.util_profile as util_profile
@@ -51,7 +52,7 @@ from youtube_sync import youtube_get_video_data_dict, youtube_get_video_data
 
 from api.route_decorator import route
 from api import v1_utils
-from api.decorators import jsonify, jsonp, pickle, etag,\
+from api.decorators import jsonify, jsonify_chunked, jsonp, pickle, etag,\
     cacheable, cache_with_key_fxn_and_param
 import api.auth.decorators
 from api.auth.auth_util import unauthorized_response
@@ -167,8 +168,9 @@ def get_user_data_coach_from_request():
     lambda version_id=None:
         "api_content_topics_%s_%s" %
         (version_id, setting_model.Setting.topic_tree_version()),
-    layer=layer_cache.Layers.Memcache)
-@jsonify
+    layer=layer_cache.Layers.Memcache,
+    use_chunks=True)
+@jsonify_chunked
 def content_topics(version_id=None):
     version = topic_models.TopicVersion.get_by_id(version_id)
     if version is None:
@@ -360,8 +362,9 @@ def topic_progress(topic_id):
     (lambda version_id=None: "api_topictree_%s_%s" % (version_id,
         setting_model.Setting.topic_tree_version())
         if version_id is None or version_id == "default" else None),
-    layer=layer_cache.Layers.Memcache)
-@jsonify
+    layer=layer_cache.Layers.Memcache,
+    use_chunks=True)
+@jsonify_chunked
 def topictree(version_id=None):
     version = topic_models.TopicVersion.get_by_id(version_id)
     if version is None:
@@ -1074,8 +1077,9 @@ def get_flagged_feedback():
 @cache_with_key_fxn_and_param(
     "casing",
     lambda: "api_library_%s" % setting_model.Setting.topic_tree_version(),
-    layer=layer_cache.Layers.Memcache)
-@jsonify
+    layer=layer_cache.Layers.Memcache,
+    use_chunks=True)
+@jsonify_chunked
 def playlists_library():
     tree = topic_models.Topic.get_by_id("root").make_tree()
 
@@ -2177,17 +2181,21 @@ def get_students_progress_summary():
         return api_invalid_param_response(e.message)
 
     list_students = sorted(list_students, key=lambda student: student.nickname)
-    user_exercise_graphs = exercise_models.UserExerciseGraph.get(list_students)
+    matrix = exercises.progress_matrix.ProgressMatrix.get(
+        list_students, coach=user_data_coach)
 
-    student_review_exercise_names = []
-    for user_exercise_graph in user_exercise_graphs:
-        student_review_exercise_names.append(
-            user_exercise_graph.review_exercise_names())
+    # The same student dicts are shared by every exercise's buckets
+    student_dicts = [{
+            'nickname': student.nickname,
+            'email': student.email,
+            'profile_root': student.profile_root,
+        } for student in list_students]
 
-    exercises = exercise_models.Exercise.get_all_use_cache()
     exercise_data = []
 
-    for exercise in exercises:
+    for (name, display_name, column) in izip(matrix.exercise_names,
+                                             matrix.exercise_display_names,
+                                             matrix.columns):
         progress_buckets = {
             'review': [],
             'proficient': [],
@@ -2196,36 +2204,18 @@ def get_students_progress_summary():
             'not-started': [],
         }
 
-        for (student, user_exercise_graph, review_exercise_names) in izip(
-                list_students, user_exercise_graphs,
-                student_review_exercise_names):
-            graph_dict = user_exercise_graph.graph_dict(exercise.name)
-
-            if graph_dict['proficient']:
-                if exercise.name in review_exercise_names:
-                    status = 'review'
-                else:
-                    status = 'proficient'
-            elif graph_dict['struggling']:
-                status = 'struggling'
-            elif graph_dict['total_done'] > 0:
-                status = 'started'
-            else:
-                status = 'not-started'
-
-            progress_buckets[status].append({
-                    'nickname': student.nickname,
-                    'email': student.email,
-                    'profile_root': student.profile_root,
-            })
+        for (student_dict, status) in izip(student_dicts, column):
+            progress_buckets[
+                exercises.progress_matrix.STATUS_NAMES[status]].append(
+                    student_dict)
 
         progress = [dict([('status', status),
                         ('students', progress_buckets[status])])
                         for status in progress_buckets]
 
         exercise_data.append({
-            'name': exercise.name,
-            'display_name': exercise.display_name,
+            'name': name,
+            'display_name': display_name,
             'progress': progress,
         })
 
@@ -2895,32 +2885,11 @@ def autocomplete():
 
         max_results_per_type = 10
 
-        exercise_results = filter(
-                lambda exercise: query in exercise.display_name.lower(),
-                exercise_models.Exercise.get_all_use_cache())
-        video_results = filter(
-                lambda video_dict: query in video_dict["title"].lower(),
-                video_title_dicts())
-        topic_results = filter(
-                lambda topic_dict: query in topic_dict["title"].lower(),
-                topic_title_dicts())
-        url_results = filter(
-                lambda url_dict: query in url_dict["title"].lower(),
-                url_title_dicts())
-
-        exercise_results = sorted(
-                exercise_results,
-                key=lambda v: v.display_name.lower().index(query))
-        video_results = sorted(
-                video_results + url_results,
-                key=lambda v: v["title"].lower().index(query))
-        topic_results = sorted(
-                topic_results,
-                key=lambda t: t["title"].lower().index(query))
-
-        exercise_results = exercise_results[:max_results_per_type]
-        video_results = video_results[:max_results_per_type]
-        topic_results = topic_results[:max_results_per_type]
+        index = AutocompleteIndex.get()
+        exercise_results = index.exercises.search(query,
+                                                  max_results_per_type)
+        video_results = index.videos.search(query, max_results_per_type)
+        topic_results = index.topics.search(query, max_results_per_type)
 
     else:
         video_results = {}
@@ -3068,7 +3037,8 @@ def get_student_goals():
     dt_start = dt_end - datetime.timedelta(days=days)
 
     students = sorted(students, key=lambda student: student.nickname)
-    user_exercise_graphs = exercise_models.UserExerciseGraph.get(students)
+    user_exercise_graphs = exercise_models.UserExerciseGraph.get(
+        students, coach=user_data_coach)
 
     return_data = []
     for student, uex_graph in izip(students, user_exercise_graphs):
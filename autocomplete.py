@@ -1,5 +1,9 @@
+import array
+
+import exercise_models
 import layer_cache
 import topic_models
+import user_util
 import video_models
 from url_model import Url
 from setting_model import Setting
@@ -59,3 +63,96 @@ def topic_title_dicts(version_number=None):
         "topic_url": topic.topic_page_url,
         "id": topic.id
     }, topic_list)
+
+
+class TitleIndex(object):
+    """Substring search over a fixed list of titles.
+
+    Returns the same results, in the same order, as checking
+    query in title.lower() for every title and sorting the matches by
+    where the query first appears in the title. Every substring of up to
+    MAX_GRAM_LENGTH characters of every title is indexed with its matches
+    already in that order, so short queries (the first few keystrokes) are
+    answered by slicing a list. Longer queries only check the titles
+    containing their rarest trigram.
+    """
+
+    MAX_GRAM_LENGTH = 3
+
+    def __init__(self, items, titles):
+        self.items = items
+        self.titles = [title.lower() for title in titles]
+
+        gram_matches = {}
+        for i, title in enumerate(self.titles):
+            first_positions = {}
+            for length in xrange(1, TitleIndex.MAX_GRAM_LENGTH + 1):
+                for position in xrange(len(title) - length + 1):
+                    first_positions.setdefault(
+                        title[position:position + length], position)
+
+            for gram, position in first_positions.iteritems():
+                gram_matches.setdefault(gram, []).append((position, i))
+
+        # gram -> indices of the titles containing it, in result order
+        self.postings = {}
+        for gram, matches in gram_matches.iteritems():
+            matches.sort()
+            self.postings[gram] = array.array("i", [i for _, i in matches])
+
+    def search(self, query, limit):
+        """Return the first limit items whose title contains query."""
+        query = query.lower()
+        if len(query) <= TitleIndex.MAX_GRAM_LENGTH:
+            postings = self.postings.get(query, ())
+            return [self.items[i] for i in postings[:limit]]
+
+        rarest = None
+        for position in xrange(len(query) - TitleIndex.MAX_GRAM_LENGTH + 1):
+            postings = self.postings.get(
+                query[position:position + TitleIndex.MAX_GRAM_LENGTH])
+            if postings is None:
+                return []
+            if rarest is None or len(postings) < len(rarest):
+                rarest = postings
+
+        matches = []
+        for i in rarest:
+            position = self.titles[i].find(query)
+            if position >= 0:
+                matches.append((position, i))
+        matches.sort()
+        return [self.items[i] for _, i in matches[:limit]]
+
+
+class AutocompleteIndex(object):
+    """Title indexes of the exercises, videos and urls, and topics."""
+
+    def __init__(self, exercises, video_dicts, topic_dicts):
+        self.exercises = TitleIndex(
+            exercises, [exercise.display_name for exercise in exercises])
+        self.videos = TitleIndex(
+            video_dicts, [video_dict["title"] for video_dict in video_dicts])
+        self.topics = TitleIndex(
+            topic_dicts, [topic_dict["title"] for topic_dict in topic_dicts])
+
+    @staticmethod
+    def get():
+        """Return the index for the current topic version and exercises."""
+        return AutocompleteIndex._get(Setting.topic_tree_version(),
+                                      Setting.cached_exercises_date(),
+                                      user_util.is_current_user_developer())
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(
+        lambda topic_tree_version, exercises_date, is_developer:
+            "autocomplete_index_%s_%s_%s" % (
+                topic_tree_version, exercises_date, is_developer),
+        layer=layer_cache.Layers.InAppMemory)
+    def _get(topic_tree_version, exercises_date, is_developer):
+        # Exercise.get_all_use_cache picks the exercises based on whether the
+        # current user is a developer, the arguments are for the cache key.
+        return AutocompleteIndex(
+            exercise_models.Exercise.get_all_use_cache(),
+            video_title_dicts() + url_title_dicts(),
+            topic_title_dicts())
@@ -0,0 +1,44 @@
+from autocomplete import TitleIndex
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TitleIndexTest(unittest.TestCase):
+    TITLES = [
+        u"Addition 1",
+        u"Basic addition",
+        u"Adding and Subtracting Fractions",
+        u"Subtraction 1",
+        u"Level 2 addition",
+        u"Introduction to the Coordinate Plane",
+        u"Adding Decimals",
+        u"Ratios as fractions in simplest form",
+    ]
+
+    def scan(self, query, limit):
+        """The unindexed search TitleIndex replaces."""
+        matches = [title for title in TitleIndexTest.TITLES
+                   if query in title.lower()]
+        matches.sort(key=lambda title: title.lower().index(query))
+        return matches[:limit]
+
+    def test_matches_scan(self):
+        index = TitleIndex(TitleIndexTest.TITLES, TitleIndexTest.TITLES)
+        for query in [u"a", u"ad", u"add", u"addi", u"addition", u"ion",
+                      u"tion 1", u"fractions", u" ", u"1", u"z", u"addz",
+                      u"coordinate plane", u"the coordinate planes"]:
+            for limit in [1, 3, 10]:
+                self.assertEqual(self.scan(query, limit),
+                                 index.search(query, limit))
+
+    def test_returns_items(self):
+        items = [{"title": title} for title in TitleIndexTest.TITLES]
+        index = TitleIndex(items, TitleIndexTest.TITLES)
+        self.assertEqual([{"title": u"Adding Decimals"}],
+                         index.search(u"Decimal", 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""Compare BadgeReview with the badge checks it replaced.
+
+legacy_earned checks badges the way badge_update_map used to: it filters
+all_badges() by context type and scans user_data.badges once per badge for
+every UserExercise and UserTopic. Neither it nor benchmark() awards
+anything, so they're safe to run against real users.
+
+To run against the users in the test db (see testutil/make_test_db.py),
+from the dev server's interactive console:
+
+    from badges import badge_review_benchmark
+    badge_review_benchmark.benchmark_users()
+"""
+
+import time
+
+import badges
+import exercise_models
+import last_action_cache
+import topic_models
+import user_models
+import util_badges
+
+
+def legacy_earned(user_data, user_exercises, user_topics, action_cache):
+    """Return the names of the badges the old checks found earned."""
+    earned = []
+
+    for badge in util_badges.badges_with_context_type(
+            badges.BadgeContextType.NONE):
+        if badge.is_manually_awarded():
+            continue
+        if not badge.is_already_owned_by(user_data=user_data):
+            if badge.is_satisfied_by(user_data=user_data,
+                                     action_cache=action_cache):
+                earned.append(badge.name)
+
+    for context_type, kwarg, contexts in [
+            (badges.BadgeContextType.EXERCISE, "user_exercise",
+             user_exercises),
+            (badges.BadgeContextType.TOPIC, "user_topic", user_topics)]:
+        for context in contexts:
+            kwargs = {kwarg: context}
+            for badge in util_badges.badges_with_context_type(context_type):
+                if badge.is_manually_awarded():
+                    continue
+                if not badge.is_already_owned_by(user_data=user_data,
+                                                 **kwargs):
+                    if badge.is_satisfied_by(user_data=user_data,
+                                             action_cache=action_cache,
+                                             **kwargs):
+                        earned.append(badge.name)
+
+    return earned
+
+
+def review_earned(user_data, user_exercises, user_topics, action_cache,
+                  since=None):
+    """Return the names of the badges BadgeReview finds earned."""
+    review = util_badges.BadgeReview(user_data, action_cache, since)
+
+    earned = [badge.name for badge in review.earned_with_no_context()]
+    for user_exercise in user_exercises:
+        earned.extend(badge.name for badge in
+                      review.earned_with_context(user_exercise=user_exercise))
+    for user_topic in user_topics:
+        earned.extend(badge.name for badge in
+                      review.earned_with_context(user_topic=user_topic))
+
+    return earned
+
+
+def _time(fxn, users, iterations, **kwargs):
+    """Return the best time of several runs over all users, in seconds."""
+    best = None
+    for _ in xrange(iterations):
+        start = time.time()
+        for user in users:
+            fxn(*user, **kwargs)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(user_datas, iterations=5):
+    """Time legacy_earned and BadgeReview for each user and check they agree.
+
+    Each user's UserExercises, UserTopics and LastActionCache are loaded
+    up front so only the badge checks are timed. Returns a dict with the
+    best time in seconds of the old checks, of a full review, and of a
+    review that skips contexts unchanged since the user's last one.
+    """
+    users = []
+    for user_data in user_datas:
+        users.append((
+            user_data,
+            list(exercise_models.UserExercise.get_for_user_data(user_data)),
+            list(topic_models.UserTopic.get_for_user_data(user_data)),
+            last_action_cache.LastActionCache.get_for_user_data(user_data)))
+
+    for user in users:
+        if legacy_earned(*user) != review_earned(*user):
+            raise Exception("BadgeReview found different badges for %s" %
+                            user[0].key_email)
+
+    def incremental(user_data, user_exercises, user_topics, action_cache):
+        review_earned(user_data, user_exercises, user_topics, action_cache,
+                      since=user_data.last_badge_review)
+
+    return {
+        "legacy": _time(legacy_earned, users, iterations),
+        "review": _time(review_earned, users, iterations),
+        "incremental": _time(incremental, users, iterations),
+    }
+
+
+def benchmark_users(limit=1000, iterations=5):
+    """Benchmark badge reviews of up to limit non-phantom users.
+
+    Like badge_update_map, which each badge mapreduce shard calls for
+    every UserData, and prints the time taken per user.
+    """
+    user_datas = [user_data for user_data
+                  in user_models.UserData.all().fetch(limit)
+                  if util_badges.is_badge_review_waiting(user_data)]
+    if not user_datas:
+        print "No users are waiting for a badge review."
+        return None
+
+    results = benchmark(user_datas, iterations)
+    for name in ["legacy", "review", "incremental"]:
+        print "%-12s %.2fms per user" % (
+            name + ":", 1000.0 * results[name] / len(user_datas))
+    print "speedup:     %.1fx (%.1fx incremental)" % (
+        results["legacy"] / results["review"],
+        results["legacy"] / results["incremental"])
+    return results
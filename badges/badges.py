@@ -182,6 +182,12 @@ class Badge(object):
             "hide_context", "absolute_url", "relative_url", "slug"
             ]
 
+    # Property of the badge's context (a UserExercise or UserTopic) that
+    # changes whenever anything is_satisfied_by checks does. Badge reviews
+    # skip contexts that haven't changed since the user's last review.
+    # None if there is no such property.
+    context_last_changed_property = None
+
     def __init__(self):
         # Initialized by subclasses:
         #   self.description,
@@ -5,6 +5,10 @@ from badges import Badge, BadgeContextType
 # All badges that may be awarded once-per-Exercise inherit from ExerciseBadge
 class ExerciseBadge(Badge):
 
+    # Set on every problem attempt, which is also what pushes the problem
+    # logs some exercise badges look at to the LastActionCache
+    context_last_changed_property = "last_done"
+
     def __init__(self):
         Badge.__init__(self)
         self.badge_context_type = BadgeContextType.EXERCISE
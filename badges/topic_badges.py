@@ -4,6 +4,9 @@ from badges import Badge, BadgeContextType
 # All badges that may be awarded once-per-Topic inherit from TopicBadge
 class TopicBadge(Badge):
 
+    # Set whenever the user watches a video in the topic
+    context_last_changed_property = "last_watched"
+
     def __init__(self):
         Badge.__init__(self)
         self.badge_context_type = BadgeContextType.TOPIC
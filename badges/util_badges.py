@@ -15,12 +15,14 @@ from third_party.mapreduce import control
 from api.jsonify import jsonify
 import badges
 import custom_badges
+import exercise_badges
 import exercise_models
 import last_action_cache
 import layer_cache
 import models_badges
 import notifications
 import setting_model
+import topic_badges
 import topic_exercise_badges
 import topic_models
 import user_models
@@ -74,6 +76,140 @@ def badges_with_context_type(badge_context_type):
                     == badge_context_type, all_badges())
 
 
+# Implementations of is_already_owned_by that only check whether the
+# badge's name, with the name of the context if it has one, is in
+# user_data.badges
+_OWNED_BY_NAME = frozenset([
+    badges.Badge.is_already_owned_by.im_func,
+    exercise_badges.ExerciseBadge.is_already_owned_by.im_func,
+    topic_badges.TopicBadge.is_already_owned_by.im_func,
+])
+
+
+@layer_cache.cache_with_key_fxn(lambda: "reviewed_badges:%s"
+                                % setting_model.Setting.topic_tree_version(),
+                                layer=layer_cache.Layers.InAppMemory)
+def reviewed_badges():
+    """Badges checked by badge reviews, grouped by context type.
+
+    Maps each context type to a list of (badge, whether it's owned by name,
+    its context_last_changed_property) in all_badges() order. Manually
+    awarded badges are left out, as are retired badges, which are never
+    satisfied.
+    """
+    reviewed = {}
+    for badge in all_badges():
+        if badge.is_manually_awarded() or badge.is_retired:
+            continue
+
+        owned_by_name = (type(badge).is_already_owned_by.im_func
+                         in _OWNED_BY_NAME)
+        reviewed.setdefault(badge.badge_context_type, []).append(
+            (badge, owned_by_name, badge.context_last_changed_property))
+
+    return reviewed
+
+
+class BadgeReview(object):
+    """Checks which badges one user has earned and awards them.
+
+    The badges to check come from reviewed_badges(), which is computed once
+    per instance rather than filtered from all_badges() for every context.
+    Whether the user already owns a badge is looked up in a set of
+    user_data.badges built once, instead of by scanning the list for every
+    badge.
+
+    If since is given, badges aren't checked in a context whose
+    context_last_changed_property is older than it, because nothing they
+    depend on has changed since they were last checked.
+    """
+
+    def __init__(self, user_data, action_cache=None, since=None):
+        self.user_data = user_data
+        self.action_cache = action_cache or (last_action_cache.LastActionCache
+                                             .get_for_user_data(user_data))
+        self.since = since
+        self.badges_by_context_type = reviewed_badges()
+        self.owned = set(user_data.badges or [])
+
+    def earned_with_no_context(self):
+        """Yield each unowned no-context badge the user has earned."""
+        for badge in self._earned(badges.BadgeContextType.NONE, None, None,
+                                  {}):
+            yield badge
+
+    def earned_with_context(self, user_exercise=None, user_topic=None):
+        """Yield each unowned badge earned in a UserExercise or UserTopic."""
+        if user_exercise is not None:
+            context_type = badges.BadgeContextType.EXERCISE
+            context = user_exercise
+            context_name = (user_exercise.exercise.replace('_', ' ')
+                            .capitalize())
+            kwargs = {"user_exercise": user_exercise}
+        else:
+            context_type = badges.BadgeContextType.TOPIC
+            context = user_topic
+            context_name = user_topic.title
+            kwargs = {"user_topic": user_topic}
+
+        for badge in self._earned(context_type, context, context_name,
+                                  kwargs):
+            yield badge
+
+    def _earned(self, context_type, context, context_name, kwargs):
+        user_data = self.user_data
+        unchanged = {}
+
+        for badge, owned_by_name, last_changed_property in (
+                self.badges_by_context_type.get(context_type, [])):
+
+            if self.since and last_changed_property:
+                if last_changed_property not in unchanged:
+                    last_changed = getattr(context, last_changed_property)
+                    unchanged[last_changed_property] = (
+                        last_changed is not None and
+                        last_changed <= self.since)
+                if unchanged[last_changed_property]:
+                    continue
+
+            if owned_by_name:
+                if (badge.name_with_target_context(context_name)
+                        in self.owned):
+                    continue
+            elif badge.is_already_owned_by(user_data=user_data, **kwargs):
+                continue
+
+            if badge.is_satisfied_by(user_data=user_data,
+                                     action_cache=self.action_cache,
+                                     **kwargs):
+                yield badge
+
+    def award_with_no_context(self):
+        """Award every no-context badge earned, returning if any were."""
+        return self._award(self.earned_with_no_context(), {})
+
+    def award_with_context(self, user_exercise=None, user_topic=None):
+        """Award every badge earned in a UserExercise or UserTopic,
+        returning if any were.
+        """
+        if user_exercise is not None:
+            kwargs = {"user_exercise": user_exercise}
+        else:
+            kwargs = {"user_topic": user_topic}
+        return self._award(self.earned_with_context(**kwargs), kwargs)
+
+    def _award(self, earned, kwargs):
+        awarded = False
+        for badge in earned:
+            badge.award_to(user_data=self.user_data, **kwargs)
+            awarded = True
+
+            # award_to adds the badge's name to user_data.badges
+            self.owned.update(self.user_data.badges)
+
+        return awarded
+
+
 def badges_with_triggers(badge_triggers):
     """Return badges which list a badge trigger in common with the argument
     badge_triggers.
@@ -377,22 +513,21 @@ def badge_update_map(user_data):
     if not is_badge_review_waiting(user_data):
         return
 
-    action_cache = (last_action_cache.LastActionCache
-                    .get_for_user_data(user_data))
+    # Only check badges in the exercises and topics the user has been
+    # active in since their last review
+    review = BadgeReview(user_data, since=user_data.last_badge_review)
 
     # Update all no-context badges
-    update_with_no_context(user_data, action_cache=action_cache)
+    review.award_with_no_context()
 
     # Update all exercise-context badges
     for user_exercise in (exercise_models.UserExercise
                             .get_for_user_data(user_data)):
-        update_with_user_exercise(user_data, user_exercise,
-                                    action_cache=action_cache)
+        review.award_with_context(user_exercise=user_exercise)
 
     # Update all topic-context badges
     for user_topic in topic_models.UserTopic.get_for_user_data(user_data):
-        update_with_user_topic(user_data, user_topic,
-                                action_cache=action_cache)
+        review.award_with_context(user_topic=user_topic)
 
     user_data.last_badge_review = datetime.datetime.now()
     user_data.put()
@@ -400,50 +535,21 @@ def badge_update_map(user_data):
 
 # Award this user any earned no-context badges.
 def update_with_no_context(user_data, action_cache=None):
-    possible_badges = badges_with_context_type(badges.BadgeContextType.NONE)
-    action_cache = action_cache or (last_action_cache.LastActionCache
-                                    .get_for_user_data(user_data))
-
-    awarded = False
-    for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
-        if not badge.is_already_owned_by(user_data=user_data):
-            if badge.is_satisfied_by(user_data=user_data,
-                                    action_cache=action_cache):
-                badge.award_to(user_data=user_data)
-                awarded = True
-
-    return awarded
+    return BadgeReview(user_data, action_cache).award_with_no_context()
 
 
 # Award user any earned Exercise-context badges for provided UserExercise.
 def update_with_user_exercise(user_data, user_exercise,
                               include_other_badges=False,
                               action_cache=None):
-    possible_badges = badges_with_context_type(badges
-                                               .BadgeContextType.EXERCISE)
-    action_cache = action_cache or (last_action_cache.LastActionCache
-                                    .get_for_user_data(user_data))
+    review = BadgeReview(user_data, action_cache)
 
-    awarded = False
-    for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
-        # Pass in pre-retrieved user_exercise data so each badge check
-        # doesn't have to talk to the datastore
-        if not badge.is_already_owned_by(user_data=user_data,
-                                         user_exercise=user_exercise):
-            if badge.is_satisfied_by(user_data=user_data,
-                                     user_exercise=user_exercise,
-                                     action_cache=action_cache):
-                badge.award_to(user_data=user_data,
-                               user_exercise=user_exercise)
-                awarded = True
+    # Pass in pre-retrieved user_exercise data so each badge check
+    # doesn't have to talk to the datastore
+    awarded = review.award_with_context(user_exercise=user_exercise)
 
     if include_other_badges:
-        awarded = update_with_no_context(user_data,
-                                         action_cache=action_cache) or awarded
+        awarded = review.award_with_no_context() or awarded
 
     return awarded
 
@@ -451,27 +557,14 @@ def update_with_user_exercise(user_data, user_exercise,
 # Award this user any earned Topic-context badges for the provided UserTopic.
 def update_with_user_topic(user_data, user_topic, include_other_badges=False,
                             action_cache=None):
-    possible_badges = badges_with_context_type(badges.BadgeContextType.TOPIC)
-    action_cache = action_cache or (last_action_cache.LastActionCache
-                                    .get_for_user_data(user_data))
+    review = BadgeReview(user_data, action_cache)
 
-    awarded = False
-    for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
-        # Pass in pre-retrieved user_topic data so each badge check doesn't
-        # have to talk to the datastore
-        if not badge.is_already_owned_by(user_data=user_data,
-                                            user_topic=user_topic):
-            if badge.is_satisfied_by(user_data=user_data,
-                                    user_topic=user_topic,
-                                    action_cache=action_cache):
-                badge.award_to(user_data=user_data, user_topic=user_topic)
-                awarded = True
+    # Pass in pre-retrieved user_topic data so each badge check doesn't
+    # have to talk to the datastore
+    awarded = review.award_with_context(user_topic=user_topic)
 
     if include_other_badges:
-        awarded = (update_with_no_context(user_data, action_cache=action_cache)
-                    or awarded)
+        awarded = review.award_with_no_context() or awarded
 
     return awarded
 
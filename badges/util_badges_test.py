@@ -0,0 +1,51 @@
+import datetime
+
+# We can't do 'from badges import util_badges' because badges/badges.py
+# confuses the import system; see mapreduce_test.py.
+import topic_time_badges
+import util_badges
+from testutil import gae_model
+import topic_models
+import user_models
+
+
+class BadgeReviewTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(BadgeReviewTest, self).setUp()
+        self.user_data = user_models.UserData.insert_for(
+            'reviewed', 'reviewed@example.com')
+        self.user_topic = topic_models.UserTopic(
+            user=self.user_data.user,
+            title="Fractions",
+            seconds_watched=20 * 60,
+            last_watched=datetime.datetime(2012, 6, 1))
+
+    def badge_name(self, badge_class):
+        return badge_class().name_with_target_context("Fractions")
+
+    def test_awards_earned_badges_once(self):
+        review = util_badges.BadgeReview(self.user_data)
+        self.assertTrue(review.award_with_context(user_topic=self.user_topic))
+        self.assertTrue(self.badge_name(topic_time_badges.NiceTopicTimeBadge)
+                        in self.user_data.badges)
+        self.assertFalse(self.badge_name(
+            topic_time_badges.GreatTopicTimeBadge) in self.user_data.badges)
+
+        # Already owned, both by this review and by a new one
+        self.assertFalse(review.award_with_context(user_topic=self.user_topic))
+        self.assertEqual([], list(util_badges.BadgeReview(self.user_data)
+                                  .earned_with_context(
+                                      user_topic=self.user_topic)))
+
+    def test_skips_unchanged_contexts(self):
+        review = util_badges.BadgeReview(
+            self.user_data, since=datetime.datetime(2012, 6, 2))
+        self.assertEqual([], list(review.earned_with_context(
+            user_topic=self.user_topic)))
+
+        self.user_topic.last_watched = datetime.datetime(2012, 6, 3)
+        self.assertEqual([self.badge_name(
+                              topic_time_badges.NiceTopicTimeBadge)],
+                         [badge.name_with_target_context("Fractions")
+                          for badge in review.earned_with_context(
+                              user_topic=self.user_topic)])
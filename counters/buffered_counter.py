@@ -0,0 +1,171 @@
+"""Sharded counters that are cheap to add to and to read often.
+
+These use the same ShardedCounter shards as sharded_counter.py, so a
+counter can be switched from one module to the other, but:
+
+- add buffers changes in memcache with memcache.incr, and a task folds
+  them into a single shard at most once every FOLD_INTERVAL_SECONDS per
+  counter, instead of running a transaction for every change.
+- get_count caches the sum of a counter's shards in memcache for
+  TOTAL_CACHE_SECONDS instead of querying and summing them on every read.
+  It adds the changes still waiting to be folded, so reads stay current.
+- get_counts_multi reads any number of counters with a single memcache
+  get_multi, plus one batch get of the configs and one of the shards of
+  counters whose totals aren't cached.
+
+Changes added in a transaction still go straight to a shard, so they're
+only counted if the transaction commits.
+"""
+
+import logging
+import re
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+import sharded_counter
+
+# Buffered changes are folded into a shard by a task that runs at most
+# this many seconds after the first change since the last fold
+FOLD_INTERVAL_SECONDS = 60
+
+# Shard totals are cached for this long. A fold running while a total is
+# read can leave it off by the folded changes until it expires.
+TOTAL_CACHE_SECONDS = 60
+
+# Memcache counters can't go below zero, so buffered changes are stored
+# offset by this much
+PENDING_OFFSET = 2 ** 40
+
+
+def _pending_key(name):
+    return "buffered_counter_pending:%s" % name
+
+
+def _total_key(name):
+    return "buffered_counter_total:%s" % name
+
+
+def add(name, n):
+    '''Add n to the counter (n < 0 is valid)'''
+    if db.is_in_transaction():
+        sharded_counter.add(name, n)
+        return
+
+    key = _pending_key(name)
+    pending = memcache.offset_multi({key: n},
+                                    initial_value=PENDING_OFFSET).get(key)
+    if pending is None:
+        # Memcache is unavailable, so don't buffer the change
+        sharded_counter.add(name, n)
+        return
+
+    window = int(time.time()) // FOLD_INTERVAL_SECONDS
+    if memcache.add("buffered_counter_fold:%s:%s" % (name, window), True,
+                    time=FOLD_INTERVAL_SECONDS * 2):
+        _schedule_fold(name, window)
+
+
+def _schedule_fold(name, window):
+    task_name = re.sub(r'[^a-zA-Z0-9_-]', '_',
+                       "buffered_counter_fold_%s_%s" % (name, window))
+    try:
+        deferred.defer(fold, name,
+                       _name=task_name,
+                       _countdown=FOLD_INTERVAL_SECONDS)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info("deferred task %s already exists" % task_name)
+
+
+def fold(name):
+    '''Move the changes add buffered in memcache into a shard'''
+    key = _pending_key(name)
+    pending = memcache.get(key)
+    if pending is None:
+        return
+
+    n = int(pending) - PENDING_OFFSET
+    if n == 0:
+        return
+
+    # Take the changes out of the buffer before storing them, so changes
+    # added meanwhile are left for the next fold
+    if memcache.offset_multi({key: -n}).get(key) is None:
+        return
+
+    try:
+        sharded_counter._add(name, n)
+    except:
+        memcache.offset_multi({key: n}, initial_value=PENDING_OFFSET)
+        raise
+
+    memcache.delete(_total_key(name))
+
+
+def _sum_shards(names):
+    '''Return a dict of the sum of the shards of each of the counters'''
+    configs = sharded_counter.ShardedCounterConfig.get_by_key_name(names)
+
+    shard_names = []
+    shard_counter_names = []
+    for name, config in zip(names, configs):
+        if config is not None:
+            for index in xrange(config.num_shards):
+                shard_names.append(name + str(index))
+                shard_counter_names.append(name)
+
+    totals = dict.fromkeys(names, 0)
+    shards = sharded_counter.ShardedCounter.get_by_key_name(shard_names)
+    for name, shard in zip(shard_counter_names, shards):
+        # Shard key names are ambiguous: "a1" + "0" is also "a" + "10"
+        if shard is not None and shard.name == name:
+            totals[name] += shard.count
+
+    return totals
+
+
+def get_counts_multi(names):
+    '''Get a dict of the count of each of the named counters'''
+    names = list(set(names))
+    if not names:
+        return {}
+
+    cached = memcache.get_multi([_total_key(name) for name in names] +
+                                [_pending_key(name) for name in names])
+
+    uncached = [name for name in names if _total_key(name) not in cached]
+    totals = {}
+    if uncached:
+        totals = _sum_shards(uncached)
+        memcache.set_multi(dict((_total_key(name), total)
+                                for name, total in totals.iteritems()),
+                           time=TOTAL_CACHE_SECONDS)
+
+    counts = {}
+    for name in names:
+        count = cached.get(_total_key(name), totals.get(name))
+        pending = cached.get(_pending_key(name))
+        if pending is not None:
+            count += int(pending) - PENDING_OFFSET
+        counts[name] = count
+
+    return counts
+
+
+def get_count(name):
+    '''Get the count'''
+    try:
+        return get_counts_multi([name])[name]
+
+    except Exception, e:
+        logging.error("Error in get_count: %s" % e)
+        return 0
+
+
+def change_number_of_shards(name, num):
+    '''Change the number of shards to num'''
+    sharded_counter.change_number_of_shards(name, num)
+    memcache.delete(_total_key(name))
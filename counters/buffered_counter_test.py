@@ -0,0 +1,50 @@
+from google.appengine.ext import db
+
+from counters import buffered_counter
+from counters import sharded_counter
+from testutil import gae_model
+
+
+class BufferedCounterTest(gae_model.GAEModelTestCase):
+    def test_add_and_fold(self):
+        buffered_counter.add("widgets", 5)
+        buffered_counter.add("widgets", 2)
+        buffered_counter.add("widgets", -1)
+        self.assertEqual(6, buffered_counter.get_count("widgets"))
+        self.assertEqual({"widgets": 0},
+                         buffered_counter._sum_shards(["widgets"]))
+
+        buffered_counter.fold("widgets")
+        self.assertEqual({"widgets": 6},
+                         buffered_counter._sum_shards(["widgets"]))
+        self.assertEqual(6, buffered_counter.get_count("widgets"))
+
+        # Nothing left to fold
+        buffered_counter.fold("widgets")
+        self.assertEqual(6, buffered_counter.get_count("widgets"))
+
+    def test_add_in_transaction(self):
+        xg_on = db.create_transaction_options(xg=True)
+        db.run_in_transaction_options(xg_on, buffered_counter.add,
+                                      "widgets", 3)
+        self.assertEqual({"widgets": 3},
+                         buffered_counter._sum_shards(["widgets"]))
+        self.assertEqual(3, buffered_counter.get_count("widgets"))
+
+    def test_caches_total(self):
+        sharded_counter.add("widgets", 4)
+        self.assertEqual(4, buffered_counter.get_count("widgets"))
+
+        sharded_counter.add("widgets", 1)
+        self.assertEqual(4, buffered_counter.get_count("widgets"))
+
+        buffered_counter.add("widgets", 1)
+        self.assertEqual(5, buffered_counter.get_count("widgets"))
+
+    def test_get_counts_multi(self):
+        sharded_counter.add("widgets", 4)
+        buffered_counter.add("widgets", 1)
+        buffered_counter.add("gadgets", 2)
+        self.assertEqual({"widgets": 5, "gadgets": 2, "gizmos": 0},
+                         buffered_counter.get_counts_multi(
+                             ["widgets", "gadgets", "gizmos", "widgets"]))
@@ -36,8 +36,7 @@ class ShardedCounterConfig(db.Model):
 class ShardedCounter(db.Model):
     '''`ShardedCounter`s work together to hold a global count.
     This model is intended to be written often and read rarely (once a day). If
-    you need a global that will be read often consider writing a similar model
-    using memcache.
+    you need a global that will be read often, use buffered_counter.py.
     '''
     name = db.StringProperty(required=True)
     count = db.IntegerProperty(required=True, default=0)
@@ -72,24 +71,29 @@ def _get_config(name):
         return ShardedCounterConfig.get_or_insert(name, name=name)
 
 
+def _add(name, n):
+    '''Add n to a random shard of the counter, raising any errors'''
+    config = _get_config(name)
+
+    def transaction():
+        index = random.randint(0, config.num_shards - 1)
+        shard_name = name + str(index)
+        counter = ShardedCounter.get_by_key_name(shard_name)
+        if counter is None:
+            counter = ShardedCounter(key_name=shard_name, name=name)
+        counter.count += n
+        counter.put()
+
+    if db.is_in_transaction():
+        transaction()
+    else:
+        db.run_in_transaction(transaction)
+
+
 def add(name, n):
     '''Add n to the counter (n < 0 is valid)'''
     try:
-        config = _get_config(name)
-
-        def transaction():
-            index = random.randint(0, config.num_shards - 1)
-            shard_name = name + str(index)
-            counter = ShardedCounter.get_by_key_name(shard_name)
-            if counter is None:
-                counter = ShardedCounter(key_name=shard_name, name=name)
-            counter.count += n
-            counter.put()
-
-        if db.is_in_transaction():
-            transaction()
-        else:
-            db.run_in_transaction(transaction)
+        _add(name, n)
 
     except Exception, e:
         logging.error("Error in add: %s" % e)
@@ -1,18 +1,19 @@
-import sharded_counter
+import buffered_counter
 
-# Keep a global count of registered users
+# Keep a global count of registered users. It's read on dashboards, so use a
+# buffered counter.
 
 
 def get_count():
     '''Get the number of registered users'''
-    return sharded_counter.get_count('user_counter')
+    return buffered_counter.get_count('user_counter')
 
 
 def add(n):
     '''Add n to the counter (n < 0 is valid)'''
-    sharded_counter.add('user_counter', n)
+    buffered_counter.add('user_counter', n)
 
 
 def change_number_of_shards(num):
     '''Change the number of shards to num'''
-    sharded_counter.change_number_of_shards('user_counter', num)
+    buffered_counter.change_number_of_shards('user_counter', num)
@@ -7,6 +7,8 @@ UserExerciseCache: database entity for a cache to speed access to UserExercise
 UserExerciseGraph: all the exercises tried by a single user.  Note that
    this is not a model, despite being in exercise_model.py
    TODO(csilvers): move to a different file in this directory?
+ExerciseTopology: the user-independent shape of the exercise graph, shared
+   by all UserExerciseGraphs built in a process.
 ProblemLog: information about a single problem done by a single user in some
     exercise.
 StackLog: information about a stack (in Power Mode) done by a single user.
@@ -17,17 +19,22 @@ An 'exercise' is what's on a Khan page like
    http://www.khanacademy.org/math/arithmetic/addition-subtraction/e
 """
 
+import collections
 import datetime
+import hashlib
 import itertools
 import logging
 import math
 import random
+import time
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 from exercises import accuracy_model
 from exercises import progress_normalizer
-import app
 import backup_model
 import consts
 import decorators
@@ -38,6 +45,8 @@ import gandalf.bridge
 import layer_cache
 import object_property
 import phantom_users
+import pickle_util
+import request_cache
 import setting_model
 import url_util
 import user_models
@@ -50,6 +59,31 @@ from tincan import TinCan
 # purposes
 ASSESSMENT_CARD_PERIOD = 8
 
+# Attempts and hints wait in this pull queue, tagged with their user's
+# user_id, until commit_problem_logs merges them into their ProblemLogs
+PROBLEM_LOG_OUTBOX_QUEUE = "problem-log-outbox"
+
+# commit_problem_logs runs in this queue, whose retry backoff is at least
+# PROBLEM_LOG_LEASE_SECONDS so a retry finds the attempts and hints it
+# failed to commit
+PROBLEM_LOG_QUEUE = "problem-log-queue"
+
+# A user's attempts and hints are committed at most this many seconds after
+# they're queued
+PROBLEM_LOG_COMMIT_INTERVAL_SECONDS = 5
+
+# The most attempts and hints commit_problem_logs leases at once
+PROBLEM_LOG_BATCH_SIZE = 100
+
+# How long commit_problem_logs has to commit the attempts and hints it
+# leased before they can be leased again
+PROBLEM_LOG_LEASE_SECONDS = 60
+
+# Attempts and hints leased more than this many times are moved out of the
+# outbox into UncommittedProblemLogs, so one that can't be committed doesn't
+# hold up the rest of its user's
+PROBLEM_LOG_MAX_LEASES = 5
+
 class Exercise(backup_model.BackupModel):
     """Information about a single exercise."""
     name = db.StringProperty()
@@ -273,7 +307,7 @@ class Exercise(backup_model.BackupModel):
         if user_util.is_current_user_developer():
             return Exercise._get_all_use_cache_unsafe()
         else:
-            return Exercise._get_all_use_cache_safe()
+            return Exercise.get_all_use_cache_safe()
 
     @staticmethod
     @layer_cache.cache_with_key_fxn(
@@ -284,7 +318,8 @@ class Exercise(backup_model.BackupModel):
         return query.fetch(1000) # TODO(Ben) this limit is tenuous
 
     @staticmethod
-    def _get_all_use_cache_safe():
+    def get_all_use_cache_safe():
+        """The live exercises, whoever the current user is."""
         return filter(lambda exercise: exercise.live, Exercise._get_all_use_cache_unsafe())
 
     @staticmethod
@@ -595,7 +630,7 @@ class UserExercise(backup_model.BackupModel):
         if len(stack_dicts) < n:
             # Now get all boundary exercises (those that aren't proficient and
             # aren't covered by other boundary exercises)
-            frontier = UserExerciseGraph.get_boundary_names(graph.graph)
+            frontier = graph.get_boundary_names()
             frontier_dicts = [graph.graph_dict(exid) for exid in frontier]
 
             # If we don't have *any* boundary exercises, fill things out with the other
@@ -697,6 +732,28 @@ class UserExerciseCache(db.Model):
     # and need to invalidate all old caches
     CURRENT_VERSION = 9
 
+    # Missing caches are regenerated by running their users' UserExercise
+    # queries concurrently, as many at once as fit in this many estimated
+    # UserExercises. Some coaches have lots of active students, and their
+    # user exercise information is too much for app engine instances.
+    REGENERATE_USER_EXERCISE_BUDGET = 1000
+
+    # ...and never more than this many queries at once
+    REGENERATE_MAX_QUERIES = 10
+
+    # How many UserExercises to expect of a user with no old cache to count
+    DEFAULT_USER_EXERCISE_ESTIMATE = 50
+
+    # Warm-ups regenerate and put the missing caches of this many students
+    # at a time
+    WARM_UP_BATCH_SIZE = 20
+
+    # A coach's report missing this many of its students' caches is cold, so
+    # the caches of all of the coach's students are regenerated in the
+    # background, at most once per WARM_UP_INTERVAL_SECONDS
+    COLD_REPORT_MISSING_CACHES = 10
+    WARM_UP_INTERVAL_SECONDS = 60 * 60
+
     version = db.IntegerProperty()
     dicts = object_property.UnvalidatedObjectProperty()
 
@@ -711,80 +768,137 @@ class UserExerciseCache(db.Model):
         return "UserExerciseCache:%s" % user_data.key_email
 
     @staticmethod
-    def get(user_data_or_list):
+    def get(user_data_or_list, coach=None,
+            read_policy=db.EVENTUAL_CONSISTENCY):
+        """Get the caches of a user or list of users, regenerating any that
+        are missing.
+
+        coach is the coach whose students user_data_or_list are, if they're
+        being loaded for one of their reports. If many caches are missing,
+        all of the coach's students' caches are regenerated in the
+        background.
+
+        read_policy can be db.STRONG_CONSISTENCY for callers that need the
+        caches to reflect the users' latest activity.
+        """
         if not user_data_or_list:
             raise Exception("Must provide UserData when loading UserExerciseCache")
 
         # We can grab a single UserExerciseCache or do an optimized grab of a bunch of 'em
         user_data_list = user_data_or_list if type(user_data_or_list) == list else [user_data_or_list]
 
-        # Try to get 'em all by key name
+        user_exercise_caches, missing_cache_indices, estimates = (
+                UserExerciseCache._get_existing(user_data_list, read_policy))
+
+        if missing_cache_indices:
+            regenerated = []
+            for i, user_exercise_cache in UserExerciseCache._regenerate(
+                    [user_data_list[i] for i in missing_cache_indices],
+                    estimates):
+                user_index = missing_cache_indices[i]
+                user_exercise_caches[user_index] = user_exercise_cache
+                regenerated.append(user_exercise_cache)
+
+            # Cache all of them, so the next request doesn't regenerate the
+            # same ones again. The put has to finish before they're
+            # returned, or it could overwrite a cache the caller updates
+            # and puts.
+            put_rpc = db.put_async(regenerated)
+
+            if (coach and len(missing_cache_indices) >=
+                    UserExerciseCache.COLD_REPORT_MISSING_CACHES):
+                _schedule_user_exercise_cache_warm_up(coach)
+
+            try:
+                put_rpc.get_result()
+            except db.Error, e:
+                logging.warning("Couldn't put %s regenerated "
+                                "UserExerciseCaches: %s" %
+                                (len(regenerated), e))
+
+        if not user_exercise_caches:
+            return []
+
+        # Return list of caches if a list was passed in,
+        # otherwise return single cache
+        return user_exercise_caches if type(user_data_or_list) == list else user_exercise_caches[0]
+
+    @staticmethod
+    def _get_existing(user_data_list, read_policy=db.EVENTUAL_CONSISTENCY):
+        """Get the users' caches by key name.
+
+        Returns the list of caches, with None for those that are missing or
+        out of date, the indices of those, and an estimate of how many
+        UserExercises each of those users has.
+        """
         user_exercise_caches = UserExerciseCache.get_by_key_name(
                 map(
                     lambda user_data: UserExerciseCache.key_for_user_data(user_data),
                     user_data_list),
-                config=db.create_config(read_policy=db.EVENTUAL_CONSISTENCY)
+                config=db.create_config(read_policy=read_policy)
                 )
 
-        # For any that are missing or are out of date,
-        # build up asynchronous queries to repopulate their data
-        async_queries = []
         missing_cache_indices = []
+        estimates = []
         for i, user_exercise_cache in enumerate(user_exercise_caches):
             if not user_exercise_cache or user_exercise_cache.version != UserExerciseCache.CURRENT_VERSION:
-                # Null out the reference so the gc can collect, in case it's
-                # a stale version, since we're going to rebuild it below.
-                user_exercise_caches[i] = None
-
                 # This user's cached graph is missing or out-of-date,
                 # put it in the list of graphs to be regenerated.
-                async_queries.append(UserExercise.get_for_user_data(user_data_list[i]))
                 missing_cache_indices.append(i)
+                estimates.append(UserExerciseCache._estimate_user_exercises(
+                        user_data_list[i], user_exercise_cache))
 
-        if len(async_queries) > 0:
-            caches_to_put = []
-
-            # Run the async queries in batches to avoid exceeding memory limits.
-            # Some coaches can have lots of active students, and their user
-            # exercise information is too much for app engine instances.
-            BATCH_SIZE = 5
-            for i in range(0, len(async_queries), BATCH_SIZE):
-                tasks = util.async_queries(async_queries[i:i + BATCH_SIZE])
-
-                # Populate the missing graphs w/ results from async queries
-                for j, task in enumerate(tasks):
-                    user_index = missing_cache_indices[i + j]
-                    user_data = user_data_list[user_index]
-                    user_exercises = task.get_result()
-
-                    user_exercise_cache = UserExerciseCache.generate(user_data, user_exercises)
-                    user_exercise_caches[user_index] = user_exercise_cache
-
-                    if len(caches_to_put) < 10:
-                        # We only put 10 at a time in case a teacher views a report w/ tons and tons of uncached students
-                        caches_to_put.append(user_exercise_cache)
-
-            # Null out references explicitly for GC.
-            tasks = None
-            async_queries = None
+                # Null out the reference so the gc can collect, in case it's
+                # a stale version, since we're going to rebuild it below.
+                user_exercise_caches[i] = None
 
-            if len(caches_to_put) > 0:
-                # Fire off an asynchronous put to cache the missing results. On the production server,
-                # we don't wait for the put to finish before dealing w/ the rest of the request
-                # because we don't really care if the cache misses.
-                future_put = db.put_async(caches_to_put)
+        return user_exercise_caches, missing_cache_indices, estimates
 
-                if app.App.is_dev_server:
-                    # On the dev server, we have to explicitly wait for get_result in order to
-                    # trigger the put (not truly asynchronous).
-                    future_put.get_result()
+    @staticmethod
+    def _estimate_user_exercises(user_data, stale_cache):
+        """Guess how many UserExercises the user has."""
+        if stale_cache and stale_cache.dicts:
+            # An out of date cache still has a dict per UserExercise
+            return len(stale_cache.dicts)
 
-        if not user_exercise_caches:
-            return []
+        # Users have started more exercises than they're proficient at
+        return max(UserExerciseCache.DEFAULT_USER_EXERCISE_ESTIMATE,
+                   2 * len(user_data.all_proficient_exercises))
 
-        # Return list of caches if a list was passed in,
-        # otherwise return single cache
-        return user_exercise_caches if type(user_data_or_list) == list else user_exercise_caches[0]
+    @staticmethod
+    def _regenerate(user_data_list, estimates):
+        """Generate the users' caches from their UserExercises.
+
+        Their queries run concurrently, as many at once as fit in
+        REGENERATE_USER_EXERCISE_BUDGET estimated UserExercises, starting
+        more as earlier ones finish. Yields the index of each user and their
+        cache as soon as its query has finished, in the order they were
+        given, so only the UserExercises of the queries still running are
+        held in memory.
+        """
+        running = collections.deque()
+        running_estimate = 0
+        next_index = 0
+
+        while next_index < len(user_data_list) or running:
+            while (next_index < len(user_data_list) and
+                   len(running) < UserExerciseCache.REGENERATE_MAX_QUERIES and
+                   (not running or
+                    running_estimate + estimates[next_index] <=
+                        UserExerciseCache.REGENERATE_USER_EXERCISE_BUDGET)):
+                query = UserExercise.get_for_user_data(
+                        user_data_list[next_index])
+                # Fetch all of them in as few batches as we can
+                batch_size = min(max(estimates[next_index], 20), 500)
+                running.append(
+                        (next_index, query.run(batch_size=batch_size)))
+                running_estimate += estimates[next_index]
+                next_index += 1
+
+            i, user_exercises = running.popleft()
+            running_estimate -= estimates[i]
+            yield i, UserExerciseCache.generate(user_data_list[i],
+                                                list(user_exercises))
 
     @staticmethod
     def dict_from_user_exercise(user_exercise, struggling_model=None):
@@ -804,7 +918,7 @@ class UserExerciseCache(db.Model):
     @staticmethod
     def generate(user_data, user_exercises=None):
 
-        if not user_exercises:
+        if user_exercises is None:
             user_exercises = UserExercise.get_for_user_data(user_data)
 
         current_user = user_models.UserData.current()
@@ -835,19 +949,199 @@ class UserExerciseCache(db.Model):
             )
 
 
+def _put_regenerated_user_exercise_caches(user_exercise_caches):
+    """Put caches that a warm-up regenerated, unless they've
+    been put since, as when their users have done a problem.
+    """
+    existing = db.get([c.key() for c in user_exercise_caches])
+    missing = [c for (c, existing_cache) in
+               itertools.izip(user_exercise_caches, existing)
+               if not existing_cache or
+                   existing_cache.version != UserExerciseCache.CURRENT_VERSION]
+    if missing:
+        db.put(missing)
+
+
+def _schedule_user_exercise_cache_warm_up(coach):
+    if not coach:
+        return
+
+    if not memcache.add(
+            "user_exercise_cache_warm_up:%s" % coach.key_email, True,
+            time=UserExerciseCache.WARM_UP_INTERVAL_SECONDS):
+        return
+
+    # Let the report that found them missing finish first
+    deferred.defer(warm_up_user_exercise_caches, coach.user_id,
+                   _countdown=60,
+                   _queue="slow-background-queue")
+
+
+def warm_up_user_exercise_caches(coach_user_id):
+    """Regenerate the missing caches of all of a coach's students.
+
+    Scheduled when one of the coach's reports finds many of them missing,
+    so their other reports and lists don't have to.
+    """
+    coach = user_models.UserData.get_from_user_id(coach_user_id)
+    if not coach:
+        return
+
+    students = coach.get_students_data()
+    for i in xrange(0, len(students), UserExerciseCache.WARM_UP_BATCH_SIZE):
+        user_data_list = students[i:i + UserExerciseCache.WARM_UP_BATCH_SIZE]
+        _, missing_cache_indices, estimates = (
+                UserExerciseCache._get_existing(user_data_list))
+        if not missing_cache_indices:
+            continue
+
+        missing_user_data = [user_data_list[j] for j in missing_cache_indices]
+        regenerated = [user_exercise_cache for (index, user_exercise_cache) in
+                       UserExerciseCache._regenerate(missing_user_data,
+                                                     estimates)]
+        _put_regenerated_user_exercise_caches(regenerated)
+
+
+class ExerciseTopology(object):
+    """The user-independent structure of the exercise graph.
+
+    Exercises are numbered 0..n-1 in the order they were given. For each
+    exercise this holds its static dict (see
+    UserExerciseGraph.dict_from_exercise) and, as tuples of those numbers,
+    the exercises that cover it, that it covers and that are its
+    prerequisites. It also precomputes two orderings:
+
+    cover_order: every exercise after all of the exercises covering it, so
+        state that flows down from coverers can be computed in one pass.
+    position_order: exercises sorted by knowledge map position, which is
+        the order UserExerciseGraph.graph_dicts returns.
+
+    It's built once per set of exercises and shared by every graph in the
+    process, so it must be treated as read-only.
+    """
+    def __init__(self, exercise_dicts):
+        self.exercise_dicts = []
+        self.index = {}
+        for exercise_dict in exercise_dicts:
+            name = exercise_dict["name"]
+            if name not in self.index:
+                self.index[name] = len(self.exercise_dicts)
+                self.exercise_dicts.append(exercise_dict)
+
+        self.names = [d["name"] for d in self.exercise_dicts]
+        count = len(self.names)
+
+        coverers = [[] for _ in xrange(count)]
+        covered = [[] for _ in xrange(count)]
+        for i, exercise_dict in enumerate(self.exercise_dicts):
+            for covered_name in exercise_dict["covers"]:
+                j = self.index.get(covered_name)
+                if j is not None:
+                    coverers[j].append(i)
+                    covered[i].append(j)
+
+        self.coverer_indices = [tuple(c) for c in coverers]
+        self.covered_indices = [tuple(c) for c in covered]
+        self.prerequisite_indices = [
+                tuple(self.index[prerequisite["name"]]
+                      for prerequisite in exercise_dict["prerequisites"]
+                      if prerequisite["name"] in self.index)
+                for exercise_dict in self.exercise_dicts]
+
+        self.cover_order = self._topological_order()
+        self.cover_rank = [0] * count
+        for rank, i in enumerate(self.cover_order):
+            self.cover_rank[i] = rank
+
+        self.position_order = sorted(
+                xrange(count),
+                key=lambda i: (self.exercise_dicts[i]["h_position"],
+                               self.exercise_dicts[i]["v_position"]))
+
+        self._covered_closures = {}
+
+    def _topological_order(self):
+        """Order exercises so that coverers come before what they cover."""
+        count = len(self.names)
+        uncovered_count = [len(c) for c in self.coverer_indices]
+        order = [i for i in xrange(count) if not uncovered_count[i]]
+        pos = 0
+        while pos < len(order):
+            for j in self.covered_indices[order[pos]]:
+                uncovered_count[j] -= 1
+                if not uncovered_count[j]:
+                    order.append(j)
+            pos += 1
+
+        if len(order) < count:
+            # Cover cycles shouldn't exist, but don't lose exercises if they
+            # do. Their coverers in the cycle just count as not yet computed.
+            logging.warning("Exercise covers contain a cycle")
+            seen = set(order)
+            order.extend(i for i in xrange(count) if i not in seen)
+
+        return order
+
+    def covered_closure(self, exercise_name):
+        """Return the indices of exercise_name and every exercise it
+        transitively covers.
+
+        These are the exercises whose implicit proficiency can change when
+        exercise_name's data changes.
+        """
+        closure = self._covered_closures.get(exercise_name)
+        if closure is None:
+            closure = set()
+            stack = [self.index[exercise_name]]
+            while stack:
+                i = stack.pop()
+                if i not in closure:
+                    closure.add(i)
+                    stack.extend(self.covered_indices[i])
+            closure = frozenset(closure)
+            self._covered_closures[exercise_name] = closure
+        return closure
+
+    @staticmethod
+    def get(exercises_allowed=None):
+        if exercises_allowed:
+            return ExerciseTopology(
+                    map(UserExerciseGraph.dict_from_exercise,
+                        exercises_allowed))
+        return ExerciseTopology._get_for_all_exercises(
+                user_util.is_current_user_developer())
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(
+        lambda is_developer: "exercise_topology_%s_%s" % (
+            setting_model.Setting.cached_exercises_date(), is_developer),
+        layer=layer_cache.Layers.InAppMemory)
+    def _get_for_all_exercises(is_developer):
+        # Exercise.get_all_use_cache picks the exercises based on whether the
+        # current user is a developer, is_developer is here for the cache key.
+        return ExerciseTopology(UserExerciseGraph.exercise_dicts())
+
+
 class UserExerciseGraph(object):
-    """All the UserExercise data for a single user."""
-    def __init__(self, graph={}, cache=None):
-        self.graph = graph
+    """All the UserExercise data for a single user.
+
+    graph maps exercise names to the user's graph dicts, and graph_dict_list
+    holds the same dicts indexed by their number in the shared topology.
+    """
+    def __init__(self, graph_dict_list, cache, topology, user_data):
+        self.graph_dict_list = graph_dict_list
+        self.graph = dict((graph_dict["name"], graph_dict)
+                          for graph_dict in graph_dict_list)
         self.cache = cache
+        self.topology = topology
+        self.user_data = user_data
 
     def graph_dict(self, exercise_name):
         return self.graph.get(exercise_name)
 
     def graph_dicts(self):
-        return sorted(sorted(self.graph.values(),
-                             key=lambda graph_dict: graph_dict["v_position"]),
-                             key=lambda graph_dict: graph_dict["h_position"])
+        graph_dict_list = self.graph_dict_list
+        return [graph_dict_list[i] for i in self.topology.position_order]
 
     def proficient_exercise_names(self):
         return [graph_dict["name"] for graph_dict in self.proficient_graph_dicts()]
@@ -885,8 +1179,7 @@ class UserExerciseGraph(object):
                 key=lambda graph_dict: graph_dict["last_done"],
                 )[0:n_recent]
 
-    @staticmethod
-    def mark_reviewing(graph):
+    def mark_reviewing(self):
         """ Mark to-be-reviewed exercise dicts as reviewing, which is used by the knowledge map
         and the profile page.
         """
@@ -899,70 +1192,62 @@ class UserExerciseGraph(object):
         #     previously incorrectly answered (ex.streak == 0)
         #   * the user is proficient at ex
         # the algorithm:
-        #   for each exercise:
-        #     traverse it's ancestors, computing and storing the next review time (if not already done),
+        #   for each exercise, coverers first:
+        #     compute its next review time from its own schedule and its
+        #     coverers' (already computed) next review times,
         #     using now as the next review time if proficient and streak==0
         #   select and mark the exercises in which the user is proficient but with next review times in the past as review candidates
-        #   for each of those candidates:
-        #     traverse it's ancestors, computing and storing whether an ancestor is also a candidate
+        #   for each exercise, coverers first:
+        #     it has a candidate ancestor if any coverer is a candidate or has one
         #   all exercises that are candidates but do not have ancestors as
         #   candidates should be listed for review. Covering ancestors are not
         #   considered for incorrectly answered review questions
         #   (streak == 0 and proficient).
 
         now = datetime.datetime.now()
-
-        def compute_next_review(graph_dict):
-            if graph_dict.get("next_review") is None:
-                graph_dict["next_review"] = datetime.datetime.min
-
-                if graph_dict["total_done"] > 0 and graph_dict["last_review"] and graph_dict["last_review"] > datetime.datetime.min:
-                    next_review = graph_dict["last_review"] + UserExercise.get_review_interval_from_seconds(graph_dict["review_interval_secs"])
-
-                    if next_review > now and graph_dict["proficient"] and graph_dict["streak"] == 0:
-                        next_review = now
-
-                    if next_review > graph_dict["next_review"]:
-                        graph_dict["next_review"] = next_review
-
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    covering_next_review = compute_next_review(covering_graph_dict)
-                    if (covering_next_review > graph_dict["next_review"] and
-                            graph_dict["streak"] != 0):
-                        graph_dict["next_review"] = covering_next_review
-
-            return graph_dict["next_review"]
-
-        def compute_is_ancestor_review_candidate(graph_dict):
-            if graph_dict.get("is_ancestor_review_candidate") is None:
-
-                graph_dict["is_ancestor_review_candidate"] = False
-
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    graph_dict["is_ancestor_review_candidate"] = (graph_dict["is_ancestor_review_candidate"] or
-                            covering_graph_dict["is_review_candidate"] or
-                            compute_is_ancestor_review_candidate(covering_graph_dict))
-
-            return graph_dict["is_ancestor_review_candidate"]
-
-        for graph_dict in graph.values():
-            graph_dict["reviewing"] = False # Assume false at first
-            compute_next_review(graph_dict)
-
-        candidate_dicts = []
-        for graph_dict in graph.values():
-            if (graph_dict["proficient"] and
-                    graph_dict["next_review"] <= now and
-                    graph_dict["total_done"] > 0):
-                graph_dict["is_review_candidate"] = True
-                candidate_dicts.append(graph_dict)
-            else:
-                graph_dict["is_review_candidate"] = False
-
-        for graph_dict in candidate_dicts:
-            if (not compute_is_ancestor_review_candidate(graph_dict) or
-                    graph_dict["streak"] == 0):
-                graph_dict["reviewing"] = True
+        graph_dict_list = self.graph_dict_list
+        coverer_indices = self.topology.coverer_indices
+        cover_order = self.topology.cover_order
+
+        next_reviews = [datetime.datetime.min] * len(graph_dict_list)
+        for i in cover_order:
+            graph_dict = graph_dict_list[i]
+            next_review = datetime.datetime.min
+
+            if graph_dict["total_done"] > 0 and graph_dict["last_review"] and graph_dict["last_review"] > datetime.datetime.min:
+                scheduled_review = graph_dict["last_review"] + UserExercise.get_review_interval_from_seconds(graph_dict["review_interval_secs"])
+
+                if scheduled_review > now and graph_dict["proficient"] and graph_dict["streak"] == 0:
+                    scheduled_review = now
+
+                if scheduled_review > next_review:
+                    next_review = scheduled_review
+
+            if graph_dict["streak"] != 0:
+                for j in coverer_indices[i]:
+                    if next_reviews[j] > next_review:
+                        next_review = next_reviews[j]
+
+            next_reviews[i] = next_review
+            graph_dict["next_review"] = next_review
+
+        is_candidate = [False] * len(graph_dict_list)
+        has_candidate_ancestor = [False] * len(graph_dict_list)
+        for i in cover_order:
+            graph_dict = graph_dict_list[i]
+            is_candidate[i] = bool(graph_dict["proficient"] and
+                    next_reviews[i] <= now and
+                    graph_dict["total_done"] > 0)
+
+            for j in coverer_indices[i]:
+                if is_candidate[j] or has_candidate_ancestor[j]:
+                    has_candidate_ancestor[i] = True
+                    break
+
+            graph_dict["is_review_candidate"] = is_candidate[i]
+            graph_dict["is_ancestor_review_candidate"] = has_candidate_ancestor[i]
+            graph_dict["reviewing"] = is_candidate[i] and (
+                    not has_candidate_ancestor[i] or graph_dict["streak"] == 0)
 
     def states(self, exercise_name):
         graph_dict = self.graph_dict(exercise_name)
@@ -979,23 +1264,31 @@ class UserExerciseGraph(object):
         return UserExerciseGraph.get(user_models.UserData.current())
 
     @staticmethod
-    def get(user_data_or_list, exercises_allowed=None):
+    def get(user_data_or_list, exercises_allowed=None, coach=None,
+            read_policy=db.EVENTUAL_CONSISTENCY):
         if not user_data_or_list:
             return [] if type(user_data_or_list) == list else None
 
         # We can grab a single UserExerciseGraph or do an optimized grab of a bunch of 'em
         user_data_list = user_data_or_list if type(user_data_or_list) == list else [user_data_or_list]
-        user_exercise_cache_list = UserExerciseCache.get(user_data_list)
+        user_exercise_cache_list = UserExerciseCache.get(
+                user_data_list, coach=coach, read_policy=read_policy)
 
         if not user_exercise_cache_list:
             return [] if type(user_data_or_list) == list else None
 
-        exercise_dicts = UserExerciseGraph.exercise_dicts(exercises_allowed)
+        topology = ExerciseTopology.get(exercises_allowed)
 
         user_exercise_graphs = map(
-                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, exercise_dicts),
+                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, topology),
                 itertools.izip(user_data_list, user_exercise_cache_list))
 
+        if type(user_data_or_list) != list and not exercises_allowed:
+            # Let get_and_update later in this request build on this graph
+            request_cache.set(
+                    UserExerciseGraph._request_cache_key(user_data_or_list),
+                    user_exercise_graphs[0])
+
         # Return list of graphs if a list was passed in,
         # otherwise return single graph
         return user_exercise_graphs if type(user_data_or_list) == list else user_exercise_graphs[0]
@@ -1024,62 +1317,94 @@ class UserExerciseGraph(object):
         )
 
     @staticmethod
-    def get_and_update(user_data, user_exercise):
-        user_exercise_cache = UserExerciseCache.get(user_data)
-        user_exercise_cache.update(user_exercise)
-        return UserExerciseGraph.generate(user_data, user_exercise_cache, UserExerciseGraph.exercise_dicts())
+    def _request_cache_key(user_data):
+        return "UserExerciseGraph:%s" % user_data.key_email
 
     @staticmethod
-    def get_boundary_names(graph):
-        """ Return the names of the exercises that succeed
-        the student's proficient exercises.
-        """
-        all_exercises_dict = {}
-
-        def is_boundary(graph_dict):
-            name = graph_dict["name"]
-
-            if name in all_exercises_dict:
-                return all_exercises_dict[name]
-
-            # Don't suggest already-proficient exercises
-            if graph_dict["proficient"]:
-                all_exercises_dict.update({name: False})
-                return False
+    def get_and_update(user_data, user_exercise):
+        topology = ExerciseTopology.get()
+        key = UserExerciseGraph._request_cache_key(user_data)
+
+        user_exercise_graph = request_cache.get(key)
+        if (user_exercise_graph is not None and
+                user_exercise_graph.topology is topology):
+            # We already built this user's graph during this request, so only
+            # recompute what this UserExercise can have changed.
+            user_exercise_graph.update(user_data, user_exercise)
+        else:
+            user_exercise_cache = UserExerciseCache.get(user_data)
+            user_exercise_cache.update(user_exercise)
+            user_exercise_graph = UserExerciseGraph.generate(
+                    user_data, user_exercise_cache, topology)
 
-            # First, assume we're suggesting this exercise
-            is_suggested = True
+        request_cache.set(key, user_exercise_graph)
+        return user_exercise_graph
 
-            # Don't suggest exercises that are covered by other suggested exercises
-            for covering_graph_dict in graph_dict["coverer_dicts"]:
-                if is_boundary(covering_graph_dict):
-                    all_exercises_dict.update({name: False})
-                    return False
+    def update(self, user_data, user_exercise):
+        """Bring the graph up to date after user_exercise has changed.
 
-            # Don't suggest exercises if the user isn't proficient in all prerequisites
-            for prerequisite_graph_dict in graph_dict["prerequisite_dicts"]:
-                if not prerequisite_graph_dict["proficient"]:
-                    all_exercises_dict.update({name: False})
-                    return False
+        Only the changed exercise and those it covers, directly or not, have
+        their proficiency recomputed, as do any exercises whose explicit
+        proficiency in user_data has changed. Suggestions and reviews are
+        then re-marked, which are single passes over the graph.
+        """
+        self.cache.update(user_exercise)
+        self.user_data = user_data
+        topology = self.topology
+
+        changed_names = set()
+        if user_exercise.exercise in topology.index:
+            changed_names.add(user_exercise.exercise)
+
+        explicitly_proficient_names = set(user_data.proficient_exercises)
+        for graph_dict in self.graph_dict_list:
+            if (bool(graph_dict["explicitly_proficient"]) !=
+                    (graph_dict["name"] in explicitly_proficient_names)):
+                changed_names.add(graph_dict["name"])
+
+        affected = set()
+        for name in changed_names:
+            affected.update(topology.covered_closure(name))
+
+        for i in affected:
+            graph_dict = self.graph_dict_list[i]
+            graph_dict.update(self.cache.user_exercise_dict(graph_dict["name"]))
+            is_explicit = graph_dict["name"] in explicitly_proficient_names
+            graph_dict["proficient"] = True if is_explicit else None
+            graph_dict["explicitly_proficient"] = True if is_explicit else None
+
+        self._set_implicit_proficiencies(
+                sorted(affected, key=topology.cover_rank.__getitem__))
+        self.mark_suggested()
+        self.mark_reviewing()
+
+    def get_boundary_names(self):
+        """ Return the names of the exercises that succeed
+        the student's proficient exercises.
+        """
+        graph_dict_list = self.graph_dict_list
+        topology = self.topology
 
-            all_exercises_dict.update({name: True})
-            return True
+        # An exercise is on the boundary if it isn't proficient, isn't covered
+        # by another boundary exercise and all its prerequisites are
+        # proficient. Coverers come first in cover_order so they are decided
+        # by the time we need them.
+        is_boundary = [False] * len(graph_dict_list)
+        for i in topology.cover_order:
+            if graph_dict_list[i]["proficient"]:
+                continue
 
-        boundary_graph_dicts = []
-        for exercise_name in graph:
-            graph_dict = graph[exercise_name]
-            if graph_dict["live"] and is_boundary(graph_dict):
-                boundary_graph_dicts.append(graph_dict)
+            if any(is_boundary[j] for j in topology.coverer_indices[i]):
+                continue
 
-        boundary_graph_dicts = sorted(sorted(boundary_graph_dicts,
-                             key=lambda graph_dict: graph_dict["v_position"]),
-                             key=lambda graph_dict: graph_dict["h_position"])
+            is_boundary[i] = all(graph_dict_list[j]["proficient"]
+                                 for j in topology.prerequisite_indices[i])
 
-        return [graph_dict["name"]
-                    for graph_dict in boundary_graph_dicts]
+        return [graph_dict_list[i]["name"]
+                for i in topology.position_order
+                if is_boundary[i] and graph_dict_list[i]["live"]]
 
-    @staticmethod
-    def get_attempted_names(graph):
+    def get_attempted_names(self):
         """ Return the names of the exercises that the student has attempted.
 
         Exact details, such as the threshold that marks a real attempt
@@ -1091,7 +1416,7 @@ class UserExerciseGraph(object):
                                     lambda graph_dict:
                                         (graph_dict["progress"] > progress_threshold
                                             and not graph_dict["proficient"]),
-                                    graph.values())
+                                    self.graph_dict_list)
 
         attempted_graph_dicts = sorted(attempted_graph_dicts,
                             reverse=True,
@@ -1099,8 +1424,7 @@ class UserExerciseGraph(object):
 
         return [graph_dict["name"] for graph_dict in attempted_graph_dicts]
 
-    @staticmethod
-    def mark_suggested(graph):
+    def mark_suggested(self):
         """ Mark 5 exercises as suggested, which are used by the knowledge map
         and the profile page.
 
@@ -1112,87 +1436,62 @@ class UserExerciseGraph(object):
         sorted by knowledge map position. We might want to change that.
         """
         num_to_suggest = 5
-        suggested_names = UserExerciseGraph.get_attempted_names(graph)
+        suggested_names = self.get_attempted_names()
 
         if len(suggested_names) < num_to_suggest:
-            boundary_names = UserExerciseGraph.get_boundary_names(graph)
+            boundary_names = self.get_boundary_names()
             suggested_names.extend(boundary_names)
 
-        suggested_names = suggested_names[:num_to_suggest]
-
-        for exercise_name in graph:
-            is_suggested = exercise_name in suggested_names
-            graph[exercise_name]["suggested"] = is_suggested
+        suggested_names = set(suggested_names[:num_to_suggest])
 
-    @staticmethod
-    def generate(user_data, user_exercise_cache, exercise_dicts):
+        for graph_dict in self.graph_dict_list:
+            graph_dict["suggested"] = graph_dict["name"] in suggested_names
 
-        graph = {}
+    def _set_implicit_proficiencies(self, indices):
+        """Fill in proficient for the exercises at indices, which must be in
+        cover_order, leaving explicitly proficient ones alone.
+        """
+        graph_dict_list = self.graph_dict_list
+        coverer_indices = self.topology.coverer_indices
 
-        # Build up base of graph
-        for exercise_dict in exercise_dicts:
+        for i in indices:
+            graph_dict = graph_dict_list[i]
+            if graph_dict["proficient"] is not None:
+                continue
 
-            user_exercise_dict = user_exercise_cache.user_exercise_dict(exercise_dict["name"])
+            # Consider an exercise implicitly proficient if the user has
+            # never missed a problem and a covering ancestor is proficient
+            graph_dict["proficient"] = bool(
+                    graph_dict["streak"] == graph_dict["total_done"] and
+                    any(graph_dict_list[j]["proficient"]
+                        for j in coverer_indices[i]))
 
-            graph_dict = {}
+    @staticmethod
+    def generate(user_data, user_exercise_cache, topology):
 
-            graph_dict.update(user_exercise_dict)
+        # Build up base of graph, one dict per exercise in the topology
+        graph_dict_list = []
+        for exercise_dict in topology.exercise_dicts:
+            graph_dict = user_exercise_cache.user_exercise_dict(exercise_dict["name"]).copy()
             graph_dict.update(exercise_dict)
-            graph_dict.update({
-                "coverer_dicts": [],
-                "prerequisite_dicts": [],
-            })
+            graph_dict_list.append(graph_dict)
 
-            # In case user has multiple UserExercise mappings for a specific exercise,
-            # always prefer the one w/ more problems done
-            if graph_dict["name"] not in graph or graph[graph_dict["name"]]["total_done"] < graph_dict["total_done"]:
-                graph[graph_dict["name"]] = graph_dict
-
-        # Cache coverers and prereqs for later
-        for graph_dict in graph.values():
-            # Cache coverers
-            for covered_exercise_name in graph_dict["covers"]:
-                covered_graph_dict = graph.get(covered_exercise_name)
-                if covered_graph_dict:
-                    covered_graph_dict["coverer_dicts"].append(graph_dict)
-
-            # Cache prereqs
-            for prerequisite_exercise_name in graph_dict["prerequisites"]:
-                prerequisite_graph_dict = graph.get(prerequisite_exercise_name["name"])
-                if prerequisite_graph_dict:
-                    graph_dict["prerequisite_dicts"].append(prerequisite_graph_dict)
+        user_exercise_graph = UserExerciseGraph(graph_dict_list,
+                                                user_exercise_cache,
+                                                topology, user_data)
 
         # Set explicit proficiencies
         for exercise_name in user_data.proficient_exercises:
-            graph_dict = graph.get(exercise_name)
-            if graph_dict:
-                graph_dict["proficient"] = graph_dict["explicitly_proficient"] = True
-
-        # Calculate implicit proficiencies
-        def set_implicit_proficiency(graph_dict):
-            if graph_dict["proficient"] is not None:
-                return graph_dict["proficient"]
-
-            graph_dict["proficient"] = False
-
-            # Consider an exercise implicitly proficient if the user has
-            # never missed a problem and a covering ancestor is proficient
-            if graph_dict["streak"] == graph_dict["total_done"]:
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    if set_implicit_proficiency(covering_graph_dict):
-                        graph_dict["proficient"] = True
-                        break
-
-            return graph_dict["proficient"]
-
-        for exercise_name in graph:
-            set_implicit_proficiency(graph[exercise_name])
+            i = topology.index.get(exercise_name)
+            if i is not None:
+                graph_dict_list[i]["proficient"] = graph_dict_list[i]["explicitly_proficient"] = True
 
-        # Calculate suggested and reviewing
-        UserExerciseGraph.mark_suggested(graph)
-        UserExerciseGraph.mark_reviewing(graph)
+        # Calculate implicit proficiencies, suggested and reviewing
+        user_exercise_graph._set_implicit_proficiencies(topology.cover_order)
+        user_exercise_graph.mark_suggested()
+        user_exercise_graph.mark_reviewing()
 
-        return UserExerciseGraph(graph=graph, cache=user_exercise_cache)
+        return user_exercise_graph
 
 
 class ProblemLog(backup_model.BackupModel):
@@ -1227,6 +1526,11 @@ class ProblemLog(backup_model.BackupModel):
     random_float = db.FloatProperty() # Add a random float in [0, 1) for easy random sampling
     ip_address = db.StringProperty(indexed=False)
 
+    # The commit_token of each attempt and hint merged into this log
+    commit_tokens = db.StringListProperty(indexed=False)
+
+    _serialize_blacklist = ["commit_tokens"]
+
     @classmethod
     def key_for(cls, user_data, exid, problem_number):
         return "problemlog_%s_%s_%s" % (user_data.key_email, exid,
@@ -1304,63 +1608,347 @@ class ProblemLog(backup_model.BackupModel):
     def minutes_spent(self):
         return util.minutes_between(self.time_started(), self.time_ended())
 
-# commit_problem_log is used by our deferred problem log insertion process
+    def is_hint(self):
+        return self.attempts[0] == "hint"
+
+    def commit_token(self):
+        """Identify the single attempt or hint this unsaved log records.
+
+        attempt_problem builds one of these logs for each attempt and hint,
+        to be merged into the problem's saved ProblemLog. Its token names its
+        place in the problem, so it's merged only once however many times
+        it's committed.
+        """
+        if self.is_hint():
+            return "hint:%s" % max(0, self.count_hints - 1)
+        return "attempt:%s" % max(0, self.count_attempts - 1)
+
+def queue_problem_log(problem_log_source):
+    """Queue an attempt or hint to be merged into its ProblemLog.
+
+    It waits in the outbox until commit_problem_logs commits it with the
+    other attempts and hints its user made in the meantime.
+    """
+    task = taskqueue.Task(payload=pickle_util.dump(problem_log_source),
+                          method="PULL",
+                          tag=problem_log_source.user_id)
+    taskqueue.Queue(PROBLEM_LOG_OUTBOX_QUEUE).add(task)
+
+    _schedule_problem_log_commit(problem_log_source.user_id)
+
+
+def _schedule_problem_log_commit(user_id):
+    window = int(time.time()) // PROBLEM_LOG_COMMIT_INTERVAL_SECONDS
+    window_key = "problem_log_commit:%s:%s" % (user_id, window)
+    if (not memcache.add(window_key, True,
+                         time=PROBLEM_LOG_COMMIT_INTERVAL_SECONDS * 2) and
+            memcache.get(window_key)):
+        return
+    # Otherwise memcache may be down, and the task name still dedupes it
+
+    # Task names can't hold all the characters user_ids can
+    task_name = "problem_log_commit_%s_%s" % (
+        hashlib.md5(user_id).hexdigest(), window)
+    try:
+        deferred.defer(commit_problem_logs, user_id,
+                       _name=task_name,
+                       _countdown=PROBLEM_LOG_COMMIT_INTERVAL_SECONDS,
+                       _queue=PROBLEM_LOG_QUEUE,
+                       _url="/_ah/queue/deferred_problemlog")
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info("deferred task %s already exists" % task_name)
+    except:
+        # Let the request's retry schedule it
+        memcache.delete(window_key)
+        raise
+
+
+class UncommittedProblemLog(db.Model):
+    """An attempt or hint that commit_problem_logs gave up committing.
+
+    payload is its pickled ProblemLog from the outbox, so once whatever
+    kept it from being committed is fixed it can be queued again with
+    queue_problem_log(pickle_util.load(payload)).
+    """
+    user_id = db.StringProperty()
+    problem_log_key_name = db.StringProperty(indexed=False)
+    commit_token = db.StringProperty(indexed=False)
+    leases = db.IntegerProperty(indexed=False)
+    payload = db.BlobProperty()
+    created_on = db.DateTimeProperty(auto_now_add=True)
+
+    @staticmethod
+    def key_for(problem_log_source):
+        """Keyed by attempt or hint, so a retried put doesn't duplicate it."""
+        return "%s:%s" % (problem_log_source.key().name(),
+                          problem_log_source.commit_token())
+
+    @staticmethod
+    def for_task(user_id, task, problem_log_source=None):
+        """The outbox task's payload as given up on, keyed by the task's
+        name if it couldn't be loaded.
+        """
+        if problem_log_source is None:
+            return UncommittedProblemLog(key_name=task.name,
+                                         user_id=user_id,
+                                         leases=task.retry_count,
+                                         payload=db.Blob(task.payload))
+
+        return UncommittedProblemLog(
+            key_name=UncommittedProblemLog.key_for(problem_log_source),
+            user_id=user_id,
+            problem_log_key_name=problem_log_source.key().name(),
+            commit_token=problem_log_source.commit_token(),
+            leases=task.retry_count,
+            payload=db.Blob(task.payload))
+
+
+class ProblemLogCommitError(Exception):
+    """Some attempts or hints couldn't be committed, so the task should
+    retry.
+    """
+    pass
+
+
+def commit_problem_logs(user_id):
+    """Merge the attempts and hints queued for a user into their ProblemLogs.
+
+    They're leased from the outbox in batches, and each ProblemLog a batch
+    touches is written once. Raises ProblemLogCommitError if any couldn't
+    be committed, so the task is retried once their leases run out.
+    """
+    queue = taskqueue.Queue(PROBLEM_LOG_OUTBOX_QUEUE)
+    committer = _ProblemLogCommitter(user_id)
+
+    while True:
+        tasks = queue.lease_tasks_by_tag(PROBLEM_LOG_LEASE_SECONDS,
+                                         PROBLEM_LOG_BATCH_SIZE,
+                                         tag=user_id)
+        if not tasks:
+            return
+
+        tasks_by_key_name = {}
+        done = []
+        uncommitted = {}
+        unloadable = 0
+        for task in tasks:
+            try:
+                source = pickle_util.load(task.payload)
+            except Exception, e:
+                logging.error("Couldn't load queued task %s: %s" %
+                              (task.name, e))
+                source = None
+
+            if task.retry_count > PROBLEM_LOG_MAX_LEASES:
+                logging.error("Giving up on %s after %s leases" %
+                              (task.name, task.retry_count))
+                uncommitted[task] = UncommittedProblemLog.for_task(
+                    user_id, task, source)
+            elif source is None:
+                # Leave it leased, to be retried and eventually given up on
+                unloadable += 1
+            elif not _should_commit(source):
+                done.append(task)
+            else:
+                tasks_by_key_name.setdefault(
+                    source.key().name(), []).append((task, source))
+
+        failed = unloadable
+        if uncommitted:
+            try:
+                db.put(uncommitted.values())
+            except db.Error, e:
+                logging.warning("Couldn't store uncommitted problem logs: %s"
+                                % e)
+                failed += len(uncommitted)
+            else:
+                done.extend(uncommitted)
+
+        for key_name, task_sources in tasks_by_key_name.iteritems():
+            try:
+                committer.commit(key_name,
+                                 [queued for _, queued in task_sources])
+            except db.Error, e:
+                logging.warning("Couldn't commit problem log %s: %s" %
+                                (key_name, e))
+                failed += len(task_sources)
+            else:
+                done.extend(task for task, _ in task_sources)
+
+        if done:
+            queue.delete_tasks(done)
+
+        if failed:
+            raise ProblemLogCommitError(
+                "%s of %s attempts and hints weren't committed" %
+                (failed, len(tasks)))
+
+
+# commit_problem_log is used by our deferred problem log insertion process,
+# and by attempt_problem when the problem log isn't put asynchronously
 def commit_problem_log(problem_log_source, user_data=None, async=True):
+    if _should_commit(problem_log_source):
+        _ProblemLogCommitter(problem_log_source.user_id,
+                             transactional=async).commit(
+            problem_log_source.key().name(), [problem_log_source])
+
+
+def _should_commit(problem_log_source):
     try:
         if not problem_log_source or not problem_log_source.key().name:
             logging.critical("Skipping problem log commit due to missing problem_log_source or key().name")
-            return
+            return False
     except db.NotSavedError:
         # Handle special case during new exercise deploy
         logging.critical("Skipping problem log commit due to db.NotSavedError")
-        return
+        return False
 
     if problem_log_source.count_attempts > 1000:
         logging.info("Ignoring attempt to write problem log w/ attempts over 1000.")
-        return
+        return False
 
-    #for TinCan
-    user_data = user_models.UserData.get_from_user_id(problem_log_source.user_id)
-    exercise = Exercise.get_by_name(problem_log_source.exercise)
-    if exercise == None:
-        logging.error("TinCan: Can't find exercise %s" % problem_log_source.exercise)
-    user_exercise = user_data.get_or_insert_exercise(exercise)
-    # Committing transaction combines existing problem log with any followup attempts
-    def txn():
-        problem_log = ProblemLog.get_by_key_name(problem_log_source.key().name())
-
-        if not problem_log:
-            problem_log = ProblemLog(
-                key_name = problem_log_source.key().name(),
-                user = problem_log_source.user,
-                user_id = problem_log_source.user_id,
-                exercise = problem_log_source.exercise,
-                problem_number = problem_log_source.problem_number,
-                time_done = problem_log_source.time_done,
-                sha1 = problem_log_source.sha1,
-                seed = problem_log_source.seed,
-                problem_type = problem_log_source.problem_type,
-                suggested = problem_log_source.suggested,
-                ip_address = problem_log_source.ip_address,
-                review_mode = problem_log_source.review_mode,
-                topic_mode = problem_log_source.topic_mode,
-        )
+    return True
+
+
+class _ProblemLogCommitter(object):
+    """Merges a user's attempts and hints into their ProblemLogs.
+
+    The user and the exercises and user exercises the TinCan statements
+    need are only looked up once, and only if the user's statements are
+    sent at all.
+    """
+    def __init__(self, user_id, transactional=True):
+        self.user_id = user_id
+        self.transactional = transactional
+        self._user_data = None
+        self._exercises = {}
+        self._user_exercises = {}
+
+    def commit(self, key_name, problem_log_sources):
+        """Merge attempts and hints of one problem into its ProblemLog.
+
+        The ProblemLog is written once, in a transaction unless the
+        committer isn't transactional, and only if anything new was merged.
+        """
+        def txn():
+            problem_log = ProblemLog.get_by_key_name(key_name)
+            if not problem_log:
+                problem_log = _new_problem_log(key_name,
+                                               problem_log_sources[0])
+
+            merged = _merge_problem_log(problem_log, problem_log_sources)
+            if merged:
+                problem_log.put()
+            return problem_log, merged
+
+        if self.transactional:
+            problem_log, merged = db.run_in_transaction(txn)
+        else:
+            problem_log, merged = txn()
+
+        # Outside the transaction, which can only add a few tasks
+        self._push_tincan_statements(problem_log, merged)
+
+    def _get_user_data(self):
+        if self._user_data is None:
+            self._user_data = user_models.UserData.get_from_user_id(
+                self.user_id)
+        return self._user_data
+
+    def _get_exercise(self, exercise_name):
+        if exercise_name not in self._exercises:
+            exercise = Exercise.get_by_name(exercise_name)
+            if exercise == None:
+                logging.error("TinCan: Can't find exercise %s" % exercise_name)
+            self._exercises[exercise_name] = exercise
+            self._user_exercises[exercise_name] = (
+                self._get_user_data().get_or_insert_exercise(exercise))
+        return self._exercises[exercise_name]
+
+    def _push_tincan_statements(self, problem_log, merged):
+        user_data = self._get_user_data()
+        if not merged or not user_data or not user_data.coach_project:
+            return
+
+        exercise = self._get_exercise(problem_log.exercise)
+        user_exercise = self._user_exercises[problem_log.exercise]
+
+        for problem_log_source in merged:
+            if not problem_log_source.is_hint():
+                TinCan.create_question(user_data, "answered", exercise, problem_log=problem_log_source)
+            else:
+                TinCan.create_question(user_data, "interacted", exercise, problem_log=problem_log)
+
+            # Only send progressed and completed events when exercise is not proficient and answer has been correct
+            if hasattr(problem_log_source, "explicitly_proficient") and \
+                not getattr(problem_log_source, "explicitly_proficient"):
+                if hasattr(problem_log_source, "completed") and getattr(problem_log_source, "completed"):
+                    TinCan.create_question(user_data, "progressed", exercise, user_exercise=user_exercise)
+                if user_exercise and user_exercise.progress >= 1.0:
+                    TinCan.create_question(user_data, "completed", exercise, problem_log=problem_log)
+
+
+def _new_problem_log(key_name, problem_log_source):
+    return ProblemLog(
+        key_name = key_name,
+        user = problem_log_source.user,
+        user_id = problem_log_source.user_id,
+        exercise = problem_log_source.exercise,
+        problem_number = problem_log_source.problem_number,
+        time_done = problem_log_source.time_done,
+        sha1 = problem_log_source.sha1,
+        seed = problem_log_source.seed,
+        problem_type = problem_log_source.problem_type,
+        suggested = problem_log_source.suggested,
+        ip_address = problem_log_source.ip_address,
+        review_mode = problem_log_source.review_mode,
+        topic_mode = problem_log_source.topic_mode,
+    )
+
+
+def _commit_tokens_from_lists(problem_log):
+    """Return the commit tokens of a log saved before it had any, from the
+    places of its attempts and hints in its lists.
+    """
+    tokens = ["attempt:%s" % i
+              for i, time_taken in enumerate(problem_log.time_taken_attempts)
+              if time_taken != -1]
+    tokens.extend("hint:%s" % i
+                  for i, time_taken in enumerate(problem_log.hint_time_taken_list)
+                  if time_taken != -1)
+    return tokens
+
+
+def _merge_problem_log(problem_log, problem_log_sources):
+    """Merge the attempts and hints in problem_log_sources into problem_log,
+    in the order they were made.
+
+    Returns those that were merged, skipping any that already had been.
+    """
+    if not problem_log.commit_tokens:
+        problem_log.commit_tokens = _commit_tokens_from_lists(problem_log)
+    committed = set(problem_log.commit_tokens)
+
+    merged = []
+    for problem_log_source in sorted(problem_log_sources,
+                                     key=lambda source: source.time_done):
+        token = problem_log_source.commit_token()
+        if token in committed:
+            # Already merged by an earlier commit of the same attempt or hint
+            logging.info("Skipping problem log commit of dupe %s, key.name: %s" %
+                         (token, problem_log.key().name()))
+            continue
+        committed.add(token)
+        problem_log.commit_tokens.append(token)
+        merged.append(problem_log_source)
 
         problem_log.count_hints = max(problem_log.count_hints, problem_log_source.count_hints)
         problem_log.hint_used = problem_log.count_hints > 0
-        index_attempt = max(0, problem_log_source.count_attempts - 1)
-
-        # Bump up attempt count
-        if problem_log_source.attempts[0] != "hint": # attempt
-            TinCan.create_question(user_data, "answered", exercise, problem_log=problem_log_source)
-            if index_attempt < len(problem_log.time_taken_attempts) \
-               and problem_log.time_taken_attempts[index_attempt] != -1:
-                # This attempt has already been logged. Ignore this dupe taskqueue execution.
-                logging.info("Skipping problem log commit due to dupe taskqueue\
-                    execution for attempt: %s, key.name: %s" % \
-                    (index_attempt, problem_log_source.key().name()))
-                return
 
+        if not problem_log_source.is_hint(): # attempt
+            index_attempt = max(0, problem_log_source.count_attempts - 1)
+
+            # Bump up attempt count
             problem_log.count_attempts += 1
 
             # Add time_taken for this individual attempt
@@ -1378,14 +1966,8 @@ def commit_problem_log(problem_log_source, user_data=None, async=True):
                 problem_log_source.earned_proficiency
 
         else: # hint
-            TinCan.create_question(user_data, "interacted", exercise, problem_log=problem_log)
             index_hint = max(0, problem_log_source.count_hints - 1)
 
-            if index_hint < len(problem_log.hint_time_taken_list) \
-               and problem_log.hint_time_taken_list[index_hint] != -1:
-                # This attempt has already been logged. Ignore this dupe taskqueue execution.
-                return
-
             # Add time taken for hint
             util.insert_in_position(index_hint,
                     problem_log.hint_time_taken_list,
@@ -1402,24 +1984,7 @@ def commit_problem_log(problem_log_source, user_data=None, async=True):
         # Correct cannot be changed from False to True after first attempt
         problem_log.correct = (problem_log_source.count_attempts == 1 or problem_log.correct) and problem_log_source.correct and not problem_log.count_hints
 
-
-        # Only send progressed and completed events when exercise is not proficient and answer has been correct
-        if hasattr(problem_log_source, "explicitly_proficient") and \
-            not getattr(problem_log_source, "explicitly_proficient"):
-            if hasattr(problem_log_source, "completed") and getattr(problem_log_source, "completed"):
-                TinCan.create_question(user_data, "progressed", exercise, user_exercise=user_exercise)
-            if user_exercise.progress >= 1.0:
-                TinCan.create_question(user_data, "completed", exercise, problem_log=problem_log)
-
-
-        logging.info(problem_log.time_ended())
-        problem_log.put()
-
-    #for testing purposes
-    if async:
-        db.run_in_transaction(txn)
-    else:
-        txn()
+    return merged
 
 
 # TODO(david): Tests. See how problem logs are tested.
@@ -3,12 +3,14 @@ from __future__ import with_statement
 import mock
 import datetime
 
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 
 import custom_exceptions
 import coaches
 import exercise_models
 import phantom_users.phantom_util
+import pickle_util
 from testutil import gae_model
 from testutil import mock_datetime
 from coach_resources.coach_request_model import CoachRequest
@@ -32,3 +34,391 @@ class ExerciseRequestVideoTest(gae_model.GAEModelTestCase):
         self.assertTrue(exs[0].video_requested)
         self.assertEqual(exs[0].video_requests_count, 1)
         #test v1.py
+
+
+class _FakeUserExerciseCache(object):
+    def __init__(self, dicts):
+        self.dicts = dicts
+
+    def user_exercise_dict(self, exercise_name):
+        return dict(self.dicts.get(exercise_name) or
+            exercise_models.UserExerciseCache.dict_from_user_exercise(None))
+
+    def update(self, user_exercise):
+        self.dicts[user_exercise.exercise] = user_exercise.cache_dict
+
+
+class _FakeUserExercise(object):
+    def __init__(self, exercise, **kwargs):
+        self.exercise = exercise
+        self.cache_dict = (
+            exercise_models.UserExerciseCache.dict_from_user_exercise(None))
+        self.cache_dict.update(kwargs)
+
+
+class _FakeUserData(object):
+    key_email = "graph@example.com"
+
+    def __init__(self, proficient_exercises):
+        self.proficient_exercises = proficient_exercises
+
+
+class UserExerciseGraphUpdateTest(gae_model.GAEModelTestCase):
+    """Check incremental updates agree with regenerating the graph."""
+
+    def setUp(self):
+        super(UserExerciseGraphUpdateTest, self).setUp()
+
+        def exercise_dict(name, covers=(), prerequisites=(), h_position=0):
+            return {
+                "id": 0, "name": name, "display_name": name,
+                "h_position": h_position, "v_position": 0,
+                "proficient": None, "explicitly_proficient": None,
+                "suggested": None, "live": True,
+                "covers": list(covers),
+                "prerequisites": [{"name": p, "display_name": p}
+                                  for p in prerequisites],
+            }
+
+        #  top covers middle covers bottom, and side needs bottom
+        self.topology = exercise_models.ExerciseTopology([
+            exercise_dict("top", covers=["middle"], h_position=3),
+            exercise_dict("middle", covers=["bottom"], h_position=2),
+            exercise_dict("bottom", h_position=1),
+            exercise_dict("side", prerequisites=["bottom"], h_position=4),
+        ])
+
+    def assert_same_states(self, expected, actual):
+        for name in expected.graph:
+            self.assertEqual(expected.states(name), actual.states(name), name)
+
+    def closure_names(self, exercise_name):
+        return set(self.topology.names[i]
+                   for i in self.topology.covered_closure(exercise_name))
+
+    def test_covered_closure(self):
+        self.assertEqual(set(["top", "middle", "bottom"]),
+                         self.closure_names("top"))
+        self.assertEqual(set(["side"]), self.closure_names("side"))
+
+    def test_cover_order_puts_coverers_first(self):
+        order = [self.topology.names[i] for i in self.topology.cover_order]
+        self.assertTrue(order.index("top") < order.index("middle") <
+                        order.index("bottom"))
+
+    def test_graph_dicts_are_in_position_order(self):
+        graph = exercise_models.UserExerciseGraph.generate(
+            _FakeUserData([]), _FakeUserExerciseCache({}), self.topology)
+        self.assertEqual(["bottom", "middle", "top", "side"],
+                         [d["name"] for d in graph.graph_dicts()])
+
+    def test_boundary_follows_proficiency(self):
+        graph = exercise_models.UserExerciseGraph.generate(
+            _FakeUserData([]), _FakeUserExerciseCache({}), self.topology)
+        # middle is covered by top, which is on the boundary, but bottom is
+        # only directly covered by middle. side needs bottom first.
+        self.assertEqual(["bottom", "top"], graph.get_boundary_names())
+
+        graph = exercise_models.UserExerciseGraph.generate(
+            _FakeUserData(["top"]), _FakeUserExerciseCache({}), self.topology)
+        self.assertEqual(["side"], graph.get_boundary_names())
+
+    def test_update_matches_generate_after_gaining_proficiency(self):
+        user_data = _FakeUserData([])
+        graph = exercise_models.UserExerciseGraph.generate(
+            user_data, _FakeUserExerciseCache({}), self.topology)
+        self.assertFalse(graph.graph_dict("middle")["proficient"])
+
+        user_exercise = _FakeUserExercise("top", streak=10, total_done=10,
+                                          progress=1.0)
+        user_data.proficient_exercises.append("top")
+        graph.update(user_data, user_exercise)
+
+        regenerated = exercise_models.UserExerciseGraph.generate(
+            user_data, _FakeUserExerciseCache({"top": user_exercise.cache_dict}),
+            self.topology)
+        self.assert_same_states(regenerated, graph)
+        # Covered exercises become implicitly proficient
+        self.assertTrue(graph.graph_dict("bottom")["proficient"])
+
+    def test_update_matches_generate_after_losing_proficiency(self):
+        done = _FakeUserExercise("middle", streak=10, total_done=10,
+                                 progress=1.0)
+        user_data = _FakeUserData(["middle"])
+        graph = exercise_models.UserExerciseGraph.generate(
+            user_data, _FakeUserExerciseCache({"middle": done.cache_dict}),
+            self.topology)
+        self.assertTrue(graph.graph_dict("bottom")["proficient"])
+
+        user_data.proficient_exercises.remove("middle")
+        missed = _FakeUserExercise("middle", streak=0, total_done=11,
+                                   progress=0.5)
+        graph.update(user_data, missed)
+
+        regenerated = exercise_models.UserExerciseGraph.generate(
+            user_data, _FakeUserExerciseCache({"middle": missed.cache_dict}),
+            self.topology)
+        self.assert_same_states(regenerated, graph)
+        self.assertFalse(graph.graph_dict("bottom")["proficient"])
+
+
+class ProblemLogCommitTest(gae_model.GAEModelTestCase):
+    user_id = "http://nouserid.khanacademy.org/student"
+
+    def setUp(self):
+        super(ProblemLogCommitTest, self).setUp()
+        self.time_done = datetime.datetime(2012, 6, 1)
+
+    def source(self, problem_number, attempt_number, count_hints,
+               attempt_content="42", correct=False, time_taken=10):
+        """Build the problem log attempt_problem makes for an attempt or
+        hint.
+        """
+        self.time_done += datetime.timedelta(seconds=time_taken)
+        return exercise_models.ProblemLog(
+            key_name="problemlog_student_addition_1_%s" % problem_number,
+            user_id=self.user_id,
+            exercise="addition_1",
+            problem_number=problem_number,
+            time_taken=time_taken,
+            time_done=self.time_done,
+            count_hints=count_hints,
+            correct=correct,
+            count_attempts=attempt_number,
+            attempts=[attempt_content])
+
+    def problem_log(self, problem_number):
+        return exercise_models.ProblemLog.get_by_key_name(
+            "problemlog_student_addition_1_%s" % problem_number)
+
+    def waiting(self):
+        taskqueue_stub = self.testbed.get_stub("taskqueue")
+        return len(taskqueue_stub.GetTasks(
+            exercise_models.PROBLEM_LOG_OUTBOX_QUEUE))
+
+    def test_merges_queued_attempts_and_hints(self):
+        exercise_models.queue_problem_log(self.source(1, 1, 0, "41"))
+        exercise_models.queue_problem_log(self.source(1, 1, 1, "hint"))
+        exercise_models.queue_problem_log(
+            self.source(1, 2, 1, "42", correct=True))
+        exercise_models.queue_problem_log(
+            self.source(2, 1, 0, "7", correct=True))
+        self.assertEqual(4, self.waiting())
+
+        with mock.patch.object(exercise_models.ProblemLog, "put",
+                               autospec=True,
+                               side_effect=exercise_models.ProblemLog.put
+                               ) as put:
+            exercise_models.commit_problem_logs(self.user_id)
+            self.assertEqual(2, put.call_count)
+        self.assertEqual(0, self.waiting())
+
+        problem_log = self.problem_log(1)
+        self.assertEqual(2, problem_log.count_attempts)
+        self.assertEqual(["41", "42"], problem_log.attempts)
+        self.assertEqual([10, 10], problem_log.time_taken_attempts)
+        self.assertEqual([1], problem_log.hint_after_attempt_list)
+        self.assertTrue(problem_log.hint_used)
+        self.assertFalse(problem_log.correct)
+        self.assertEqual(["attempt:0", "hint:0", "attempt:1"],
+                         problem_log.commit_tokens)
+
+        self.assertTrue(self.problem_log(2).correct)
+
+    def test_skips_committed_attempts(self):
+        attempt = self.source(1, 1, 0, "42", correct=True)
+        exercise_models.queue_problem_log(attempt)
+        exercise_models.queue_problem_log(attempt)
+        exercise_models.commit_problem_logs(self.user_id)
+        exercise_models.commit_problem_log(attempt)
+
+        problem_log = self.problem_log(1)
+        self.assertEqual(1, problem_log.count_attempts)
+        self.assertEqual(10, problem_log.time_taken)
+        self.assertEqual(["attempt:0"], problem_log.commit_tokens)
+
+    def test_skips_attempts_committed_before_tokens(self):
+        exercise_models.ProblemLog(
+            key_name="problemlog_student_addition_1_1",
+            user_id=self.user_id,
+            exercise="addition_1",
+            count_attempts=1,
+            time_taken=10,
+            time_taken_attempts=[10],
+            attempts=["41"]).put()
+
+        exercise_models.commit_problem_log(self.source(1, 1, 0, "41"))
+        exercise_models.commit_problem_log(self.source(1, 2, 0, "42"))
+
+        problem_log = self.problem_log(1)
+        self.assertEqual(2, problem_log.count_attempts)
+        self.assertEqual(["41", "42"], problem_log.attempts)
+        self.assertEqual(["attempt:0", "attempt:1"],
+                         problem_log.commit_tokens)
+
+    def test_moves_attempts_leased_too_often_out_of_outbox(self):
+        exercise_models.queue_problem_log(self.source(1, 1, 0, "41"))
+
+        with mock.patch.object(exercise_models, "PROBLEM_LOG_MAX_LEASES", -1):
+            exercise_models.commit_problem_logs(self.user_id)
+        self.assertEqual(0, self.waiting())
+        self.assertEqual(None, self.problem_log(1))
+
+        uncommitted = exercise_models.UncommittedProblemLog.get_by_key_name(
+            "problemlog_student_addition_1_1:attempt:0")
+        self.assertEqual(self.user_id, uncommitted.user_id)
+        self.assertEqual("attempt:0", uncommitted.commit_token)
+
+        # It can be queued again once it can be committed
+        exercise_models.queue_problem_log(
+            pickle_util.load(uncommitted.payload))
+        exercise_models.commit_problem_logs(self.user_id)
+        self.assertEqual(["41"], self.problem_log(1).attempts)
+
+    def test_moves_unloadable_attempts_out_of_outbox(self):
+        taskqueue.Queue(exercise_models.PROBLEM_LOG_OUTBOX_QUEUE).add(
+            taskqueue.Task(payload="not a pickle", method="PULL",
+                           tag=self.user_id, name="unloadable"))
+
+        self.assertRaises(exercise_models.ProblemLogCommitError,
+                          exercise_models.commit_problem_logs, self.user_id)
+        self.assertEqual(1, self.waiting())
+
+        with mock.patch.object(exercise_models, "PROBLEM_LOG_MAX_LEASES", -1):
+            exercise_models.commit_problem_logs(self.user_id)
+        self.assertEqual(0, self.waiting())
+
+        uncommitted = exercise_models.UncommittedProblemLog.get_by_key_name(
+            "unloadable")
+        self.assertEqual(self.user_id, uncommitted.user_id)
+        self.assertEqual("not a pickle", uncommitted.payload)
+
+    def test_schedules_commit_without_memcache(self):
+        with mock.patch.object(exercise_models.memcache, "add",
+                               return_value=False):
+            exercise_models.queue_problem_log(self.source(1, 1, 0, "41"))
+            exercise_models.queue_problem_log(self.source(1, 2, 0, "42"))
+
+        taskqueue_stub = self.testbed.get_stub("taskqueue")
+        self.assertEqual(1, len(taskqueue_stub.GetTasks(
+            exercise_models.PROBLEM_LOG_QUEUE)))
+
+
+class _FakeQuery(object):
+    """Records how many queries are running when each is started."""
+    running = 0
+    max_running = 0
+
+    def __init__(self, user_data):
+        self.user_data = user_data
+
+    def run(self, batch_size):
+        _FakeQuery.running += 1
+        _FakeQuery.max_running = max(_FakeQuery.max_running,
+                                     _FakeQuery.running)
+        return self
+
+    def __iter__(self):
+        _FakeQuery.running -= 1
+        return iter([self.user_data])
+
+
+class UserExerciseCacheRegenerateTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(UserExerciseCacheRegenerateTest, self).setUp()
+        _FakeQuery.running = _FakeQuery.max_running = 0
+        self.patchers = [
+            mock.patch.object(exercise_models.UserExercise,
+                              "get_for_user_data", _FakeQuery),
+            mock.patch.object(exercise_models.UserExerciseCache, "generate",
+                              staticmethod(lambda user_data, user_exercises:
+                                               (user_data, user_exercises))),
+            mock.patch.object(exercise_models.UserExerciseCache,
+                              "REGENERATE_USER_EXERCISE_BUDGET", 100),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(UserExerciseCacheRegenerateTest, self).tearDown()
+
+    def regenerate(self, estimates):
+        users = ["user%s" % i for i in xrange(len(estimates))]
+        return list(exercise_models.UserExerciseCache._regenerate(
+            users, estimates))
+
+    def test_yields_every_cache_in_order(self):
+        self.assertEqual(
+            [(0, ("user0", ["user0"])),
+             (1, ("user1", ["user1"])),
+             (2, ("user2", ["user2"]))],
+            self.regenerate([10, 10, 10]))
+
+    def test_runs_as_many_queries_as_fit_in_budget(self):
+        self.regenerate([30] * 10)
+        self.assertEqual(3, _FakeQuery.max_running)
+
+    def test_runs_big_queries_alone(self):
+        self.regenerate([500, 500, 10])
+        self.assertEqual(1, _FakeQuery.max_running)
+
+    def test_limits_number_of_queries(self):
+        self.regenerate([1] * 50)
+        self.assertEqual(
+            exercise_models.UserExerciseCache.REGENERATE_MAX_QUERIES,
+            _FakeQuery.max_running)
+
+
+class UserExerciseCacheGetTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(UserExerciseCacheGetTest, self).setUp()
+        self.students = [UserData.insert_for("student%s" % i,
+                                             "student%s@example.com" % i)
+                         for i in xrange(3)]
+        self.coach = UserData.insert_for("coach", "coach@example.com")
+
+        def generate(user_data, user_exercises):
+            return exercise_models.UserExerciseCache(
+                key_name=exercise_models.UserExerciseCache.key_for_user_data(
+                    user_data),
+                version=exercise_models.UserExerciseCache.CURRENT_VERSION,
+                dicts={})
+
+        self.patchers = [
+            mock.patch.object(exercise_models.UserExerciseCache, "generate",
+                              staticmethod(generate)),
+            mock.patch.object(exercise_models.UserExerciseCache,
+                              "COLD_REPORT_MISSING_CACHES", 2),
+            mock.patch("exercise_models._schedule_user_exercise_cache_warm_up"),
+        ]
+        for patcher in self.patchers[:-1]:
+            patcher.start()
+        self.schedule_warm_up = self.patchers[-1].start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(UserExerciseCacheGetTest, self).tearDown()
+
+    def stored(self):
+        return exercise_models.UserExerciseCache.get_by_key_name(
+            [exercise_models.UserExerciseCache.key_for_user_data(student)
+             for student in self.students])
+
+    def test_puts_regenerated_caches_before_returning(self):
+        self.assertEqual([None] * 3, self.stored())
+        caches = exercise_models.UserExerciseCache.get(self.students)
+        self.assertEqual([cache.key() for cache in caches],
+                         [cache.key() for cache in self.stored()])
+
+    def test_warms_up_students_of_coach(self):
+        exercise_models.UserExerciseCache.get(self.students)
+        self.assertFalse(self.schedule_warm_up.called)
+
+        for cache in self.stored():
+            cache.delete()
+        exercise_models.UserExerciseCache.get(self.students,
+                                              coach=self.coach)
+        self.schedule_warm_up.assert_called_once_with(self.coach)
@@ -19,16 +19,86 @@ MAX_HISTORY_KEPT = 20
 MAX_HISTORY_BIT_MASK = (1 << MAX_HISTORY_KEPT) - 1
 
 
+# Answer histories are looked up a byte at a time in the tables below
+_BYTE_COUNT = (MAX_HISTORY_KEPT + 7) // 8
+_BIT_COUNT_TABLE = [bin(byte).count("1") for byte in xrange(256)]
+
+
 def bit_count(num):
-    # TODO(david): This uses Kerninghan's method, which would not be very quick
-    #     for dense 1s. Use numpy or some library.
     count = 0
     while num:
-        num &= num - 1
-        count += 1
+        count += _BIT_COUNT_TABLE[num & 0xff]
+        num >>= 8
     return count
 
 
+def _ewma_tables(weight):
+    """Tables for computing AccuracyModel.exp_moving_avg(weight) with lookups.
+
+    Unrolling the average over n answers, where answer 0 is the most recent:
+
+        ewma = EWMA_SEED * (1 - weight) ** n
+               + sum(weight * (1 - weight) ** i * answer_i for i < n)
+
+    Returns (seed_terms, byte_tables) where seed_terms[n] is the first term
+    and byte_tables[k][byte] is the sum's contribution of the k-th byte of
+    the answer history.
+    """
+    seed_terms = [EWMA_SEED * (1 - weight) ** n
+                  for n in xrange(MAX_HISTORY_KEPT + 1)]
+    bit_terms = [weight * (1 - weight) ** i
+                 for i in xrange(_BYTE_COUNT * 8)]
+    byte_tables = []
+    for k in xrange(_BYTE_COUNT):
+        byte_tables.append([
+            sum(bit_terms[k * 8 + i] for i in xrange(8) if byte >> i & 1)
+            for byte in xrange(256)])
+    return seed_terms, byte_tables
+
+
+_EWMA_3_TABLES = _ewma_tables(0.333)
+_EWMA_10_TABLES = _ewma_tables(0.1)
+
+# Predictions memoized by (answer_history, total_done). There are about two
+# million possible states but real histories cluster heavily, so this stays
+# small; it's dropped wholesale if it ever grows past the limit.
+_PREDICTION_CACHE = {}
+_PREDICTION_CACHE_MAX_SIZE = 100000
+
+
+def _table_ewma(tables, answer_history, total_done):
+    seed_terms, byte_tables = tables
+    ewma = seed_terms[total_done]
+    for byte_table in byte_tables:
+        ewma += byte_table[answer_history & 0xff]
+        answer_history >>= 8
+    return ewma
+
+
+def _predict_state(answer_history, total_done):
+    """The logistic regression prediction for an (answer_history,
+    total_done) state, where answer_history has no bits above total_done.
+    """
+    total_correct = bit_count(answer_history)
+
+    # The streak is the number of trailing 1s in the history
+    current_streak = min((answer_history ^ (answer_history + 1)).bit_length()
+                         - 1, total_done)
+
+    X = (
+        _table_ewma(_EWMA_3_TABLES, answer_history, total_done),
+        _table_ewma(_EWMA_10_TABLES, answer_history, total_done),
+        current_streak,
+        math.log(total_done),
+        # log (num_missed + 1)
+        math.log(total_done - total_correct + 1),
+        float(total_correct) / total_done,
+    )
+
+    return AccuracyModel.logistic_regression_predict(
+        params.INTERCEPT, _WEIGHT_VECTOR, X)
+
+
 class AccuracyModel(object):
     """
     Predicts the probabilty of the next problem correct using logistic
@@ -56,13 +126,24 @@ class AccuracyModel(object):
             self.update([True] * user_exercise.streak)
 
     def update(self, correct):
+        """Record one answer, or a sequence of answers oldest first."""
         if self.version != AccuracyModel.CURRENT_VERSION:
             self.update_to_new_version()
 
         if hasattr(correct, '__iter__'):
-            # TODO(david): This can definitely be made more efficient.
-            for answer in correct:
-                self.update(answer or answer == '1')
+            answers = list(correct)
+
+            # Only the most recent answers can still be in the history, so
+            # shift those in all at once.
+            new_bits = 0
+            for answer in answers[-MAX_HISTORY_KEPT:]:
+                new_bits = (new_bits << 1) | (1 if answer else 0)
+            shift = min(len(answers), MAX_HISTORY_KEPT)
+
+            self.total_done = min(self.total_done + len(answers),
+                                  MAX_HISTORY_KEPT)
+            self.answer_history = (((self.answer_history << shift) | new_bits)
+                                   & MAX_HISTORY_BIT_MASK)
         else:
             self.total_done = min(self.total_done + 1, MAX_HISTORY_KEPT)
             self.answer_history = \
@@ -119,28 +200,17 @@ class AccuracyModel(object):
         if self.total_done == 0:
             return PROBABILITY_FIRST_PROBLEM_CORRECT
 
-        # Get values for the feature vector X
-        ewma_3 = self.exp_moving_avg(0.333)
-        ewma_10 = self.exp_moving_avg(0.1)
-        current_streak = self.streak()
-        log_num_done = math.log(self.total_done)
-        # log (num_missed + 1)
-        log_num_missed = math.log(self.total_done - self.total_correct() + 1)
-        percent_correct = float(self.total_correct()) / self.total_done
-
-        weighted_features = [
-            (ewma_3, params.EWMA_3),
-            (ewma_10, params.EWMA_10),
-            (current_streak, params.CURRENT_STREAK),
-            (log_num_done, params.LOG_NUM_DONE),
-            (log_num_missed, params.LOG_NUM_MISSED),
-            (percent_correct, params.PERCENT_CORRECT),
-        ]
+        state = (self.answer_history & ((1 << self.total_done) - 1),
+                 self.total_done)
 
-        X, weight_vector = zip(*weighted_features)  # unzip the list of pairs
+        prediction = _PREDICTION_CACHE.get(state)
+        if prediction is None:
+            prediction = _predict_state(*state)
+            if len(_PREDICTION_CACHE) >= _PREDICTION_CACHE_MAX_SIZE:
+                _PREDICTION_CACHE.clear()
+            _PREDICTION_CACHE[state] = prediction
 
-        return AccuracyModel.logistic_regression_predict(
-            params.INTERCEPT, weight_vector, X)
+        return prediction
 
     def is_struggling(self, param, minimum_accuracy, minimum_attempts):
         """ Whether or not this model detects that the student is struggling
@@ -193,3 +263,14 @@ class AccuracyModel(object):
 
             if model.predict() >= threshold:
                 return i
+
+
+# Weights in the same order as the feature vector built in _predict_state
+_WEIGHT_VECTOR = (
+    params.EWMA_3,
+    params.EWMA_10,
+    params.CURRENT_STREAK,
+    params.LOG_NUM_DONE,
+    params.LOG_NUM_MISSED,
+    params.PERCENT_CORRECT,
+)
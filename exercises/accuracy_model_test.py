@@ -4,6 +4,7 @@ tests for correct behavior expected of an accuracy model. Tries not to be
 flaky.
 """
 
+import math
 import unittest
 
 from exercises.accuracy_model import AccuracyModel
@@ -110,5 +111,39 @@ class TestSequenceFunctions(unittest.TestCase):
             self.assertTrue(self.is_struggling('110' * i),
                             msg="Should be struggling on %s" % ('110' * i))
 
+    def test_batch_update_matches_one_at_a_time(self):
+        for seq in ['', '0', '1101', '10' * 7, '0111' * 8, '1' * 25 + '0']:
+            batch = TestSequenceFunctions.model_from_str(seq)
+            single = AccuracyModel()
+            for answer in TestSequenceFunctions.to_bool_generator(seq):
+                single.update(answer)
+            self.assertEqual(single.answer_history, batch.answer_history)
+            self.assertEqual(single.total_done, batch.total_done)
+
+            # And on top of existing history
+            batch.update(TestSequenceFunctions.to_bool_generator('0110'))
+            for answer in TestSequenceFunctions.to_bool_generator('0110'):
+                single.update(answer)
+            self.assertEqual(single.answer_history, batch.answer_history)
+            self.assertEqual(single.total_done, batch.total_done)
+
+    def test_predict_matches_features(self):
+        # Recompute the regression directly from the model's features
+        from exercises.accuracy_model import params
+        for seq in ['1', '0', '1101', '0111' * 8]:
+            model = TestSequenceFunctions.model_from_str(seq)
+            X = (model.exp_moving_avg(0.333),
+                 model.exp_moving_avg(0.1),
+                 model.streak(),
+                 math.log(model.total_done),
+                 math.log(model.total_done - model.total_correct() + 1),
+                 float(model.total_correct()) / model.total_done)
+            weights = (params.EWMA_3, params.EWMA_10, params.CURRENT_STREAK,
+                       params.LOG_NUM_DONE, params.LOG_NUM_MISSED,
+                       params.PERCENT_CORRECT)
+            expected = AccuracyModel.logistic_regression_predict(
+                params.INTERCEPT, weights, X)
+            self.assertAlmostEqual(expected, model.predict())
+
 if __name__ == '__main__':
     unittest.main()
@@ -277,17 +277,15 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
             # Defer the put of ProblemLog for now, as we think it might be causing hot tablets
             # and want to shift it off to an automatically-retrying task queue.
             # http://ikaisays.com/2011/01/25/app-engine-datastore-tip-monotonically-increasing-values-are-bad/
-            deferred.defer(exercise_models.commit_problem_log, problem_log,
-                           _queue="problem-log-queue",
-                           _url="/_ah/queue/deferred_problemlog")
+            # It's queued with the user's other attempts and hints, so each
+            # ProblemLog is written once for a batch of them.
+            exercise_models.queue_problem_log(problem_log)
         else:
             exercise_models.commit_problem_log(problem_log, async=False)
 
         if user_data is not None and user_data.coaches:
-            # Making a separate queue for the log summaries so we can clearly see how much they are getting used
-            deferred.defer(video_models.commit_log_summary_coaches, problem_log, user_data.coaches,
-                       _queue="log-summary-queue",
-                       _url="/_ah/queue/deferred_log_summary")
+            video_models.buffer_log_summary_coaches(problem_log,
+                                                    user_data.coaches)
 
         if user_data is not None and completed and stack_uid:
             # Update the stack log iff the user just finished this card.
@@ -0,0 +1,270 @@
+"""Every student's progress in every exercise, computed in bulk for coaches.
+
+Coach reports want to know, for a list of students and all exercises,
+whether each student is reviewing, proficient, struggling, has started or
+has not started each exercise, and how far along they are. Rather than have
+each report load every student's UserExerciseGraph or UserExerciseCache and
+look up dicts by name for every (student, exercise) pair, ProgressMatrix
+builds the whole table once from the students' UserExerciseGraphs, which are
+aligned with the shared ExerciseTopology, and stores it by column: for each
+exercise, one string of status codes and one array each of progress,
+problems done, last done and proficient dates, with an entry per student.
+
+The class progress report, the exercises over time graph and the progress
+summary API all read the same matrix, which is cached in memcache per list
+of students, chunked when it's big. Alongside each student's row it keeps a
+stamp of their last activity and proficiencies, which change whenever their
+UserExerciseCache does (doing a problem calls UserData.record_activity). On
+a later get only the rows of students whose stamp has changed are rebuilt
+and patched in, so one student doing a problem doesn't rebuild the class.
+"""
+
+import array
+import datetime
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from app import App
+import exercise_models
+import layer_cache
+import setting_model
+import user_util
+
+# Status codes, stored as single characters in ProgressMatrix.columns
+REVIEW = "0"
+PROFICIENT = "1"
+STRUGGLING = "2"
+STARTED = "3"
+NOT_STARTED = "4"
+
+STATUS_NAMES = {
+    REVIEW: "review",
+    PROFICIENT: "proficient",
+    STRUGGLING: "struggling",
+    STARTED: "started",
+    NOT_STARTED: "not-started",
+}
+
+# Reviews fall due with time rather than with activity, so don't serve a
+# matrix built longer ago than this even if no student has done anything.
+CACHE_EXPIRATION_SECONDS = 60 * 60
+
+# The array typecode of each of ProgressMatrix's per-exercise arrays
+_ARRAY_TYPECODES = {
+    "progress": "d",
+    "total_done": "i",
+    "last_done": "d",
+    "proficient_date": "d",
+}
+
+_EPOCH = datetime.datetime.utcfromtimestamp(0)
+
+
+def status_for_graph_dict(graph_dict):
+    """Return the status code of a single graph dict."""
+    if graph_dict["proficient"]:
+        if graph_dict["reviewing"]:
+            return REVIEW
+        return PROFICIENT
+    elif graph_dict["struggling"]:
+        return STRUGGLING
+    elif graph_dict["total_done"] > 0:
+        return STARTED
+    return NOT_STARTED
+
+
+def student_stamp(student):
+    """A string that changes whenever the student's exercise states can."""
+    return "%s|%s" % (student.last_activity, len(student.proficient_exercises))
+
+
+def seconds_from_datetime(dt):
+    """Return dt in seconds since the epoch, or 0 if it's unset."""
+    # proficient_date defaults to 0 and last_done to datetime.min
+    if not dt or dt.year <= 1:
+        return 0
+    return (dt - _EPOCH).total_seconds()
+
+
+def datetime_from_seconds(seconds):
+    """Return the datetime stored by seconds_from_datetime, or None."""
+    if not seconds:
+        return None
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class ProgressMatrix(object):
+    """Statuses and progress of a list of students in every exercise.
+
+    exercise_names and exercise_display_names are in topology order, and
+    student_keys has the key_email of each student in the order they were
+    given. For exercise i and student j:
+
+        columns[i][j] is the student's status code
+        progress[i][j] is their progress, from 0.0 to 1.0
+        total_done[i][j] is the number of problems they've done
+        last_done[i][j] and proficient_date[i][j] are in seconds since the
+            epoch (see datetime_from_seconds), or 0 if they never have
+
+    Each column is a str or an array.array, which pickle compactly.
+    """
+
+    # Bump this whenever the fields change, so old cached matrices are
+    # ignored
+    VERSION = 2
+
+    def __init__(self, exercise_names, exercise_display_names, student_keys,
+                 stamps, columns, progress, total_done, last_done,
+                 proficient_date):
+        self.exercise_names = exercise_names
+        self.exercise_display_names = exercise_display_names
+        self.student_keys = student_keys
+        self.stamps = stamps
+        self.columns = columns
+        self.progress = progress
+        self.total_done = total_done
+        self.last_done = last_done
+        self.proficient_date = proficient_date
+        self.time_built = time.time()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in _ARRAY_TYPECODES:
+            state[name] = [column.tostring() for column in state[name]]
+        return state
+
+    def __setstate__(self, state):
+        for name, typecode in _ARRAY_TYPECODES.iteritems():
+            state[name] = [array.array(typecode, column)
+                           for column in state[name]]
+        self.__dict__.update(state)
+
+    @staticmethod
+    def from_graphs(students, user_exercise_graphs, topology):
+        """Build the matrix from graphs that were generated with topology."""
+        count = len(topology.names)
+        columns = [[] for _ in xrange(count)]
+        progress = [array.array("d") for _ in xrange(count)]
+        total_done = [array.array("i") for _ in xrange(count)]
+        last_done = [array.array("d") for _ in xrange(count)]
+        proficient_date = [array.array("d") for _ in xrange(count)]
+
+        for user_exercise_graph in user_exercise_graphs:
+            assert user_exercise_graph.topology is topology
+            for i, graph_dict in enumerate(
+                    user_exercise_graph.graph_dict_list):
+                columns[i].append(status_for_graph_dict(graph_dict))
+                progress[i].append(graph_dict["progress"])
+                total_done[i].append(graph_dict["total_done"])
+                last_done[i].append(
+                    seconds_from_datetime(graph_dict["last_done"]))
+                proficient_date[i].append(
+                    seconds_from_datetime(graph_dict["proficient_date"]))
+
+        return ProgressMatrix(
+            list(topology.names),
+            [d["display_name"] for d in topology.exercise_dicts],
+            [student.key_email for student in students],
+            [student_stamp(student) for student in students],
+            ["".join(column) for column in columns],
+            progress, total_done, last_done, proficient_date)
+
+    def patch(self, j, student, user_exercise_graph):
+        """Replace the row of student j with their up to date graph."""
+        self.stamps[j] = student_stamp(student)
+        for i, graph_dict in enumerate(user_exercise_graph.graph_dict_list):
+            column = self.columns[i]
+            self.columns[i] = "%s%s%s" % (
+                column[:j], status_for_graph_dict(graph_dict), column[j + 1:])
+            self.progress[i][j] = graph_dict["progress"]
+            self.total_done[i][j] = graph_dict["total_done"]
+            self.last_done[i][j] = seconds_from_datetime(
+                graph_dict["last_done"])
+            self.proficient_date[i][j] = seconds_from_datetime(
+                graph_dict["proficient_date"])
+
+    def is_expired(self):
+        return time.time() - self.time_built > CACHE_EXPIRATION_SECONDS
+
+    @staticmethod
+    def cache_key(students):
+        """Key for the matrix of this list of students, in this order."""
+        digest = hashlib.md5()
+        for student in students:
+            digest.update("%s\n" % student.key_email)
+
+        return "progress_matrix_%s_%s_%s_%s_%s" % (
+            ProgressMatrix.VERSION,
+            setting_model.Setting.cached_exercises_date(),
+            exercise_models.UserExerciseCache.CURRENT_VERSION,
+            user_util.is_current_user_developer(),
+            digest.hexdigest())
+
+    @staticmethod
+    def build(students, coach=None):
+        """Build the ProgressMatrix for the list of students from scratch."""
+        user_exercise_graphs = exercise_models.UserExerciseGraph.get(
+            students, coach=coach)
+        if user_exercise_graphs:
+            topology = user_exercise_graphs[0].topology
+        else:
+            topology = exercise_models.ExerciseTopology.get()
+        return ProgressMatrix.from_graphs(students, user_exercise_graphs,
+                                          topology)
+
+    @staticmethod
+    def get(students, coach=None):
+        """Return the ProgressMatrix for the list of students.
+
+        A cached matrix has the rows of students whose stamps have changed
+        rebuilt, and is cached again if any were. coach is the coach whose
+        report it's for, if any (see UserExerciseCache.get).
+        """
+        if layer_cache.is_disabled():
+            return ProgressMatrix.build(students, coach)
+
+        key = ProgressMatrix.cache_key(students)
+        matrix = _get_cached(key)
+
+        if matrix is None or matrix.is_expired():
+            matrix = ProgressMatrix.build(students, coach)
+        else:
+            stale = [j for j, student in enumerate(students)
+                     if matrix.stamps[j] != student_stamp(student)]
+            if not stale:
+                return matrix
+
+            # The rows are stamped as up to date with the students, so their
+            # caches can't be read from a stale replica
+            user_exercise_graphs = exercise_models.UserExerciseGraph.get(
+                [students[j] for j in stale], coach=coach,
+                read_policy=db.STRONG_CONSISTENCY)
+            if (user_exercise_graphs[0].topology.names !=
+                    matrix.exercise_names):
+                # The exercises have changed since the matrix was built
+                matrix = ProgressMatrix.build(students, coach)
+            else:
+                for j, user_exercise_graph in zip(stale,
+                                                  user_exercise_graphs):
+                    matrix.patch(j, students[j], user_exercise_graph)
+
+        _set_cached(key, matrix)
+        return matrix
+
+
+def _get_cached(key):
+    result = memcache.get(key, namespace=App.version)
+    if isinstance(result, layer_cache.ChunkedResult):
+        result = result.get_result(memcache, namespace=App.version)
+    return result
+
+
+def _set_cached(key, matrix):
+    # Always chunked, since big classes have matrices of over 1MB
+    layer_cache.ChunkedResult.set(key, matrix,
+                                  time=CACHE_EXPIRATION_SECONDS,
+                                  namespace=App.version,
+                                  cache_class=memcache)
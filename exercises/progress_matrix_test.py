@@ -0,0 +1,177 @@
+from __future__ import with_statement
+
+import datetime
+import unittest
+
+import mock
+
+from google.appengine.ext import db
+
+import exercise_models
+from exercises import progress_matrix
+import pickle_util
+
+
+class _FakeTopology(object):
+    def __init__(self, names):
+        self.names = names
+        self.exercise_dicts = [{"name": name, "display_name": name.upper()}
+                               for name in names]
+
+
+class _FakeGraph(object):
+    def __init__(self, topology, graph_dict_list):
+        self.topology = topology
+        self.graph_dict_list = graph_dict_list
+
+
+class _FakeStudent(object):
+    def __init__(self, key_email, last_activity=None):
+        self.key_email = key_email
+        self.last_activity = last_activity
+        self.proficient_exercises = []
+
+
+def graph_dict(proficient=False, reviewing=False, struggling=False,
+               total_done=0, progress=0.0, last_done=datetime.datetime.min,
+               proficient_date=0):
+    return {
+        "proficient": proficient,
+        "reviewing": reviewing,
+        "struggling": struggling,
+        "total_done": total_done,
+        "progress": progress,
+        "last_done": last_done,
+        "proficient_date": proficient_date,
+    }
+
+
+class ProgressMatrixTest(unittest.TestCase):
+
+    def test_status_for_graph_dict(self):
+        status = progress_matrix.status_for_graph_dict
+        self.assertEqual(progress_matrix.REVIEW,
+                         status(graph_dict(proficient=True, reviewing=True)))
+        self.assertEqual(progress_matrix.PROFICIENT,
+                         status(graph_dict(proficient=True)))
+        self.assertEqual(progress_matrix.STRUGGLING,
+                         status(graph_dict(struggling=True, total_done=3)))
+        self.assertEqual(progress_matrix.STARTED,
+                         status(graph_dict(total_done=3)))
+        self.assertEqual(progress_matrix.NOT_STARTED, status(graph_dict()))
+
+    def test_columns_hold_one_status_per_student(self):
+        topology = _FakeTopology(["a", "b"])
+        graphs = [
+            _FakeGraph(topology, [graph_dict(proficient=True),
+                                  graph_dict()]),
+            _FakeGraph(topology, [graph_dict(total_done=1),
+                                  graph_dict(struggling=True)]),
+        ]
+
+        students = [_FakeStudent("one"), _FakeStudent("two")]
+
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            students, graphs, topology)
+
+        self.assertEqual(["a", "b"], matrix.exercise_names)
+        self.assertEqual(["one", "two"], matrix.student_keys)
+        self.assertEqual(["A", "B"], matrix.exercise_display_names)
+        self.assertEqual(
+            [progress_matrix.PROFICIENT + progress_matrix.STARTED,
+             progress_matrix.NOT_STARTED + progress_matrix.STRUGGLING],
+            matrix.columns)
+
+    def test_no_students(self):
+        topology = _FakeTopology(["a", "b"])
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            [], [], topology)
+        self.assertEqual(["", ""], matrix.columns)
+        self.assertEqual([[], []], [list(a) for a in matrix.total_done])
+
+    def test_columns_hold_progress_and_dates(self):
+        topology = _FakeTopology(["a"])
+        proficient_date = datetime.datetime(2012, 5, 1, 12, 30)
+        graphs = [
+            _FakeGraph(topology, [graph_dict(
+                proficient=True, total_done=12, progress=1.0,
+                last_done=datetime.datetime(2012, 5, 2),
+                proficient_date=proficient_date)]),
+            _FakeGraph(topology, [graph_dict()]),
+        ]
+
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            [_FakeStudent("one"), _FakeStudent("two")], graphs, topology)
+
+        self.assertEqual([1.0, 0.0], list(matrix.progress[0]))
+        self.assertEqual([12, 0], list(matrix.total_done[0]))
+        self.assertEqual(
+            proficient_date,
+            progress_matrix.datetime_from_seconds(
+                matrix.proficient_date[0][0]))
+        self.assertEqual(0, matrix.proficient_date[0][1])
+        self.assertEqual(0, matrix.last_done[0][1])
+        self.assertEqual(None, progress_matrix.datetime_from_seconds(0))
+
+    def test_patch_replaces_one_row(self):
+        topology = _FakeTopology(["a", "b"])
+        students = [_FakeStudent("one"), _FakeStudent("two"),
+                    _FakeStudent("three")]
+        graphs = [_FakeGraph(topology, [graph_dict(), graph_dict()])
+                  for _ in students]
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            students, graphs, topology)
+
+        students[1].last_activity = datetime.datetime(2012, 5, 2)
+        matrix.patch(1, students[1], _FakeGraph(topology, [
+            graph_dict(total_done=3, progress=0.5),
+            graph_dict(proficient=True, total_done=10, progress=1.0)]))
+
+        self.assertEqual(
+            progress_matrix.student_stamp(students[1]), matrix.stamps[1])
+        self.assertEqual(
+            [progress_matrix.NOT_STARTED + progress_matrix.STARTED +
+             progress_matrix.NOT_STARTED,
+             progress_matrix.NOT_STARTED + progress_matrix.PROFICIENT +
+             progress_matrix.NOT_STARTED],
+            matrix.columns)
+        self.assertEqual([0, 3, 0], list(matrix.total_done[0]))
+        self.assertEqual([0.0, 1.0, 0.0], list(matrix.progress[1]))
+
+    def test_pickles_columns_compactly(self):
+        topology = _FakeTopology(["a"])
+        graphs = [_FakeGraph(topology, [graph_dict(total_done=i)])
+                  for i in xrange(100)]
+        students = [_FakeStudent(str(i)) for i in xrange(100)]
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            students, graphs, topology)
+
+        unpickled = pickle_util.load(pickle_util.dump(matrix))
+
+        self.assertEqual(range(100), list(unpickled.total_done[0]))
+        self.assertEqual(matrix.columns, unpickled.columns)
+        self.assertEqual(matrix.stamps, unpickled.stamps)
+
+    def test_get_reads_stale_rows_consistently(self):
+        topology = _FakeTopology(["a"])
+        students = [_FakeStudent("one"), _FakeStudent("two")]
+        matrix = progress_matrix.ProgressMatrix.from_graphs(
+            students, [_FakeGraph(topology, [graph_dict()])
+                       for _ in students], topology)
+        students[1].last_activity = datetime.datetime(2012, 5, 2)
+        patched = _FakeGraph(topology, [graph_dict(total_done=3)])
+
+        with mock.patch.object(progress_matrix.layer_cache, "is_disabled",
+                               return_value=False):
+            with mock.patch.object(progress_matrix, "_get_cached",
+                                   return_value=matrix):
+                with mock.patch.object(progress_matrix, "_set_cached"):
+                    with mock.patch.object(
+                            exercise_models.UserExerciseGraph, "get",
+                            return_value=[patched]) as get_graphs:
+                        self.assertEqual(matrix,
+                            progress_matrix.ProgressMatrix.get(students))
+
+        get_graphs.assert_called_once_with(
+            [students[1]], coach=None, read_policy=db.STRONG_CONSISTENCY)
+        self.assertEqual([0, 3], list(matrix.total_done[0]))
@@ -0,0 +1,75 @@
+"""A {% cache %} tag for Jinja2 templates that caches rendered fragments.
+
+    {% cache "topic_browser_pulldown" %}
+        ...expensive, rarely changing markup...
+    {% endcache %}
+
+renders its body once and stores the result in layer_cache, so later
+renders of the template reuse it instead of running the body again. The
+fragment is cached per template, per app version (as layer_cache always
+is) and per topic tree version, so publishing a new topic tree renders it
+anew.
+
+An expiration in seconds and a bucket can follow the name:
+
+    {% cache "header_links", 60 * 60, logged_in %}
+
+The bucket is added to the key, so a fragment that differs between kinds
+of users is cached once per kind. Buckets should be small segments like
+logged_in or is_mobile rather than anything unique to a user; a fragment
+that depends on anything else in the template's context mustn't be cached.
+
+Fragments without a bucket are cached in memcache and in instance memory,
+and those with one only in memcache. Caching is off on the dev server, so
+template changes show up right away, as with config_jinja's cache_size.
+"""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from app import App
+import layer_cache
+import setting_model
+
+# How long fragments are cached for unless the tag gives an expiration
+DEFAULT_EXPIRATION_SECONDS = 60 * 60
+
+
+class FragmentCacheExtension(Extension):
+    tags = set(["cache"])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache_enabled=not App.is_dev_server)
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        for _ in xrange(2):
+            if parser.stream.skip_if("comma"):
+                args.append(parser.parse_expression())
+            else:
+                args.append(nodes.Const(None))
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_cache_fragment", args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache_fragment(self, template_name, name, expiration, bucket,
+                        caller):
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+
+        key = "fragment_cache:%s:%s:%s:%s" % (
+            template_name, name,
+            setting_model.Setting.topic_tree_version(), bucket)
+
+        layer = layer_cache.Layers.Memcache
+        if bucket is None:
+            layer |= layer_cache.Layers.InAppMemory
+
+        return layer_cache.layer_cache_check_set_return(
+            caller, lambda: key,
+            expiration=expiration or DEFAULT_EXPIRATION_SECONDS,
+            layer=layer)
@@ -0,0 +1,43 @@
+import jinja2
+
+import fragment_cache
+from testutil import gae_model
+
+
+class FragmentCacheTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(FragmentCacheTest, self).setUp()
+        self.environment = jinja2.Environment(
+            loader=jinja2.DictLoader({
+                "fragments.html": (
+                    '{% cache "shared" %}[{{ render() }}]{% endcache %}'
+                    '{% cache "bucketed", 60, bucket %}'
+                    '<{{ render() }}>'
+                    '{% endcache %}'),
+            }),
+            extensions=[fragment_cache.FragmentCacheExtension])
+        self.environment.fragment_cache_enabled = True
+        self.renders = 0
+
+    def render(self, bucket):
+        def render_fragment():
+            self.renders += 1
+            return self.renders
+
+        template = self.environment.get_template("fragments.html")
+        return template.render(render=render_fragment, bucket=bucket)
+
+    def test_reuses_fragments(self):
+        self.assertEqual("[1]<2>", self.render("logged_in"))
+        self.assertEqual("[1]<2>", self.render("logged_in"))
+        self.assertEqual(2, self.renders)
+
+    def test_caches_each_bucket(self):
+        self.assertEqual("[1]<2>", self.render("logged_in"))
+        self.assertEqual("[1]<3>", self.render("phantom"))
+        self.assertEqual("[1]<2>", self.render("logged_in"))
+
+    def test_disabled(self):
+        self.environment.fragment_cache_enabled = False
+        self.assertEqual("[1]<2>", self.render("logged_in"))
+        self.assertEqual("[3]<4>", self.render("logged_in"))
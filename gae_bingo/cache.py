@@ -7,6 +7,7 @@ from google.appengine.datastore import entity_pb
 from google.appengine.ext.webapp import RequestHandler
 
 from .models import _GAEBingoExperiment, _GAEBingoAlternative, _GAEBingoIdentityRecord, _GAEBingoSnapshotLog
+from .models import apply_pending_increments
 from identity import identity
 import request_cache
 from config import QUEUE_NAME
@@ -81,14 +82,13 @@ class BingoCache(object):
         for experiment_name in self.alternatives:
             alternative_models = self.get_alternatives(experiment_name)
             for alternative_model in alternative_models:
-                # When persisting to datastore, we want to store the most recent value we've got
-                alternative_model.load_latest_counts()
-                alternative_model.put()
-                self.update_alternative(alternative_model)
+                # Only put alternatives whose counts have changed
+                if alternative_model.persist_pending_counts():
+                    self.update_alternative(alternative_model)
 
         # When periodically persisting to datastore, also make sure memcache
-        # has relatively up-to-date participant/conversion counts for each alternative.
-        self.dirty = True
+        # has relatively up-to-date participant/conversion counts for each
+        # alternative. update_alternative marked the cache dirty if any changed.
         self.store_if_dirty()
 
     def log_cache_snapshot(self):
@@ -365,6 +365,9 @@ def bingo_and_identity_cache():
     return BingoCache.get(), BingoIdentityCache.get()
 
 def store_if_dirty():
+    # Participant and conversion counts made during this request
+    apply_pending_increments()
+
     # Only load from request cache here -- if it hasn't been loaded from memcache previously, it's not dirty.
     bingo_cache = request_cache.cache.get(BingoCache.MEMCACHE_KEY)
     bingo_identity_cache = request_cache.cache.get(BingoIdentityCache.key_for_identity(identity()))
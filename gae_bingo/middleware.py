@@ -1,5 +1,6 @@
 import cache
 import identity
+import models
 import request_cache
 
 class GAEBingoWSGIMiddleware(object):
@@ -13,6 +14,10 @@ class GAEBingoWSGIMiddleware(object):
             # Make sure request-cached values are cleared at start of request
             request_cache.flush_request_cache()
 
+            # Apply all participant and conversion increments at once, in
+            # cache.store_if_dirty below
+            models.batch_counter_increments()
+
             def gae_bingo_start_response(status, headers, exc_info = None):
 
                 if identity.using_logged_in_bingo_identity():
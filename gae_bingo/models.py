@@ -1,9 +1,63 @@
 import datetime
+import logging
+import random
 
 from google.appengine.ext import db
 from google.appengine.api import memcache
 
 import pickle_util
+import request_cache
+
+# Participant and conversion increments are spread over this many memcache
+# counters per alternative so popular alternatives don't all hit one key
+COUNTER_SHARDS = 8
+
+BATCH_INCREMENTS_KEY = "_gae_bingo_batch_increments"
+PENDING_INCREMENTS_KEY = "_gae_bingo_pending_increments"
+
+
+def batch_counter_increments():
+    """ Hold counter increments made during this request until
+    apply_pending_increments is called, which GAEBingoWSGIMiddleware does
+    at the end of each request.
+    """
+    request_cache.cache[BATCH_INCREMENTS_KEY] = True
+
+
+def increment_counter(key):
+    """ Add one to the memcache counter at key, or queue the increment if
+    batch_counter_increments has been called this request.
+
+    A queued increment can't fail yet, so True is returned for it and the
+    user counts as participating or converted even if the offset_multi in
+    apply_pending_increments later fails, which is only logged.
+
+    Returns:
+        False if memcache failed to increment the counter, True otherwise.
+    """
+    if not request_cache.cache.get(BATCH_INCREMENTS_KEY):
+        return memcache.incr(key, initial_value=0) is not None
+
+    pending = request_cache.cache.get(PENDING_INCREMENTS_KEY)
+    if pending is None:
+        pending = request_cache.cache[PENDING_INCREMENTS_KEY] = {}
+    pending[key] = pending.get(key, 0) + 1
+    return True
+
+
+def apply_pending_increments():
+    """ Apply all increments queued this request with one memcache call. """
+    pending = request_cache.cache.get(PENDING_INCREMENTS_KEY)
+    if not pending:
+        return
+
+    request_cache.cache[PENDING_INCREMENTS_KEY] = {}
+
+    results = memcache.offset_multi(pending, initial_value=0) or {}
+    failed = [key for key in pending if results.get(key) is None]
+    if failed:
+        logging.warning("Failed to increment gae_bingo counters: %s" % failed)
+
 
 # If you use a datastore model to uniquely identify each user,
 # let it inherit from this class, like so...
@@ -118,57 +172,124 @@ class _GAEBingoAlternative(db.Model):
     def key_for_self(self):
         return _GAEBingoAlternative.key_for_experiment_name_and_number(self.experiment_name, self.number)
 
+    def counter_key(self, counter_name, shard=None):
+        """ Memcache key of one of the shards that count increments of
+        counter_name ("participants" or "conversions") since they were last
+        persisted, or of the total count kept before counters were sharded
+        if shard is None.
+        """
+        key = "%s:%s" % (self.key_for_self(), counter_name)
+        if shard is None:
+            return key
+        return "%s:%s" % (key, shard)
+
+    def counter_keys(self, counter_name):
+        return [self.counter_key(counter_name, shard)
+                for shard in xrange(COUNTER_SHARDS)]
+
     def increment_participants(self):
-        """ Increment a memcache.incr-backed counter to keep track of participants in a scalable fashion.
-        
-        It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
-        due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
-        be persisted.
+        """ Increment a sharded memcache counter to keep track of participants in a scalable fashion.
+
+        The memcache counters only hold increments made since the counts were
+        last persisted, which persist_pending_counts adds to this entity.
 
         Returns:
             True if participants was successfully incremented, False otherwise."
         """
-        participants = memcache.incr("%s:participants" % self.key_for_self(), initial_value=self.participants)
-
-        if participants is None:
-            # Memcache may be down and returning None for incr. Don't update the model in this case.
-            return False
-
-        self.participants = participants
-        return True
+        return increment_counter(self.counter_key("participants",
+                                                  random.randrange(COUNTER_SHARDS)))
 
     def increment_conversions(self):
-        """ Increment a memcache.incr-backed counter to keep track of conversions in a scalable fashion.
+        """ Increment a sharded memcache counter to keep track of conversions in a scalable fashion.
 
-        It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
-        due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
-        be persisted.
+        The memcache counters only hold increments made since the counts were
+        last persisted, which persist_pending_counts adds to this entity.
 
         Returns:
             True if conversions was successfully incremented, False otherwise.
         """
-        conversions = memcache.incr("%s:conversions" % self.key_for_self(), initial_value=self.conversions)
-
-        if conversions is None:
-            # Memcache may be down and returning None for incr. Don't update the model in this case.
-            return False
-
-        self.conversions = conversions
-        return True
+        return increment_counter(self.counter_key("conversions",
+                                                  random.randrange(COUNTER_SHARDS)))
+
+    def pending_counts(self):
+        """ Return the memcache values of all of this alternative's counters. """
+        keys = []
+        for counter_name in ["participants", "conversions"]:
+            keys.append(self.counter_key(counter_name))
+            keys.extend(self.counter_keys(counter_name))
+        return memcache.get_multi(keys)
+
+    def latest_count(self, counter_name, pending_counts):
+        count = max(getattr(self, counter_name),
+                    long(pending_counts.get(self.counter_key(counter_name)) or 0))
+        for key in self.counter_keys(counter_name):
+            count += long(pending_counts.get(key) or 0)
+        return count
 
     def latest_participants_count(self):
-        return max(self.participants, long(memcache.get("%s:participants" % self.key_for_self()) or 0))
+        return self.latest_count("participants", self.pending_counts())
 
     def latest_conversions_count(self):
-        return max(self.conversions, long(memcache.get("%s:conversions" % self.key_for_self()) or 0))
+        return self.latest_count("conversions", self.pending_counts())
 
     def reset_counts(self):
-        memcache.delete_multi(["%s:participants" % self.key_for_self(), "%s:conversions" % self.key_for_self()])
+        memcache.delete_multi(self.pending_counts().keys())
 
     def load_latest_counts(self):
         # When persisting to datastore, we want to store the most recent value we've got
-        self.participants = self.latest_participants_count()
-        self.conversions = self.latest_conversions_count()
+        pending_counts = self.pending_counts()
+        self.participants = self.latest_count("participants", pending_counts)
+        self.conversions = self.latest_count("conversions", pending_counts)
+
+    def persist_pending_counts(self):
+        """ Add the increments counted in memcache to the stored entity.
+
+        The increments are first taken out of the memcache counters, so ones
+        made meanwhile are kept for next time. They're then added to the
+        entity as it is in the datastore, in a transaction, rather than to
+        this copy, which may be older than the last persist. If that fails
+        the increments are put back. A persist that dies in between loses
+        them, which undercounts rather than counting them twice.
+
+        This entity's counts are set from the stored result.
+
+        Returns:
+            True if there were any increments to persist, False otherwise.
+        """
+        pending_counts = self.pending_counts()
+        if not any(pending_counts.itervalues()):
+            return False
+
+        totals = [self.counter_key("participants"),
+                  self.counter_key("conversions")]
+        deltas = dict((key, long(value))
+                      for key, value in pending_counts.iteritems()
+                      if value and key not in totals)
+        if deltas:
+            memcache.offset_multi(dict((key, -value)
+                                       for key, value in deltas.iteritems()))
+
+        def txn():
+            alternative = db.get(self.key()) or self
+            alternative.participants = alternative.latest_count(
+                "participants", pending_counts)
+            alternative.conversions = alternative.latest_count(
+                "conversions", pending_counts)
+            alternative.put()
+            return alternative
+
+        try:
+            alternative = db.run_in_transaction(txn)
+        except:
+            if deltas:
+                memcache.offset_multi(deltas, initial_value=0)
+            raise
+
+        self.participants = alternative.participants
+        self.conversions = alternative.conversions
+
+        memcache.delete_multi(totals)
+        return True
 
 class _GAEBingoSnapshotLog(db.Model):
     alternative_number = db.IntegerProperty()
@@ -0,0 +1,119 @@
+from __future__ import with_statement
+
+import mock
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from gae_bingo import models
+from gae_bingo import request_cache
+from testutil import gae_model
+
+
+class CounterTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(CounterTest, self).setUp(db_consistency_probability=1)
+        request_cache.flush_request_cache()
+        experiment, alternatives = models.create_experiment_and_alternatives(
+            "monkeys", "monkeys")
+        experiment.put()
+        self.alternative = alternatives[0]
+        self.alternative.participants = 10
+        self.alternative.conversions = 2
+        self.alternative.put()
+
+    def tearDown(self):
+        request_cache.flush_request_cache()
+        super(CounterTest, self).tearDown()
+
+    def stored(self):
+        return db.get(self.alternative.key())
+
+    def pending(self, counter_name):
+        counts = self.alternative.pending_counts()
+        return sum(long(counts.get(key) or 0)
+                   for key in self.alternative.counter_keys(counter_name))
+
+    def test_batched_increments_use_one_offset_multi(self):
+        models.batch_counter_increments()
+        for _ in xrange(3):
+            self.assertTrue(self.alternative.increment_participants())
+        self.assertTrue(self.alternative.increment_conversions())
+        self.assertEqual(0, self.pending("participants"))
+
+        with mock.patch("gae_bingo.models.memcache.offset_multi",
+                        side_effect=memcache.offset_multi) as offset_multi:
+            models.apply_pending_increments()
+            models.apply_pending_increments()
+            self.assertEqual(1, offset_multi.call_count)
+
+        self.assertEqual(3, self.pending("participants"))
+        self.assertEqual(1, self.pending("conversions"))
+
+    def test_persists_only_the_deltas(self):
+        for _ in xrange(3):
+            self.alternative.increment_participants()
+        self.alternative.increment_conversions()
+
+        self.assertTrue(self.alternative.persist_pending_counts())
+        self.assertEqual(13, self.stored().participants)
+        self.assertEqual(3, self.stored().conversions)
+        self.assertEqual(13, self.alternative.participants)
+        self.assertEqual(0, self.pending("participants"))
+
+        # Nothing new to persist
+        self.assertFalse(self.alternative.persist_pending_counts())
+        self.assertEqual(13, self.stored().participants)
+
+    def test_adds_deltas_to_the_stored_counts(self):
+        stale_copy = self.stored()
+
+        self.alternative.increment_participants()
+        self.assertTrue(self.alternative.persist_pending_counts())
+
+        # A copy loaded before that persist doesn't undo it
+        stale_copy.increment_participants()
+        self.assertTrue(stale_copy.persist_pending_counts())
+        self.assertEqual(12, self.stored().participants)
+        self.assertEqual(12, stale_copy.participants)
+
+    def test_keeps_increments_made_during_a_persist(self):
+        self.alternative.increment_participants()
+
+        run_in_transaction = db.run_in_transaction
+        def increment_and_run(txn):
+            self.alternative.increment_participants()
+            return run_in_transaction(txn)
+
+        with mock.patch("gae_bingo.models.db.run_in_transaction",
+                        increment_and_run):
+            self.assertTrue(self.alternative.persist_pending_counts())
+        self.assertEqual(11, self.stored().participants)
+        self.assertEqual(1, self.pending("participants"))
+
+        self.assertTrue(self.alternative.persist_pending_counts())
+        self.assertEqual(12, self.stored().participants)
+
+    def test_puts_increments_back_if_the_persist_fails(self):
+        self.alternative.increment_participants()
+
+        with mock.patch("gae_bingo.models.db.run_in_transaction",
+                        side_effect=db.TransactionFailedError):
+            self.assertRaises(db.TransactionFailedError,
+                              self.alternative.persist_pending_counts)
+        self.assertEqual(10, self.stored().participants)
+        self.assertEqual(1, self.pending("participants"))
+
+    def test_reads_legacy_total_once(self):
+        total_key = self.alternative.counter_key("participants")
+        memcache.set(total_key, 20)
+        self.alternative.increment_participants()
+
+        self.assertEqual(21, self.alternative.latest_participants_count())
+        self.assertTrue(self.alternative.persist_pending_counts())
+        self.assertEqual(21, self.stored().participants)
+        self.assertEqual(None, memcache.get(total_key))
+
+        self.alternative.increment_participants()
+        self.assertTrue(self.alternative.persist_pending_counts())
+        self.assertEqual(22, self.stored().participants)
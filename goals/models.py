@@ -143,23 +143,48 @@ class Goal(db.Model):
         )
 
 
+def _current_goals_key(user_data):
+    return "GoalList.get_current_goals_%s" % user_data.user_id
+
+
 # todo: think about moving these static methods to UserData. Almost all have
 # user_data as the first argument.
 class GoalList(object):
     @staticmethod
-    @request_cache.cache_with_key_fxn(
-        lambda user_data: "GoalList.get_current_goals_%s" % user_data.user_id)
+    @request_cache.cache_with_key_fxn(_current_goals_key)
     def get_current_goals(user_data):
         '''Because this method uses a request cache, make sure to pass in
         bust_cache=True if you modify the goals earlier in the same request
         in which you call this method.'''
         if user_data and user_data.has_current_goals:
-            query = GoalList.get_goals_query(user_data)
-            query.filter('completed = ', False)
-            return query.fetch(100)
+            return GoalList._current_goals_query(user_data).fetch(100)
         else:
             return []
 
+    @staticmethod
+    def prefetch_current_goals(user_data):
+        '''Start fetching the goals get_current_goals would return.
+
+        Returns a function that waits for them and caches them for
+        get_current_goals for the rest of the request, so other datastore
+        calls can run while they're fetched.'''
+        if (not user_data or not user_data.has_current_goals or
+                request_cache.has(_current_goals_key(user_data))):
+            return lambda: None
+
+        # Unlike fetch(), run() doesn't wait for the first batch of results
+        goals = GoalList._current_goals_query(user_data).run(limit=100)
+
+        def finish():
+            request_cache.set(_current_goals_key(user_data), list(goals))
+        return finish
+
+    @staticmethod
+    def _current_goals_query(user_data):
+        query = GoalList.get_goals_query(user_data)
+        query.filter('completed = ', False)
+        return query
+
     @staticmethod
     def get_all_goals(user_data):
         if user_data:
@@ -196,7 +221,9 @@ class GoalList(object):
             if obj.__class__.__name__ == 'GoalObjectiveWatchVideo']
 
     @staticmethod
-    def update_goals(user_data, activity_fn):
+    def update_goals(user_data, activity_fn, put=True):
+        '''Returns the goals activity_fn changed, after putting them and
+        user_data. Pass put=False to put them along with other changes.'''
         if not user_data.has_current_goals:
             return False
 
@@ -211,7 +238,8 @@ class GoalList(object):
             if all([g.completed for g in goals]):
                 user_data.has_current_goals = False
                 user_changes = [user_data]
-            db.put(changes + user_changes)
+            if put:
+                db.put(changes + user_changes)
         return changes
 
     @staticmethod
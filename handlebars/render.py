@@ -10,6 +10,7 @@ import os.path
 import api.jsonify
 from app import App
 from third_party.pybars import Compiler
+from third_party.pybars._compiler import strlist
 
 
 # Helpers (from javascript/shared-package/handlebars-extras.js)
@@ -17,10 +18,12 @@ from third_party.pybars import Compiler
 
 def handlebars_repeat(context, options, count):
     fn = options["fn"]
-    ret = ""
 
+    # pybars flattens the list into the template's output, so the copies
+    # are only joined once, with the rest of the template
+    ret = strlist()
     for i in xrange(0, count):
-        ret = ret + u''.join(fn(context))
+        ret.grow(fn(context))
 
     return ret
 
@@ -70,6 +73,26 @@ handlebars_helpers = {
 }
 
 
+# Template functions by (package, name), so each template is only looked up
+# once per instance. In production the functions come from the modules
+# deploy/compile_handlebar_templates.py precompiles into compiled_templates;
+# templates that weren't compiled are stored as None.
+_template_functions = {}
+
+# Templates compiled by handlebars_dynamic_load on the dev server, by
+# (package, name), as (modification time of the source, function, partials
+# it uses) so they're recompiled when the source changes
+_dynamic_templates = {}
+
+
+def compile_template(source):
+    """ Compile the source of a Handlebars template into a function. """
+
+    # HACK: Pybars doesn't handle {{else}} for some reason
+    source = source.replace("{{else}}", "{{^}}")
+    return Compiler().compile(source)
+
+
 def handlebars_dynamic_load(package, name):
     """ Dynamically compile a Handlebars template.
 
@@ -80,11 +103,6 @@ def handlebars_dynamic_load(package, name):
         return None
 
     combined_name = "%s_%s" % (package, name)
-    if combined_name in handlebars_partials:
-        handlebars_partials[combined_name]
-
-    logging.info("Dynamically loading %s-package/%s.handlebars."
-                  % (package, name))
 
     test_file_name = ("clienttemplates/%s-package/%s.handlebars.json"
                       % (package, name))
@@ -96,24 +114,71 @@ def handlebars_dynamic_load(package, name):
 
     file_name = "clienttemplates/%s-package/%s.handlebars" % (package, name)
 
+    modified = os.path.getmtime(file_name)
+    dynamic_template = _dynamic_templates.get((package, name))
+    if dynamic_template and dynamic_template[0] == modified:
+        (_, function, partials) = dynamic_template
+        # The partials may have changed even if this template hasn't
+        for (partial_package, partial_name) in partials:
+            handlebars_dynamic_load(partial_package, partial_name)
+        return function
+
+    logging.info("Dynamically loading %s-package/%s.handlebars."
+                  % (package, name))
+
     in_file = open(file_name, 'r')
     source = unicode(in_file.read())
-    # HACK: Pybars doesn't handle {{else}} for some reason
-    source = source.replace("{{else}}", "{{^}}")
 
+    partials = []
     matches = re.search('{{>[\s]*([\w\-_]+)[\s]*}}', source)
     if matches:
         for partial in matches.groups():
             (partial_package, partial_name) = partial.split("_")
             handlebars_dynamic_load(partial_package, partial_name)
+            partials.append((partial_package, partial_name))
 
-    compiler = Compiler()
-    function = compiler.compile(source)
+    function = compile_template(source)
     handlebars_partials[combined_name] = function
+    _dynamic_templates[(package, name)] = (modified, function, partials)
 
     return function
 
 
+def _load_compiled_template(package, name):
+    """ Import the precompiled module of a template and return its function.
+    """
+
+    package_name = package.replace("-", "_")
+    function_name = name.replace("-", "_")
+
+    module_name = ("compiled_templates.%s_package.%s"
+                   % (package_name, function_name))
+
+    try:
+        __import__(module_name)
+    except ImportError:
+        logging.info("Import error: %s" % traceback.format_exc())
+        return None
+
+    return getattr(sys.modules[module_name], function_name)
+
+
+def get_template_function(package, name):
+    """ Return the function that renders a template, or None if there isn't
+    one.
+    """
+
+    if App.is_dev_server:
+        # In dev mode, load all templates dynamically
+        return handlebars_dynamic_load(package, name)
+
+    key = (package, name)
+    if key not in _template_functions:
+        _template_functions[key] = _load_compiled_template(package, name)
+
+    return _template_functions[key]
+
+
 def handlebars_check_context(obj, path="context"):
     """ Validate parameters to Handlebars renderer.
 
@@ -140,35 +205,12 @@ def handlebars_template(package, name, context):
 
     handlebars_check_context(context)
 
-    package_name = package.replace("-", "_")
-    function_name = name.replace("-", "_")
-
     # Enable for debugging
     if False:
         logging.info("Rendering template %s.%s with context: %s" %
             (package, name, api.jsonify.jsonify(context)))
 
-    module_name = ("compiled_templates.%s_package.%s"
-                   % (package_name, function_name))
-
-    function = None
-
-    if App.is_dev_server:
-        # In dev mode, load all templates dynamically
-        function = handlebars_dynamic_load(package, name)
-
-    else:
-        # In production mode, dynamically load the compiled template module and
-        # find the function
-
-        if not module_name in sys.modules:
-            try:
-                __import__(module_name)
-            except ImportError:
-                logging.info("Import error: %s" % traceback.format_exc())
-
-        if module_name in sys.modules:
-            function = getattr(sys.modules[module_name], function_name)
+    function = get_template_function(package, name)
 
     if function:
         try:
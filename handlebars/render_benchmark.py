@@ -0,0 +1,91 @@
+"""Time render_from_jinja on the Handlebars templates topic pages render.
+
+Each template is rendered with the context in its .handlebars.json test
+file. render_from_jinja looks the template up in render.py's registry, so
+only its first call loads it. For comparison, "compile" also times
+compiling the template from source on every call, which is what the dev
+server used to do for each render.
+
+From the dev server's interactive console:
+
+    from handlebars import render_benchmark
+    render_benchmark.benchmark()
+"""
+
+import time
+
+import simplejson
+
+from handlebars import render
+
+# The templates rendered on the server for topic and video pages, and for
+# the topic browser in the header of every page
+TOPIC_PAGE_TEMPLATES = [
+    ("topic", "root-topic-view"),
+    ("topic", "content-topic-videos"),
+    ("topic", "subtopic-nav"),
+    ("video", "video-nav"),
+    ("video", "video-header"),
+    ("video", "video-description"),
+    ("video", "video-footer"),
+    ("shared", "topic-browser-pulldown"),
+]
+
+
+def _read(package, name, extension):
+    in_file = open("clienttemplates/%s-package/%s.%s"
+                   % (package, name, extension), "r")
+    try:
+        return in_file.read()
+    finally:
+        in_file.close()
+
+
+def _compile_and_render(package, name, context):
+    function = render.compile_template(
+        unicode(_read(package, name, "handlebars")))
+    return u"".join(function(context,
+                             helpers=render.handlebars_helpers,
+                             partials=render.handlebars_partials))
+
+
+def _time(fxn, iterations):
+    """Return the best time of several calls of fxn, in seconds."""
+    best = None
+    for _ in xrange(iterations):
+        start = time.time()
+        fxn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(iterations=20):
+    """Time rendering each of TOPIC_PAGE_TEMPLATES.
+
+    Returns a dict of (package, name) to a dict with the best time in
+    seconds of render_from_jinja and of compiling and rendering, and prints
+    them in milliseconds.
+    """
+    results = {}
+    for package, name in TOPIC_PAGE_TEMPLATES:
+        context = simplejson.loads(_read(package, name, "handlebars.json"))
+
+        results[(package, name)] = {
+            "render_from_jinja": _time(
+                lambda: render.render_from_jinja(package, name, context),
+                iterations),
+            "compile": _time(
+                lambda: _compile_and_render(package, name, context),
+                iterations),
+        }
+
+    for package, name in TOPIC_PAGE_TEMPLATES:
+        result = results[(package, name)]
+        print "%-32s %7.2fms render_from_jinja %7.2fms compile" % (
+            "%s/%s:" % (package, name),
+            1000.0 * result["render_from_jinja"],
+            1000.0 * result["compile"])
+
+    return results
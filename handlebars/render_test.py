@@ -0,0 +1,123 @@
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from handlebars import render
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class TemplateFunctionTest(unittest.TestCase):
+    def setUp(self):
+        super(TemplateFunctionTest, self).setUp()
+        self.patchers = [
+            mock.patch.object(render, "_template_functions", {}),
+            mock.patch.object(render, "_dynamic_templates", {}),
+            mock.patch.object(render, "handlebars_partials", {}),
+            mock.patch.object(render.App, "is_dev_server", False),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(TemplateFunctionTest, self).tearDown()
+
+    def test_production_imports_module_once(self):
+        function = lambda context, helpers, partials: [u"hi"]
+        with mock.patch.object(render, "__import__", create=True) as importer:
+            with mock.patch.dict("sys.modules", {
+                    "compiled_templates.shared_package.skill_bar":
+                    mock.Mock(skill_bar=function)}):
+                self.assertEqual(function, render.get_template_function(
+                    "shared", "skill-bar"))
+                self.assertEqual(function, render.get_template_function(
+                    "shared", "skill-bar"))
+        importer.assert_called_once_with(
+            "compiled_templates.shared_package.skill_bar")
+
+    def test_production_caches_missing_template(self):
+        with mock.patch.object(render, "_load_compiled_template",
+                               return_value=None) as load:
+            self.assertEqual(None, render.get_template_function(
+                "shared", "no-such-template"))
+            self.assertEqual(None, render.get_template_function(
+                "shared", "no-such-template"))
+        self.assertEqual(1, load.call_count)
+        self.assertEqual(
+            None, render._template_functions[("shared", "no-such-template")])
+
+
+class DynamicLoadTest(unittest.TestCase):
+    """handlebars_dynamic_load, in a directory of its own templates."""
+
+    def setUp(self):
+        super(DynamicLoadTest, self).setUp()
+        self.orig_cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.makedirs("clienttemplates/test-package")
+        self.write("page", u"<p>{{#if name}}{{name}}{{else}}?{{/if}}"
+                           u"{{> test_footer}}</p>")
+        self.write("footer", u"<i>{{name}}</i>")
+
+        self.patchers = [
+            mock.patch.object(render, "_dynamic_templates", {}),
+            mock.patch.object(render, "handlebars_partials", {}),
+            mock.patch.object(render.App, "is_dev_server", True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        os.chdir(self.orig_cwd)
+        shutil.rmtree(self.tmpdir)
+        super(DynamicLoadTest, self).tearDown()
+
+    def write(self, name, source, modified=1000000000):
+        file_name = "clienttemplates/test-package/%s.handlebars" % name
+        with open(file_name, "w") as out_file:
+            out_file.write(source)
+        with open(file_name + ".json", "w") as out_file:
+            out_file.write("{}")
+        os.utime(file_name, (modified, modified))
+
+    def compiled(self):
+        """Load the page template and return the sources compiled."""
+        with mock.patch.object(
+                render, "compile_template",
+                side_effect=render.compile_template) as compiler:
+            render.get_template_function("test", "page")
+        return [args[0] for args, _ in compiler.call_args_list]
+
+    def render_page(self, name):
+        return render.handlebars_template("test", "page", {"name": name})
+
+    def test_compiles_page_and_partial_once(self):
+        self.assertEqual(2, len(self.compiled()))
+        self.assertEqual([], self.compiled())
+        self.assertEqual(u"<p>Ann<i>Ann</i></p>", self.render_page("Ann"))
+        self.assertEqual(u"<p>?<i></i></p>", self.render_page(""))
+
+    def test_recompiles_changed_partial(self):
+        self.compiled()
+        self.write("footer", u"<b>{{name}}</b>", modified=1000000001)
+        self.assertEqual([u"<b>{{name}}</b>"], self.compiled())
+        self.assertEqual(u"<p>Ann<b>Ann</b></p>", self.render_page("Ann"))
+
+    def test_recompiles_changed_template(self):
+        self.compiled()
+        self.write("page", u"<div>{{> test_footer}}</div>",
+                   modified=1000000001)
+        self.assertEqual([u"<div>{{> test_footer}}</div>"], self.compiled())
+        self.assertEqual(u"<div><i>Ann</i></div>", self.render_page("Ann"))
@@ -28,24 +28,34 @@ Not everything are upsides. You can not use it on every case because:
   at least. You can cache somethings but not everything.
 """
 
-# TODO(chris): implement an LRU cache. currently we store all sorts of
-# things in instance memory by default via layer_cache, and these
-# things might never be reaped.
 
-import time
+# Entries are kept in least-recently-used order and each one is charged an
+# approximate size in bytes when it is set. Keys are grouped into namespaces
+# by key prefix (see set_budget); when a namespace goes over its byte budget
+# the least recently used entries in that namespace are evicted until it fits
+# again. Keys that don't match a registered prefix share the default
+# namespace, "".
+#
+# Example, to give the topic tree caches their own 16MB budget so that a
+# burst of other cached values can't push them out:
+#
+# instance_cache.set_budget("__layer_cache_topic_models.", 16 * 1024 * 1024)
+
+import collections
 import logging
 import os
+import sys
+import time
 
 try:
     import threading
 except ImportError:
     import dummy_threading as threading
 
-_CACHE = {}
 _CACHE_LOCK = threading.RLock()
 
 """ Flag to deactivate it on local environment. """
-ACTIVE = (not os.environ.get('SERVER_SOFTWARE').startswith('Devel') or
+ACTIVE = (not os.environ.get('SERVER_SOFTWARE', '').startswith('Devel') or
           os.environ.get('FAKE_PROD_APPSERVER'))
 
 """
@@ -54,6 +64,149 @@ Value in seconds.
 """
 DEFAULT_CACHING_TIME = None
 
+""" Byte budget for keys that don't fall into a registered namespace. """
+DEFAULT_BUDGET_BYTES = 48 * 1024 * 1024
+
+""" Containers with more items than this are sized from a sample. """
+_SIZE_SAMPLE_LENGTH = 50
+
+""" How deep into nested containers we look when sizing a value. """
+_SIZE_MAX_DEPTH = 6
+
+""" The most values we look at when sizing one value, however nested. """
+_SIZE_MAX_NODES = 1000
+
+# Captured here because this module's set() shadows the builtin below
+_SEQUENCE_TYPES = (list, tuple, set, frozenset)
+
+
+class _Namespace(object):
+    """The entries, byte budget and counters for one key prefix."""
+
+    def __init__(self, prefix, budget):
+        self.prefix = prefix
+        self.budget = budget
+        # key -> (value, expiry, size), oldest first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+        return entry
+
+    def evict_to_fit(self, incoming_size):
+        while self.entries and self.size + incoming_size > self.budget:
+            key, (_, _, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "budget": self.budget,
+            "size": self.size,
+            "count": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+_NAMESPACES = {"": _Namespace("", DEFAULT_BUDGET_BYTES)}
+
+# Registered prefixes, longest first, so the most specific one wins.
+_PREFIXES = []
+
+
+def _namespace_for_key(key):
+    for prefix in _PREFIXES:
+        if key.startswith(prefix):
+            return _NAMESPACES[prefix]
+    return _NAMESPACES[""]
+
+
+def _estimate_size(value, depth=0, nodes=None):
+    """Approximate the memory held by value, in bytes.
+
+    This is deliberately cheap rather than exact: large containers are
+    sized from a sample of their items, nesting is only followed a few
+    levels deep and at most _SIZE_MAX_NODES values are looked at in all.
+    nodes is the one-item list holding how many are left.
+    """
+    if nodes is None:
+        nodes = [_SIZE_MAX_NODES]
+    nodes[0] -= 1
+
+    size = sys.getsizeof(value, 0)
+    if (depth >= _SIZE_MAX_DEPTH or nodes[0] <= 0 or
+            isinstance(value, basestring)):
+        return size
+
+    if isinstance(value, dict):
+        count = len(value)
+        sample = []
+        for k, v in _take(value.iteritems(), _SIZE_SAMPLE_LENGTH):
+            if nodes[0] <= 0:
+                break
+            sample.append(_estimate_size(k, depth + 1, nodes) +
+                          _estimate_size(v, depth + 1, nodes))
+    elif isinstance(value, _SEQUENCE_TYPES):
+        count = len(value)
+        sample = []
+        for v in _take(iter(value), _SIZE_SAMPLE_LENGTH):
+            if nodes[0] <= 0:
+                break
+            sample.append(_estimate_size(v, depth + 1, nodes))
+    elif hasattr(value, "__dict__"):
+        return size + _estimate_size(value.__dict__, depth + 1, nodes)
+    else:
+        return size
+
+    if sample:
+        size += sum(sample) * count // len(sample)
+    return size
+
+
+def _take(iterator, n):
+    result = []
+    for item in iterator:
+        result.append(item)
+        if len(result) >= n:
+            break
+    return result
+
+
+def set_budget(prefix, budget):
+    """Give keys starting with prefix their own LRU with budget bytes.
+
+    Entries already cached under the prefix are moved into the new
+    namespace. Passing the empty prefix changes the default budget.
+    """
+    with _CACHE_LOCK:
+        namespace = _NAMESPACES.get(prefix)
+        if namespace is None:
+            namespace = _NAMESPACES[prefix] = _Namespace(prefix, budget)
+            _PREFIXES.append(prefix)
+            _PREFIXES.sort(key=len, reverse=True)
+
+            for other in _NAMESPACES.values():
+                if other is namespace:
+                    continue
+                for key in other.entries.keys():
+                    if _namespace_for_key(key) is namespace:
+                        namespace.entries[key] = other.pop(key)
+                        namespace.size += namespace.entries[key][2]
+        else:
+            namespace.budget = budget
+
+        namespace.evict_to_fit(0)
+
 
 def get(key):
     """ Gets the data associated to the key or a None """
@@ -61,21 +214,24 @@ def get(key):
         return None
 
     with _CACHE_LOCK:
-        entry = _CACHE.get(key, None)
+        namespace = _namespace_for_key(key)
+        entry = namespace.pop(key)
         if entry is None:
+            namespace.misses += 1
             return None
 
-        value, expiry = entry
-        if expiry == None:
-            return value
-
-        current_timestamp = time.time()
-        if current_timestamp < expiry:
-            return value
-        else:
-            del _CACHE[key]
+        value, expiry, size = entry
+        if expiry is not None and time.time() >= expiry:
+            namespace.expirations += 1
+            namespace.misses += 1
             return None
 
+        # Re-insert to mark this key as the most recently used
+        namespace.entries[key] = entry
+        namespace.size += size
+        namespace.hits += 1
+        return value
+
 
 def set(key, value, expiry=DEFAULT_CACHING_TIME):
     """
@@ -88,9 +244,24 @@ def set(key, value, expiry=DEFAULT_CACHING_TIME):
     if expiry != None:
         expiry = time.time() + int(expiry)
 
+    # Sizing walks the value, so do it before taking the lock
+    size = _estimate_size(value)
+
     try:
         with _CACHE_LOCK:
-            _CACHE[key] = (value, expiry)
+            namespace = _namespace_for_key(key)
+            namespace.pop(key)
+
+            if size > namespace.budget:
+                logging.info("%s not caching key '%s': %i bytes is over the "
+                             "budget of %i for namespace '%s'" %
+                             (__name__, key, size, namespace.budget,
+                              namespace.prefix))
+                return None
+
+            namespace.evict_to_fit(size)
+            namespace.entries[key] = (value, expiry, size)
+            namespace.size += size
     except MemoryError:
         # It doesn't seems to catch the exception, something in the
         # GAE's python runtime probably.
@@ -104,23 +275,33 @@ def delete(key):
     instead.
     """
     with _CACHE_LOCK:
-        _CACHE.pop(key, None)
+        _namespace_for_key(key).pop(key)
 
 
 def dump():
     """
-    Returns the cache dictionary with all the data of the current
-    instance, not all the instances.  There's no reason to use it
+    Returns the data and counters of the current instance, not all the
+    instances, as a dict of namespace prefix to a dict with the namespace's
+    "entries" (key -> (value, expiry)) and "stats" (budget, size, count,
+    hits, misses, evictions and expirations). There's no reason to use it
     except for debugging when developing.
     """
-    return _CACHE
+    with _CACHE_LOCK:
+        return dict(
+            (prefix, {
+                "entries": dict((key, entry[:2])
+                                for key, entry in namespace.entries.iteritems()),
+                "stats": namespace.stats(),
+            })
+            for prefix, namespace in _NAMESPACES.iteritems())
 
 
 def flush():
     """
     Resets the cache of the current instance, not all the instances.
+    Namespace budgets are kept but their data and counters are cleared.
     There's no reason to use it except for debugging when developing.
     """
-    global _CACHE
     with _CACHE_LOCK:
-        _CACHE = {}
+        for prefix, namespace in _NAMESPACES.items():
+            _NAMESPACES[prefix] = _Namespace(prefix, namespace.budget)
@@ -0,0 +1,99 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import instance_cache
+
+
+class InstanceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(InstanceCacheTest, self).setUp()
+        self.orig_active = instance_cache.ACTIVE
+        instance_cache.ACTIVE = True
+        instance_cache.flush()
+        # A budget big enough for a handful of 1000 character strings
+        instance_cache.set_budget("test_lru_", 5000)
+
+    def tearDown(self):
+        instance_cache.flush()
+        instance_cache.ACTIVE = self.orig_active
+        super(InstanceCacheTest, self).tearDown()
+
+    def stats(self, prefix="test_lru_"):
+        return instance_cache.dump()[prefix]["stats"]
+
+    def test_get_returns_value_that_was_set(self):
+        instance_cache.set("key", [1, 2, 3])
+        self.assertEqual([1, 2, 3], instance_cache.get("key"))
+
+    def test_expired_values_are_not_returned(self):
+        instance_cache.set("key", "value", expiry=-1)
+        self.assertIsNone(instance_cache.get("key"))
+        self.assertEqual(1, self.stats("")["expirations"])
+
+    def test_least_recently_used_key_is_evicted_over_budget(self):
+        for i in range(4):
+            instance_cache.set("test_lru_%i" % i, "x" * 1000)
+        # Touch the oldest key so that test_lru_1 becomes the oldest
+        instance_cache.get("test_lru_0")
+        instance_cache.set("test_lru_4", "x" * 1000)
+        instance_cache.set("test_lru_5", "x" * 1000)
+
+        self.assertIsNotNone(instance_cache.get("test_lru_0"))
+        self.assertIsNone(instance_cache.get("test_lru_1"))
+        self.assertIsNotNone(instance_cache.get("test_lru_5"))
+        self.assertTrue(self.stats()["size"] <= 5000)
+        self.assertTrue(self.stats()["evictions"] >= 1)
+
+    def test_namespace_budget_does_not_evict_other_namespaces(self):
+        instance_cache.set("other_key", "value")
+        for i in range(10):
+            instance_cache.set("test_lru_%i" % i, "x" * 1000)
+        self.assertEqual("value", instance_cache.get("other_key"))
+
+    def test_value_bigger_than_budget_is_not_cached(self):
+        instance_cache.set("test_lru_small", "x")
+        instance_cache.set("test_lru_big", "x" * 10000)
+        self.assertIsNone(instance_cache.get("test_lru_big"))
+        self.assertEqual("x", instance_cache.get("test_lru_small"))
+
+    def test_dump_counts_hits_and_misses(self):
+        instance_cache.set("test_lru_key", "value")
+        instance_cache.get("test_lru_key")
+        instance_cache.get("test_lru_missing")
+        stats = self.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(1, stats["count"])
+
+    def test_set_budget_moves_existing_entries(self):
+        instance_cache.set("test_moved_key", "value")
+        instance_cache.set_budget("test_moved_", 1000)
+        self.assertEqual("value", instance_cache.get("test_moved_key"))
+        self.assertEqual(1, self.stats("test_moved_")["count"])
+        self.assertEqual(0, self.stats("")["count"])
+
+    def test_size_estimate_grows_with_nested_values(self):
+        small = instance_cache._estimate_size({"a": [1]})
+        big = instance_cache._estimate_size({"a": ["x" * 1000] * 200})
+        self.assertTrue(big > small + 100000)
+
+    def test_size_estimate_visits_a_bounded_number_of_values(self):
+        calls = []
+        orig_estimate_size = instance_cache._estimate_size
+
+        def counting_estimate_size(*args):
+            calls.append(args)
+            return orig_estimate_size(*args)
+
+        instance_cache._estimate_size = counting_estimate_size
+        try:
+            # 50 ** 4 values if every level's sample were followed
+            nested = [[[[[0] * 50] * 50] * 50] * 50]
+            self.assertTrue(orig_estimate_size(nested) > 0)
+        finally:
+            instance_cache._estimate_size = orig_estimate_size
+
+        self.assertTrue(len(calls) < instance_cache._SIZE_MAX_NODES)
@@ -5,6 +5,7 @@ import datetime
 import logging
 import zlib
 import os
+import time
 
 from google.appengine.api import memcache
 from google.appengine.ext import db
@@ -81,6 +82,17 @@ else:
 #   ... do lots of long-running work...
 #   return result_for_cache
 #
+# Cache many results at once when callers would otherwise loop over a cached
+# function. The decorated function takes a list of objects and returns a
+# list of results in the same order; key_fxn is applied to each object.
+# Cached results are looked up with one get_multi per layer and the function
+# is only called with the objects that missed:
+#
+# @layer_cache.cache_multi_with_key_fxn(lambda object: "layer_cache_key_for_object_%s" % object.id())
+# def calculate_object_averages(objects):
+#   ... do lots of long-running work, ideally batched ...
+#   return [result_for_object for object in objects]
+#
 # _____Manually busting the cache:_____
 #
 # When you call your cached function, just pass a special "bust_cache"
@@ -122,6 +134,21 @@ else:
 # compression and decompression time 
 # @layer_cache.cache(... compress_chunks=False)
 #
+# _____Avoiding stampedes on popular keys:_____
+#
+# When a popular key expires every concurrent request would otherwise
+# recompute it at once. Pass lease_seconds to make callers take a memcache
+# lease before recomputing; only the caller holding the lease runs the target
+# while the others are served the value in the permanent cache (see
+# permanent_key_fxn above) if there is one:
+# @layer_cache.cache(... lease_seconds=30, permanent_key_fxn=...)
+#
+# Pass soft_expiration to keep serving a cached value for up to `expiration`
+# seconds but have it refreshed once it is older than `soft_expiration`
+# seconds. The first caller to see the stale value takes the lease and
+# refreshes it; everyone else keeps getting the stale value meanwhile:
+# @layer_cache.cache(... expiration=60 * 60, soft_expiration=5 * 60)
+#
 # _____Disabling:_____
 #
 # You can disable layer_cache for the rest of the request by calling:
@@ -143,6 +170,11 @@ CHUNK_GENERATION_LENGTH = 16
 # Expire after 25 days by default
 DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS = 60 * 60 * 24 * 25 
 
+# How long a recompute lease is held for when soft_expiration is used without
+# an explicit lease_seconds. A caller that dies holding the lease only blocks
+# refreshes for this long.
+DEFAULT_LEASE_SECONDS = 60
+
 class Layers:
     Datastore = 1
     Memcache = 2
@@ -162,14 +194,17 @@ def cache(
         layer = Layers.Memcache | Layers.InAppMemory,
         persist_across_app_versions = False,
         use_chunks = False,
-        compress_chunks = True):
+        compress_chunks = True,
+        lease_seconds = None,
+        soft_expiration = None):
     def decorator(target):
         key = "__layer_cache_%s.%s__" % (target.__module__, target.__name__)
         def wrapper(*args, **kwargs):
             return layer_cache_check_set_return(target, 
                 lambda *args, **kwargs: key, expiration, layer,
                     persist_across_app_versions, None, use_chunks, 
-                    compress_chunks, *args, **kwargs)
+                    compress_chunks, lease_seconds, soft_expiration,
+                    *args, **kwargs)
         return wrapper
     return decorator
 
@@ -180,15 +215,146 @@ def cache_with_key_fxn(
         persist_across_app_versions = False,
         permanent_key_fxn = None,
         use_chunks = False,
-        compress_chunks = True):
+        compress_chunks = True,
+        lease_seconds = None,
+        soft_expiration = None):
     def decorator(target):
         def wrapper(*args, **kwargs):
             return layer_cache_check_set_return(target, key_fxn, expiration, 
                 layer, persist_across_app_versions, permanent_key_fxn, 
-                use_chunks, compress_chunks, *args, **kwargs)
+                use_chunks, compress_chunks, lease_seconds, soft_expiration,
+                *args, **kwargs)
+        return wrapper
+    return decorator
+
+def cache_multi_with_key_fxn(
+        key_fxn,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False):
+    def decorator(target):
+        def wrapper(objects, bust_cache=False):
+            return layer_cache_get_multi(target, key_fxn, objects, expiration,
+                layer, persist_across_app_versions, bust_cache)
         return wrapper
     return decorator
 
+def layer_cache_get_multi(
+        target,
+        key_fxn,
+        objects,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False,
+        bust_cache = False):
+    ''' Batched counterpart of layer_cache_check_set_return.
+
+    Returns a list with the result for each object in objects. Each layer is
+    read at most once for all keys, target is called once with the list of
+    objects that missed every layer, and the new results are written back
+    with one set_multi per layer.
+
+    Results are never chunked, so this is meant for many small values rather
+    than a few big ones. Objects whose key is None are always passed to
+    target and never cached.
+    '''
+    objects = list(objects)
+    keys = [key_fxn(obj) for obj in objects]
+
+    if request_cache.get("layer_cache_disabled"):
+        return [result.result if isinstance(result, UncachedResult)
+                else result for result in target(objects)]
+
+    namespace = App.version
+    if persist_across_app_versions:
+        namespace = None
+
+    results = {}
+    if not bust_cache:
+        remaining = [key for key in set(keys) if key is not None]
+
+        if remaining and layer & Layers.InAppMemory:
+            for key in remaining:
+                result = instance_cache.get(key)
+                if result is not None:
+                    results[key] = result
+            remaining = [key for key in remaining if key not in results]
+
+        if remaining and layer & Layers.Memcache:
+            found = memcache.get_multi(remaining, namespace=namespace)
+            for key, result in found.iteritems():
+                if isinstance(result, ChunkedResult):
+                    result = result.get_result(memcache, namespace=namespace)
+                if result is not None:
+                    results[key] = result
+                    if layer & Layers.InAppMemory:
+                        instance_cache.set(key, result, expiry=expiration)
+            remaining = [key for key in remaining if key not in results]
+
+        if remaining and layer & Layers.Datastore:
+            found = KeyValueCache.get_multi(remaining, namespace=namespace)
+            refill = {}
+            for key, result in found.iteritems():
+                if isinstance(result, ChunkedResult):
+                    result = result.get_result(KeyValueCache,
+                                               namespace=namespace)
+                if result is not None:
+                    results[key] = result
+                    refill[key] = result
+                    if layer & Layers.InAppMemory:
+                        instance_cache.set(key, result, expiry=expiration)
+            if refill and layer & Layers.Memcache:
+                memcache.set_multi(refill, time=expiration,
+                                   namespace=namespace)
+
+    # Compute each missing key once, even if several objects share it
+    missing_objects = []
+    missing_keys = []
+    seen_keys = set()
+    for obj, key in zip(objects, keys):
+        if key is None or (key not in results and key not in seen_keys):
+            missing_objects.append(obj)
+            missing_keys.append(key)
+            seen_keys.add(key)
+
+    uncached_results = {}
+    if missing_objects:
+        computed = list(target(missing_objects))
+        assert len(computed) == len(missing_objects), (
+            "%s returned %i results for %i objects" %
+            (target.__name__, len(computed), len(missing_objects)))
+
+        to_cache = {}
+        for obj, key, result in zip(missing_objects, missing_keys, computed):
+            if isinstance(result, UncachedResult):
+                result = result.result
+            elif key is not None:
+                to_cache[key] = result
+
+            if key is None:
+                uncached_results[id(obj)] = result
+            else:
+                results[key] = result
+
+        if to_cache:
+            if layer & Layers.InAppMemory:
+                for key, result in to_cache.iteritems():
+                    instance_cache.set(key, result, expiry=expiration)
+
+            if layer & Layers.Memcache:
+                failed_keys = memcache.set_multi(to_cache, time=expiration,
+                                                 namespace=namespace)
+                if failed_keys:
+                    logging.error("Memcache set_multi failed for %s" %
+                                  failed_keys)
+
+            if layer & Layers.Datastore:
+                KeyValueCache.set_multi(to_cache, time=expiration,
+                                        namespace=namespace)
+
+    return [uncached_results[id(obj)] if key is None else results[key]
+            for obj, key in zip(objects, keys)]
+
 def layer_cache_check_set_return(
         target,
         key_fxn,
@@ -198,6 +364,8 @@ def layer_cache_check_set_return(
         permanent_key_fxn = None,
         use_chunks = False,
         compress_chunks = True,
+        lease_seconds = None,
+        soft_expiration = None,
         *args,
         **kwargs):
 
@@ -250,6 +418,15 @@ def layer_cache_check_set_return(
                 
                 return result
         
+    def get_permanent_result():
+        if permanent_key_fxn is None:
+            return None
+        permanent_key = permanent_key_fxn(*args, **kwargs)
+        result = get_cached_result(permanent_key, namespace, expiration, layer)
+        if isinstance(result, SoftExpiringResult):
+            result = result.result
+        return result
+
     def set_cached_result(key, namespace, expiration, layer, result, 
                           use_chunks, compress_chunks):
         # Cache the result
@@ -328,21 +505,47 @@ def layer_cache_check_set_return(
     if persist_across_app_versions:
         namespace = None
 
+    if soft_expiration and not lease_seconds:
+        lease_seconds = DEFAULT_LEASE_SECONDS
+
+    # The value we are replacing, if it is only soft expired. It is served
+    # to everyone who doesn't get the lease and if the refresh fails.
+    stale_result = None
+    lease_key = None
+
     if not bust_cache:
 
         result = get_cached_result(key, namespace, expiration, layer)
-        if result is not None:
+        if isinstance(result, SoftExpiringResult):
+            if not result.is_stale():
+                return result.result
+            stale_result = result.result
+        elif result is not None:
             return result
 
+        if lease_seconds:
+            lease_key = _acquire_lease(key, namespace, lease_seconds)
+            if lease_key is None:
+                # Somebody else is recomputing this key right now
+                if stale_result is None:
+                    stale_result = get_permanent_result()
+                if stale_result is not None:
+                    return stale_result
+                # Nothing to serve in the meantime, so we have to compute it
+                # too
+
     try:
         result = target(*args, **kwargs)
 
     # an error happened trying to recompute the result, see if there is a value for it in the permanent cache
     except Exception, e:
-        if permanent_key_fxn is not None:
-            permanent_key = permanent_key_fxn(*args, **kwargs)
+        if stale_result is not None:
+            logging.info("resource is not available, serving stale result")
+            _release_lease(lease_key, namespace)
+            return stale_result
 
-            result = get_cached_result(permanent_key, namespace, expiration, layer)
+        if permanent_key_fxn is not None:
+            result = get_permanent_result()
 
             if result is not None:
                 logging.info("resource is not available, restoring from permanent cache")
@@ -351,12 +554,16 @@ def layer_cache_check_set_return(
                 key = key_fxn(*args, **kwargs)
 
                 #retreived item from permanent cache - save it to the more temporary cache and then return it
-                set_cached_result(key, namespace, expiration, layer, result, 
+                set_cached_result(key, namespace, expiration, layer,
+                                  SoftExpiringResult.wrap(result,
+                                                          soft_expiration),
                                   use_chunks, compress_chunks)
+                _release_lease(lease_key, namespace)
                 return result
 
         # could not retrieve item from a permanent cache, raise the error on up
         logging.exception(e)
+        _release_lease(lease_key, namespace)
         return 
         #raise
 
@@ -371,24 +578,121 @@ def layer_cache_check_set_return(
 
         # In case the key's value has been changed by target's execution
         key = key_fxn(*args, **kwargs)
-        set_cached_result(key, namespace, expiration, layer, result, 
+        set_cached_result(key, namespace, expiration, layer,
+                          SoftExpiringResult.wrap(result, soft_expiration),
                           use_chunks, compress_chunks)
 
+    _release_lease(lease_key, namespace)
     return result
 
+def _acquire_lease(key, namespace, lease_seconds):
+    ''' Tries to take the recompute lease for key. memcache.add only succeeds
+    for one caller until the lease is released or times out.
+
+    Returns the lease key if the lease was taken, otherwise None.
+    '''
+    lease_key = key + "__lease__"
+    if memcache.add(lease_key, True, time=lease_seconds, namespace=namespace):
+        return lease_key
+    return None
+
+def _release_lease(lease_key, namespace):
+    if lease_key is not None:
+        memcache.delete(lease_key, namespace=namespace)
+
+class _ChunkWriter(object):
+    ''' A file-like object that pickle_util.dump_to_file writes into. It
+    compresses what it is given as it arrives and cuts the output into chunks
+    of MAX_SIZE_OF_CACHE_CHUNKS, so the whole pickled string never has to be
+    held in memory at once.
+    '''
+
+    class TooLarge(Exception):
+        pass
+
+    # Don't call into zlib for every small write the pickler makes
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, compress):
+        self.compressor = zlib.compressobj() if compress else None
+        self.chunks = []
+        self.size = 0
+        self.raw_size = 0
+        self.checksum = 0
+        self._pending = []
+        self._pending_size = 0
+        self._buffer = []
+        self._buffer_size = 0
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size >= _ChunkWriter.BUFFER_SIZE:
+            self._flush_buffer()
+
+    def _flush_buffer(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        self.raw_size += len(data)
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self._add(data)
+
+    def _add(self, data):
+        if not data:
+            return
+
+        self.size += len(data)
+        if self.size > MAX_SIZE:
+            raise _ChunkWriter.TooLarge()
+
+        self.checksum = zlib.crc32(data, self.checksum)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        while self._pending_size >= MAX_SIZE_OF_CACHE_CHUNKS:
+            data = "".join(self._pending)
+            self.chunks.append(data[:MAX_SIZE_OF_CACHE_CHUNKS])
+            rest = data[MAX_SIZE_OF_CACHE_CHUNKS:]
+            self._pending = [rest]
+            self._pending_size = len(rest)
+
+    def close(self):
+        ''' Returns the list of chunks once everything has been written '''
+        self._flush_buffer()
+        if self.compressor:
+            self._add(self.compressor.flush())
+        if self._pending_size:
+            self.chunks.append("".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+        return self.chunks
+
+
 class ChunkedResult():
     ''' Allows for storing of data between 1MB and 32MB in size.  If compression
     is turned on then it will first compress the result and store it in this 
     object with data set, if it is now under 1MB, otherwise if after compression
     or if compression is turned off it will do a set_multi to store the result 
     in chunks.
+
+    The value is pickled and compressed incrementally straight into chunks,
+    and on the way back out every chunk is fetched with a single get_multi
+    and checked against the generation and checksum in the index before
+    being decompressed into one preallocated buffer.
     '''
 
+    # Version 1 results have no checksum or raw_size. They may still be in
+    # the cache and are read the old way.
+    VERSION = 2
+
     def __init__(self, 
                  chunk_list=None, 
                  generation=None, 
                  data=None, 
-                 compress=True):
+                 compress=True,
+                 checksum=None,
+                 raw_size=None):
         ''' Stores info on the data to be stored. Either chunk_list+generation 
         or data is set, but not both
 
@@ -400,6 +704,9 @@ class ChunkedResult():
                    single chunk, then data will store the compressed result
             compress: boolean saying whether we should compress the result
                       before storing and decompressing afterwards  
+            checksum: crc32 of the stored (possibly compressed) data across
+                      all chunks
+            raw_size: length of the pickled value before compression
         '''
         assert (bool(chunk_list and generation) ^ bool(data)), ("Either " 
                 "chunk_list+generation or data must be set, but not both")
@@ -409,6 +716,9 @@ class ChunkedResult():
         else: 
             self.data = data
         self.compress = compress
+        self.version = ChunkedResult.VERSION
+        self.checksum = checksum
+        self.raw_size = raw_size
         
     @staticmethod
     def set(key, value, time=None, namespace="", cache_class=memcache, 
@@ -418,38 +728,40 @@ class ChunkedResult():
         class cache_class is set to (memcache or KeyValueCache)
         '''
 
-        result = pickle_util.dump(value)
-        if compress:
-            result = zlib.compress(result)
-        
-        size = len(result)
-        if size > MAX_SIZE:
-            logging.warning("Not caching %s: %i is greater than maxsize %i" % 
-                            (key, size, MAX_SIZE))
+        writer = _ChunkWriter(compress)
+        try:
+            pickle_util.dump_to_file(value, writer)
+            chunks = writer.close()
+        except _ChunkWriter.TooLarge:
+            logging.warning("Not caching %s: it is greater than maxsize %i" % 
+                            (key, MAX_SIZE))
             return
             
         # if now that we have compressed the item it can fit within a single
         # 1MB object don't use the chunk_list, and it will save us from having
         # to do an extra round-trip on the gets
-        if size < MAX_SIZE_OF_CACHE_CHUNKS:
+        if len(chunks) == 1 and writer.size < MAX_SIZE_OF_CACHE_CHUNKS:
             return cache_class.set(key, 
-                                   ChunkedResult(data=result, 
-                                                 compress=compress),
+                                   ChunkedResult(data=chunks[0], 
+                                                 compress=compress,
+                                                 checksum=writer.checksum,
+                                                 raw_size=writer.raw_size),
                                    time=time,
                                    namespace=namespace)              
                                     
         mapping = {}
         chunk_list = []
         generation = os.urandom(CHUNK_GENERATION_LENGTH) 
-        for i, pos in enumerate(range(0, size, MAX_SIZE_OF_CACHE_CHUNKS)):
-            chunk = generation + result[pos : pos + MAX_SIZE_OF_CACHE_CHUNKS]                           
+        for i, chunk in enumerate(chunks):
             chunk_key = key + "__chunk%i__" % i
-            mapping[chunk_key] = chunk
+            mapping[chunk_key] = generation + chunk
             chunk_list.append(chunk_key)
 
         mapping[key] = ChunkedResult(chunk_list=chunk_list, 
-                                     generation= generation, 
-                                     compress=compress)
+                                     generation=generation, 
+                                     compress=compress,
+                                     checksum=writer.checksum,
+                                     raw_size=writer.raw_size)
         
         # Note: set_multi is not atomic so when we get we will need to make sure 
         # that all the keys are there and are part of the same set_multi 
@@ -469,49 +781,99 @@ class ChunkedResult():
         elif value is not None:
             cache_class.delete(key, namespace=namespace)
 
+    def _get_chunks(self, cache_class, namespace):
+        ''' Returns the payload of every chunk in order, or None if any chunk
+        is missing or belongs to a different set_multi than this index.
+        '''
+        chunked_results = cache_class.get_multi(self.chunk_list, 
+                                                namespace=namespace)
+        chunks = []
+        checksum = 0
+        for chunk_key in self.chunk_list:
+            if chunk_key not in chunked_results:
+                # if a chunk is missing then it is impossible to depickle
+                # so target func will need to be re-executed
+                return None
+
+            # It is possible that the results come some from a new value of
+            # a cached item and some from an old version of the cached item
+            # as set_multi is not atomic.  By adding a random generation 
+            # string to the beginning of each chunk we can be sure they are 
+            # all part of the same set, by checking if that string matches
+            # the one in the index
+            chunk_result = chunked_results[chunk_key]
+            chunk_generation = chunk_result[:CHUNK_GENERATION_LENGTH]
+            if chunk_generation != self.generation:
+                logging.warning("invalid chunk: wrong generation string" 
+                                " in chunk %s" % chunk_key)
+                return None
+
+            chunk = chunk_result[CHUNK_GENERATION_LENGTH:]
+            checksum = zlib.crc32(chunk, checksum)
+            chunks.append(chunk)
+
+        checksum_expected = getattr(self, "checksum", None)
+        if checksum_expected is not None and checksum != checksum_expected:
+            logging.warning("invalid ChunkedResult: checksum mismatch")
+            return None
+
+        return chunks
+
+    def _decompress(self, chunks):
+        ''' Decompresses chunks into a single buffer, preallocated when we
+        know the uncompressed size.
+        '''
+        decompressor = zlib.decompressobj()
+        raw_size = getattr(self, "raw_size", None)
+        if not raw_size:
+            return "".join(decompressor.decompress(chunk) for chunk in chunks
+                           ) + decompressor.flush()
+
+        data = bytearray(raw_size)
+        view = memoryview(data)
+        pos = 0
+        for chunk in chunks + [None]:
+            if chunk is None:
+                piece = decompressor.flush()
+            else:
+                piece = decompressor.decompress(chunk)
+            if pos + len(piece) > raw_size:
+                raise zlib.error("decompressed data is larger than expected")
+            view[pos:pos + len(piece)] = piece
+            pos += len(piece)
+        if pos != raw_size:
+            raise zlib.error("decompressed data is smaller than expected")
+        return buffer(data)
+
     def get_result(self, cache_class=memcache, namespace=""):
         '''If the results are stored within this ChunkedResult object it will 
         decompress, depickle and return it.  Otherwise it calls get_multi on the
-        cache_class for all items in its chunk_list, combines them together and
-        returns the descompressed and depickled result
+        cache_class for all items in its chunk_list, checks they all belong
+        together and returns the decompressed and depickled result
         '''
         if hasattr(self, "chunk_list"):
-            chunked_results = cache_class.get_multi(self.chunk_list, 
-                                                    namespace=namespace)
-            self.data = ""
-            for chunk_key in self.chunk_list:
-                if chunk_key not in chunked_results:
-                    # if a chunk is missing then it is impossible to depickle
-                    # so target func will need to be re-executed
-                    return None
-
-                # It is possible that the results come some from a new value of
-                # a cached item and some from an old version of the cached item
-                # as set_multi is not atomic.  By adding a random generation 
-                # string to the beginning of each chunk we can be sure they are 
-                # all part of the same set, by checking if that string matches
-                # the one in the index
-                chunk_result = chunked_results[chunk_key]
-                chunk_generation = chunk_result[:CHUNK_GENERATION_LENGTH]
-                if chunk_generation != self.generation:
-                    logging.warning("invalid chunk: wrong generation string" 
-                                    " in chunk %s" % chunk_key)
-                    return None
-
-                self.data += chunk_result[CHUNK_GENERATION_LENGTH:]          
-            
-        if self.compress:
-            try:
-                self.data = zlib.decompress(self.data)
-            except zlib.error:
-                # If for some reason the data coming back is corrupted so it 
-                # can't be decompressed, we return None in order to recaclulate 
-                # the target function
-                logging.warning("could not decompress ChunkedResult from cache")
+            chunks = self._get_chunks(cache_class, namespace)
+            if chunks is None:
                 return None
+        else:
+            chunks = [self.data]
+            
+        try:
+            if self.compress:
+                data = self._decompress(chunks)
+            elif len(chunks) == 1:
+                data = chunks[0]
+            else:
+                data = "".join(chunks)
+        except zlib.error:
+            # If for some reason the data coming back is corrupted so it 
+            # can't be decompressed, we return None in order to recaclulate 
+            # the target function
+            logging.warning("could not decompress ChunkedResult from cache")
+            return None
              
         try:
-            return pickle_util.load(self.data)
+            return pickle_util.load(data)
         except Exception:
             # If for some reason the data coming back is corrupted so it can't
             # be depickled, we will return None in order to recaclulate the 
@@ -536,6 +898,23 @@ class UncachedResult():
     def __init__(self, result):
         self.result = result
 
+# Results cached with soft_expiration are stored wrapped in a
+# SoftExpiringResult, which records when the result should be refreshed. The
+# wrapper is stored in every layer so freshness costs no extra cache lookups.
+class SoftExpiringResult():
+    def __init__(self, result, refresh_after):
+        self.result = result
+        self.refresh_after = refresh_after
+
+    def is_stale(self):
+        return time.time() >= self.refresh_after
+
+    @staticmethod
+    def wrap(result, soft_expiration):
+        if not soft_expiration:
+            return result
+        return SoftExpiringResult(result, time.time() + soft_expiration)
+
 class KeyValueCache(db.Model):
 
     value = db.BlobProperty()
@@ -69,6 +69,21 @@ class LayerCacheMemcacheTest(LayerCacheTest):
         memcache.set(self.key + "__chunk1__", "bad generation string")
         self.assertEqualTruncateError("a", self.cache_func("a"))
     
+    def test_should_throw_out_result_when_chunk_fails_checksum(self):
+        self.cache_func(_BIG_STRING)
+        index = memcache.get(self.key)
+        # Right generation but wrong contents, as from a partial overwrite
+        memcache.set(self.key + "__chunk1__", index.generation + "b" * 100)
+        self.assertEqualTruncateError("a", self.cache_func("a"))
+
+    def test_compressed_chunks_return_cached_result(self):
+        @layer_cache.cache(layer=layer_cache.Layers.Memcache, use_chunks=True)
+        def func(result):
+            return result
+
+        func(_BIG_STRING)
+        self.assertEqualTruncateError(_BIG_STRING, func("a"))
+
     def test_huge_memcache_set_should_fail_gracefully_and_reexecute(self):
         self.cache_func(_HUGE_STRING)
         self.assertEqualTruncateError("a", self.cache_func("a"))
@@ -264,3 +279,146 @@ class LayerCacheCompressionTest(LayerCacheTest):
         
         # make sure target func re-evaluates now that we deleted the key
         self.assertEqual("a", self.cache_func("a"))   
+
+
+class LayerCacheLeaseTest(LayerCacheTest):
+
+    def setUp(self):
+        self.calls = []
+
+        @layer_cache.cache_with_key_fxn(
+            lambda result: "__layer_cache_layer_cache_test.func__",
+            layer=layer_cache.Layers.Memcache,
+            permanent_key_fxn=lambda result: "permanent_func_key",
+            lease_seconds=30)
+        def func(result):
+            self.calls.append(result)
+            return result
+
+        self.cache_func = func
+        super(LayerCacheLeaseTest, self).setUp()
+
+    def test_lease_is_released_after_recompute(self):
+        self.cache_func("a")
+        self.assertIsNone(memcache.get(self.key + "__lease__",
+                                       namespace=layer_cache.App.version))
+
+    def test_contended_lease_serves_permanent_result(self):
+        self.cache_func("a")
+        memcache.delete(self.key, namespace=layer_cache.App.version)
+        # Pretend another request is recomputing the key
+        memcache.add(self.key + "__lease__", True,
+                     namespace=layer_cache.App.version)
+
+        self.assertEqual("a", self.cache_func("b"))
+        self.assertEqual(["a"], self.calls)
+
+    def test_contended_lease_without_fallback_recomputes(self):
+        memcache.add(self.key + "__lease__", True,
+                     namespace=layer_cache.App.version)
+        self.assertEqual("a", self.cache_func("a"))
+
+
+class LayerCacheSoftExpirationTest(LayerCacheTest):
+
+    def setUp(self):
+        self.calls = []
+
+        @layer_cache.cache(layer=layer_cache.Layers.Memcache,
+                           soft_expiration=60)
+        def func(result):
+            self.calls.append(result)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.cache_func = func
+        super(LayerCacheSoftExpirationTest, self).setUp()
+
+    def expire_softly(self):
+        value = memcache.get(self.key, namespace=layer_cache.App.version)
+        value.refresh_after = 0
+        memcache.set(self.key, value, namespace=layer_cache.App.version)
+
+    def test_fresh_result_is_served_from_cache(self):
+        self.cache_func("a")
+        self.assertEqual("a", self.cache_func("b"))
+        self.assertEqual(["a"], self.calls)
+
+    def test_stale_result_is_refreshed_by_lease_holder(self):
+        self.cache_func("a")
+        self.expire_softly()
+        self.assertEqual("b", self.cache_func("b"))
+        self.assertEqual("b", self.cache_func("c"))
+
+    def test_stale_result_is_served_while_lease_is_held(self):
+        self.cache_func("a")
+        self.expire_softly()
+        memcache.add(self.key + "__lease__", True,
+                     namespace=layer_cache.App.version)
+        self.assertEqual("a", self.cache_func("b"))
+        self.assertEqual(["a"], self.calls)
+
+    def test_stale_result_is_served_when_refresh_fails(self):
+        self.cache_func("a")
+        self.expire_softly()
+        self.assertEqual("a", self.cache_func(Exception("refresh failed")))
+
+
+class LayerCacheMultiTest(LayerCacheTest):
+
+    def setUp(self):
+        self.calls = []
+
+        @layer_cache.cache_multi_with_key_fxn(
+            lambda n: None if n is None else "multi_%s" % n,
+            layer=(layer_cache.Layers.Memcache |
+                   layer_cache.Layers.Datastore))
+        def func(numbers):
+            self.calls.append(numbers)
+            return [None if n is None else n * 2 for n in numbers]
+
+        self.cache_func = func
+        super(LayerCacheMultiTest, self).setUp()
+
+    def test_results_are_returned_in_order(self):
+        self.assertEqual([2, 4, 6], self.cache_func([1, 2, 3]))
+
+    def test_only_misses_are_computed(self):
+        self.cache_func([1, 2])
+        self.assertEqual([4, 6, 2], self.cache_func([2, 3, 1]))
+        self.assertEqual([[1, 2], [3]], self.calls)
+
+    def test_duplicate_objects_are_computed_once(self):
+        self.assertEqual([2, 2, 4], self.cache_func([1, 1, 2]))
+        self.assertEqual([[1, 2]], self.calls)
+
+    def test_missing_memcache_is_filled_from_datastore(self):
+        self.cache_func([1, 2])
+        memcache.flush_all()
+        self.assertEqual([2, 4], self.cache_func([1, 2]))
+        self.assertEqual([[1, 2]], self.calls)
+        self.assertEqual(
+            2, memcache.get("multi_1", namespace=layer_cache.App.version))
+
+    def test_bust_cache_recomputes_everything(self):
+        self.cache_func([1, 2])
+        self.cache_func([1, 2], bust_cache=True)
+        self.assertEqual([[1, 2], [1, 2]], self.calls)
+
+    def test_none_keys_are_not_cached(self):
+        self.assertEqual([2, None], self.cache_func([1, None]))
+        self.assertEqual([2, None], self.cache_func([1, None]))
+        self.assertEqual([[1, None], [None]], self.calls)
+
+    def test_uncached_results_are_unwrapped_when_disabled(self):
+        @layer_cache.cache_multi_with_key_fxn(lambda n: "uncached_%s" % n)
+        def func(numbers):
+            return [layer_cache.UncachedResult(n) for n in numbers]
+
+        self.assertEqual([1, 2], func([1, 2]))
+        layer_cache.disable()
+        try:
+            self.assertEqual([1, 2], func([1, 2]))
+        finally:
+            layer_cache.enable()
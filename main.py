@@ -53,6 +53,7 @@ import helpus
 import rssblog
 
 from third_party import search
+import search_index
 
 import request_handler
 from app import App
@@ -718,11 +719,16 @@ class Search(request_handler.RequestHandler):
         exvids_future = util.async_queries([exvids_query])
 
         # One full (non-partial) search, then sort by kind
-        all_text_keys = Topic.full_text_search(
-                query, limit=50, kind=None,
-                stemming=Topic.INDEX_STEMMING,
-                multi_word_literal=Topic.INDEX_MULTI_WORD,
-                searched_phrases_out=searched_phrases)
+        if gandalf("local_search_index"):
+            all_text_keys = search_index.full_text_search(
+                    query, limit=50, kind=["Topic", "Video"],
+                    searched_phrases_out=searched_phrases)
+        else:
+            all_text_keys = Topic.full_text_search(
+                    query, limit=50, kind=None,
+                    stemming=Topic.INDEX_STEMMING,
+                    multi_word_literal=Topic.INDEX_MULTI_WORD,
+                    searched_phrases_out=searched_phrases)
 
         # Quick title-only partial search
         topic_partial_results = filter(
@@ -100,6 +100,15 @@ def dump(obj):
     return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
 
 
+def dump_to_file(obj, f):
+    """Pickle obj by writing it to the file-like f: like pickle.dump(obj, f).
+
+    Useful for large objects, since f can consume the pickle as it is
+    produced instead of the whole pickled string being built in memory.
+    """
+    cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL).dump(obj)
+
+
 def load(s):
     """Return an unpickled object from s: equivalent to pickle.loads(s)."""
     unpickler = g_unpickler_class(cStringIO.StringIO(s))
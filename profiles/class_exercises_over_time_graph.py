@@ -1,4 +1,5 @@
 import exercise_models
+from exercises import progress_matrix
 
 
 class ExerciseData:
@@ -24,9 +25,9 @@ def class_exercises_over_time_graph_context(user_data, student_list):
         students_data = user_data.get_students_data()
   
     dict_student_exercises = {}
-    user_exercise_cache_list = exercise_models.UserExerciseCache.get(
-            students_data)
-    for i, user_data_student in enumerate(students_data):
+    matrix = progress_matrix.ProgressMatrix.get(students_data,
+                                                coach=user_data)
+    for j, user_data_student in enumerate(students_data):
         student_nickname = user_data_student.nickname
 
         dict_student_exercises[student_nickname] = {
@@ -36,16 +37,17 @@ def class_exercises_over_time_graph_context(user_data, student_list):
                 "exercises": [],
             }
 
-        for exercise, user_exercise in user_exercise_cache_list[i].dicts.iteritems():
-            if user_exercise["proficient_date"]:
-                joined = min(user_data_student.joined,
-                             user_exercise["proficient_date"])
-                days_until_proficient = (user_exercise["proficient_date"] - joined).days
-                proficient_date = user_exercise["proficient_date"].strftime('%m/%d/%Y')
+        for i, exercise in enumerate(matrix.exercise_names):
+            proficient_date = progress_matrix.datetime_from_seconds(
+                    matrix.proficient_date[i][j])
+            if proficient_date:
+                joined = min(user_data_student.joined, proficient_date)
+                days_until_proficient = (proficient_date - joined).days
                 data = ExerciseData(student_nickname, exercise,
-                                    days_until_proficient, proficient_date)
+                                    days_until_proficient,
+                                    proficient_date.strftime('%m/%d/%Y'))
                 dict_student_exercises[student_nickname]["exercises"].append(data)
-   
+
         dict_student_exercises[student_nickname]["exercises"].sort(
                 key=lambda k: k.days_until_proficient)
 
@@ -1,9 +1,14 @@
-from itertools import izip
+from templatefilters import timesince_ago
+from exercises import progress_matrix
 
-from jinja2.utils import escape
-
-from templatefilters import escapejs, timesince_ago
-from exercise_models import Exercise, UserExerciseGraph
+# What the report calls each status. Not started exercises are left blank.
+STATUS_TEXT = {
+    progress_matrix.REVIEW: "Herzien",
+    progress_matrix.PROFICIENT: "Gehaald",
+    progress_matrix.STRUGGLING: "Moeite",
+    progress_matrix.STARTED: "Gestart",
+    progress_matrix.NOT_STARTED: "",
+}
 
 
 def class_progress_report_graph_context(user_data, list_students):
@@ -12,88 +17,49 @@ def class_progress_report_graph_context(user_data, list_students):
 
     list_students = sorted(list_students, key=lambda student: student.nickname)
 
-    student_email_pairs = [(escape(s.email), (s.nickname[:14] + '...')
-                            if len(s.nickname) > 17
-                            else s.nickname)
-                           for s in list_students]
-    emails_escapejsed = [escapejs(s.email) for s in list_students]
-
-    exercises_all = Exercise.get_all_use_cache()
-    user_exercise_graphs = UserExerciseGraph.get(list_students)
-
-    exercises_found = []
-
-    for exercise in exercises_all:
-        for user_exercise_graph in user_exercise_graphs:
-            graph_dict = user_exercise_graph.graph_dict(exercise.name)
-            if graph_dict and graph_dict["total_done"]:
-                exercises_found.append(exercise)
-                break
-
-    exercise_names = [(e.name, e.display_name, escapejs(e.name))
-                      for e in exercises_found]
-
-    exercise_list = [{'name': e.name, 'display_name': e.display_name}
-                     for e in exercises_found]
-
-    exercise_data = {}
-
-    for (student, _, _, user_exercise_graph) in izip(list_students,
-                                                     student_email_pairs,
-                                                     emails_escapejsed,
-                                                     user_exercise_graphs):
-        student_email = student.email
-
-        for (exercise, (_, _, _)) in izip(exercises_found, exercise_names):
-
-            exercise_name = exercise.name
-            graph_dict = user_exercise_graph.graph_dict(exercise_name)
+    matrix = progress_matrix.ProgressMatrix.get(list_students,
+                                                coach=user_data)
 
-            status = ""
+    # The exercises any student has done a problem in
+    exercise_indices = [i for (i, total_done) in enumerate(matrix.total_done)
+                        if any(total_done)]
 
-            if graph_dict["proficient"]:
+    exercise_list = [{'name': matrix.exercise_names[i],
+                      'display_name': matrix.exercise_display_names[i]}
+                     for i in exercise_indices]
 
-                if graph_dict["reviewing"]:
-                    status = "Herzien"
-                else:
-                    status = "Gehaald"
-                    if not graph_dict["explicitly_proficient"]:
-                        status = ("Gehaald")
+    student_row_data = []
 
-            elif graph_dict["struggling"]:
-                status = "Moeite"
-            elif graph_dict["total_done"] > 0:
-                status = "Gestart"
+    # Students only have rows if there are exercises to show
+    for (j, student) in enumerate(list_students if exercise_indices else []):
+        exercises = []
 
-            if student_email not in exercise_data:
-                exercise_data[student_email] = {
-                    'email': student.email,
-                    'nickname': student.nickname,
-                    'profile_root': student.profile_root,
-                    'exercises': []
-                }
+        for i in exercise_indices:
+            status = STATUS_TEXT[matrix.columns[i][j]]
 
             if len(status) > 0:
-                exercise_data[student_email]['exercises'].append({
+                last_done = progress_matrix.datetime_from_seconds(
+                    matrix.last_done[i][j])
+                exercises.append({
                     "status": status,
-                    "progress": graph_dict["progress"],
-                    "total_done": graph_dict["total_done"],
-                    "last_done": (graph_dict["last_done"]
-                                  if (graph_dict["last_done"] and
-                                      graph_dict["last_done"].year > 1)
-                                  else ''),
-                    "last_done_ago": (timesince_ago(graph_dict["last_done"])
-                                      if (graph_dict["last_done"] and
-                                          graph_dict["last_done"].year > 1)
-                                      else '')
+                    "progress": matrix.progress[i][j],
+                    "total_done": matrix.total_done[i][j],
+                    "last_done": last_done or '',
+                    "last_done_ago": (timesince_ago(last_done)
+                                      if last_done else '')
                 })
             else:
-                exercise_data[student_email]['exercises'].append({
-                    "name": exercise_name,
+                exercises.append({
+                    "name": matrix.exercise_names[i],
                     "status": status,
                 })
 
-    student_row_data = [data for (_, data) in exercise_data.iteritems()]
+        student_row_data.append({
+            'email': student.email,
+            'nickname': student.nickname,
+            'profile_root': student.profile_root,
+            'exercises': exercises,
+        })
 
     return {
         'exercise_names': exercise_list,
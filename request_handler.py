@@ -185,6 +185,24 @@ class RequestInputHandler(object):
         else:
             return self.request_int(key, 1 if default else 0) == 1
 
+def _prefetch_user_template_values(user_data):
+    """Fetch the entities behind global_goals and badges_earned at once.
+
+    Both usually take a datastore round-trip of their own, so this starts
+    them together and request caches the results for them to use.
+    """
+    finishers = [goals.models.GoalList.prefetch_current_goals(user_data)]
+
+    # badges_earned pops the current user's notifications
+    current_user_data = user_models.UserData.current()
+    if current_user_data and current_user_data.has_notification:
+        finishers.append(user_models.UserNotificationGroup
+                         .prefetch_for_user_data(current_user_data))
+
+    for finish in finishers:
+        finish()
+
+
 class RequestHandler(webapp2.RequestHandler, RequestInputHandler):
 
     class __metaclass__(type):
@@ -458,11 +476,15 @@ class RequestHandler(webapp2.RequestHandler, RequestInputHandler):
 
         template_values['server_time'] = time.time()
 
+        # Values that may need the datastore, memcache or gandalf are
+        # LazyTemplateValues, so they're only computed if the template uses
+        # them. Code that needs one of them should shared_jinja.resolve() it.
+        lazy = shared_jinja.LazyTemplateValue
+
         # TODO(marcia): Remove username, points, logged_in template values
         # since they should be encapsulated in this UserProfile object
-        logged_in_user_profile = util_profile.UserProfile.from_user(user_data,
-                                                                    user_data)
-        template_values['logged_in_user_profile'] = logged_in_user_profile
+        template_values['logged_in_user_profile'] = lazy(
+            lambda: util_profile.UserProfile.from_user(user_data, user_data))
 
         # TODO(benkomalo): rename this global template property from "username"
         #    as it's not really the user's username, but just a display name.
@@ -474,11 +496,11 @@ class RequestHandler(webapp2.RequestHandler, RequestInputHandler):
         # Always insert a post-login request before our continue url
         template_values['continue'] = url_util.create_post_login_url(
             template_values.get('continue') or self.request.uri)
-        template_values['login_url'] = ('%s&direct=1' %
-                                        url_util.create_login_url(
-                                            template_values['continue']))
-        template_values['logout_url'] = url_util.create_logout_url(
-            self.request.uri)
+        continue_url = template_values['continue']
+        template_values['login_url'] = lazy(
+            lambda: '%s&direct=1' % url_util.create_login_url(continue_url))
+        template_values['logout_url'] = lazy(
+            lambda: url_util.create_logout_url(self.request.uri))
 
         # TODO(stephanie): these settings are temporary; for FB testing purposes only
         template_values['site_base_url'] = 'http://%s' % os.environ["HTTP_HOST"]
@@ -500,10 +522,12 @@ class RequestHandler(webapp2.RequestHandler, RequestInputHandler):
         template_values['hide_analytics'] = hide_analytics
 
         # client-side error logging
-        template_values['include_errorception'] = gandalf('errorception')
+        template_values['include_errorception'] = lazy(
+            lambda: gandalf('errorception'))
 
         # Analytics
-        template_values['mixpanel_enabled'] = gandalf('mixpanel_enabled')
+        template_values['mixpanel_enabled'] = lazy(
+            lambda: gandalf('mixpanel_enabled'))
 
         # Enable for Mixpanel testing only
         # You will need to ask Tom, Kitt, or Marcia to add you to the "Khan
@@ -513,29 +537,44 @@ class RequestHandler(webapp2.RequestHandler, RequestInputHandler):
             template_values['mixpanel_enabled'] = True
             template_values['hide_analytics'] = False
 
-        if template_values['mixpanel_enabled']:
-            template_values['mixpanel_id'] = gae_bingo.identity.identity()
+        # Only looked up by templates if mixpanel_enabled
+        template_values['mixpanel_id'] = lazy(gae_bingo.identity.identity)
 
         if not template_values['hide_analytics']:
-            superprops_list = user_models.UserData.get_analytics_properties(user_data)
+            superprops_list = lazy(
+                lambda: user_models.UserData.get_analytics_properties(
+                    user_data))
 
             # Create a superprops dict for MixPanel with a version number
             # Bump the version number if changes are made to the client-side
             # analytics code and we want to be able to filter by version.
-            template_values['mixpanel_superprops'] = dict(superprops_list)
+            template_values['mixpanel_superprops'] = lazy(
+                lambda: dict(superprops_list.get()))
 
             # Copy over first 4 per-user properties for GA
             # (The 5th is reserved for Bingo)
-            template_values['ga_custom_vars'] = superprops_list[0:4]
+            template_values['ga_custom_vars'] = lazy(
+                lambda: superprops_list.get()[0:4])
 
-        if user_data:
+        # Whichever of global_goals and badges_earned is computed first
+        # fetches what both need at the same time
+        prefetch = lazy(lambda: _prefetch_user_template_values(user_data))
+
+        def global_goals():
+            if not user_data:
+                return None
+            prefetch.get()
             user_goals = goals.models.GoalList.get_current_goals(user_data)
             goals_data = [g.get_visible_data() for g in user_goals]
             if goals_data:
-                template_values['global_goals'] = jsonify(goals_data)
-
-        badges_earned = badges.util_badges.get_badge_notifications_json()
-        template_values['badges_earned'] = badges_earned
+                return jsonify(goals_data)
+            return None
+        template_values['global_goals'] = lazy(global_goals)
+
+        def badges_earned():
+            prefetch.get()
+            return badges.util_badges.get_badge_notifications_json()
+        template_values['badges_earned'] = lazy(badges_earned)
 
         # Disable topic browser in the header on mobile devices
         template_values['watch_topic_browser_enabled'] = not self.is_mobile_capable()
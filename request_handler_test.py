@@ -5,6 +5,7 @@ from google.appengine.ext import db
 import webapp2
 
 import request_handler
+import shared_jinja
 from testutil import gae_model
 import user_models
 
@@ -94,3 +95,25 @@ class RequestHandlerTest(gae_model.GAEModelTestCase):
         location_header_value = handler.response.headers['Location']
         self.assertIsInstance(location_header_value, str)
         self.assertEqual("http://encode.me/%E2%80%A1", location_header_value)
+
+    def test_global_template_values_are_lazy(self):
+        actor = self.make_user("actor")
+        self.fake_request(current_user=actor)
+
+        with mock.patch.dict("os.environ", {"HTTP_HOST": "localhost"}):
+            with mock.patch("request_handler.gandalf") as gandalf_mock:
+                gandalf_mock.return_value = True
+                template_values = self.handler.add_global_template_values({})
+                self.assertEquals(0, gandalf_mock.call_count)
+
+                self.assertTrue(shared_jinja.resolve(
+                    template_values["mixpanel_enabled"]))
+                self.assertEquals(1, gandalf_mock.call_count)
+
+                # Only computed once
+                shared_jinja.resolve(template_values["mixpanel_enabled"])
+                self.assertEquals(1, gandalf_mock.call_count)
+
+        self.assertEquals(actor.key(), template_values["user_data"].key())
+        self.assertEquals(None, shared_jinja.resolve(
+            template_values["global_goals"]))
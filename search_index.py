@@ -0,0 +1,235 @@
+"""A local, in-memory alternative to the datastore full text search.
+
+Searchable.full_text_search answers every query with a merge join of
+"phrases =" filters over StemmedIndex entities, and a second query when
+the multi-word literal match comes up short. InvertedIndex instead holds
+postings lists (document numbers with term frequencies) for every stemmed
+term in the topics, videos and exercises of a topic version. It is built
+once per version, stored as a single blob, kept in instance memory, and
+ranks matches with BM25 without touching the datastore.
+
+Use full_text_search() below in place of Searchable.full_text_search.
+"""
+
+import array
+import heapq
+import math
+
+from google.appengine.ext import db
+
+import exercise_models
+import layer_cache
+import setting_model
+import topic_models
+import video_models
+from third_party import search
+from search.pyporter2 import Stemmer
+
+# BM25 parameters: how quickly repeated terms saturate, and how much
+# longer documents are penalized
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms in a title count this many times as much as other text
+TITLE_WEIGHT = 3
+
+# (title property, other properties) indexed for each kind
+INDEXED_PROPERTIES = {
+    "Topic": ("standalone_title", ["description"]),
+    "Video": ("title", ["keywords", "description"]),
+    "Exercise": ("display_name", ["description", "tags"]),
+}
+
+_stemmer = Stemmer.Stemmer("english")
+_stems = {}
+_MAX_STEMS = 50000
+
+
+def _stem(word):
+    stem = _stems.get(word)
+    if stem is None:
+        if len(_stems) >= _MAX_STEMS:
+            _stems.clear()
+        stem = _stems[word] = _stemmer.stemWord(word)
+    return stem
+
+
+def terms(text):
+    """Return the stemmed search terms in text, repeats included.
+
+    Words are split and filtered the same way Searchable does for
+    single-word phrases: punctuation separates words, and stop words and
+    words shorter than search.SEARCH_PHRASE_MIN_LENGTH are dropped.
+    """
+    if not text:
+        return []
+    if isinstance(text, list):
+        text = " ".join(text)
+
+    words = search.PUNCTUATION_REGEX.sub(" ", text).lower().split()
+    return [_stem(word) for word in words
+            if len(word) >= search.SEARCH_PHRASE_MIN_LENGTH and
+            word not in search.STOP_WORDS]
+
+
+class InvertedIndex(object):
+    """BM25-ranked term search over a fixed set of documents.
+
+    Documents are numbered in the order they were added. For each term,
+    postings[term] is a pair of arrays: the numbers of the documents
+    containing it, ascending, and how many times it occurs in each.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.titles = []
+        self.kinds = []
+        self.lengths = array.array("i")
+        self.postings = {}
+
+    def add(self, key, kind, title, text_terms):
+        """Add a document, given its (title-weighted) list of terms."""
+        doc = len(self.keys)
+        self.keys.append(str(key))
+        self.kinds.append(kind)
+        self.titles.append(title)
+        self.lengths.append(len(text_terms))
+
+        counts = {}
+        for term in text_terms:
+            counts[term] = counts.get(term, 0) + 1
+
+        for term, count in counts.iteritems():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array.array("i"),
+                                                  array.array("i"))
+            postings[0].append(doc)
+            postings[1].append(count)
+
+    def add_entity(self, entity):
+        kind = entity.kind()
+        title_property, text_properties = INDEXED_PROPERTIES[kind]
+        title = getattr(entity, title_property)
+
+        text_terms = terms(title) * TITLE_WEIGHT
+        for text_property in text_properties:
+            text_terms.extend(terms(getattr(entity, text_property)))
+
+        self.add(entity.key(), kind, title, text_terms)
+
+    def search(self, phrase, limit=10, kind=None, searched_phrases_out=None):
+        """Return up to limit (key, title) pairs, best matches first.
+
+        Documents match if they contain every one of the phrase's terms,
+        like the merge join Searchable.full_text_search does, and are
+        ranked by the sum of each term's BM25 score. kind can be a kind
+        name or a list of them to only return documents of those kinds.
+        """
+        query_terms = set(terms(phrase))
+        if searched_phrases_out is not None:
+            searched_phrases_out.extend(query_terms)
+
+        if isinstance(kind, basestring):
+            kind = [kind]
+
+        num_docs = len(self.keys)
+        if not num_docs:
+            return []
+        average_length = float(sum(self.lengths)) / num_docs
+
+        term_postings = [self.postings.get(term) for term in query_terms]
+        if not term_postings or None in term_postings:
+            return []
+
+        scores = {}
+        matched_terms = {}
+        for docs, counts in term_postings:
+            matching = len(docs)
+            idf = math.log(1.0 + (num_docs - matching + 0.5) /
+                           (matching + 0.5))
+            for doc, count in zip(docs, counts):
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B *
+                                  self.lengths[doc] / average_length)
+                scores[doc] = (scores.get(doc, 0.0) +
+                               idf * count * (BM25_K1 + 1.0) / (count + norm))
+                matched_terms[doc] = matched_terms.get(doc, 0) + 1
+
+        if kind:
+            kind = frozenset(kind)
+        matches = [(score, doc) for doc, score in scores.iteritems()
+                   if matched_terms[doc] == len(term_postings) and
+                       (not kind or self.kinds[doc] in kind)]
+
+        # Ties go to the document added first
+        best = heapq.nsmallest(limit, matches,
+                               key=lambda match: (-match[0], match[1]))
+        return [(db.Key(self.keys[doc]), self.titles[doc])
+                for _, doc in best]
+
+    def __getstate__(self):
+        # Pickle arrays as raw bytes rather than as lists of ints
+        return {
+            "keys": self.keys,
+            "titles": self.titles,
+            "kinds": self.kinds,
+            "lengths": self.lengths.tostring(),
+            "postings": dict((term, (docs.tostring(), counts.tostring()))
+                             for term, (docs, counts)
+                             in self.postings.iteritems()),
+        }
+
+    def __setstate__(self, state):
+        self.keys = state["keys"]
+        self.titles = state["titles"]
+        self.kinds = state["kinds"]
+        self.lengths = InvertedIndex._array(state["lengths"])
+        self.postings = dict(
+            (term, (InvertedIndex._array(docs), InvertedIndex._array(counts)))
+            for term, (docs, counts) in state["postings"].iteritems())
+
+    @staticmethod
+    def _array(data):
+        ints = array.array("i")
+        ints.fromstring(data)
+        return ints
+
+    @staticmethod
+    def get(version_number=None):
+        """Return the index for a topic version, the default if None."""
+        return InvertedIndex._get_for_version(
+            version_number or setting_model.Setting.topic_tree_version(),
+            setting_model.Setting.cached_exercises_date())
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(
+        lambda version_number, exercises_date: "search_index_%s_%s" % (
+            version_number, exercises_date),
+        layer=layer_cache.Layers.InAppMemory | layer_cache.Layers.Datastore,
+        persist_across_app_versions=True,
+        use_chunks=True)
+    def _get_for_version(version_number, exercises_date):
+        version = topic_models.TopicVersion.get_by_number(version_number)
+        return InvertedIndex.build(version)
+
+    @staticmethod
+    def build(version):
+        index = InvertedIndex()
+        for topic in topic_models.Topic.get_content_topics(version):
+            index.add_entity(topic)
+        for video in video_models.Video.get_all_live(version=version):
+            if video is not None:
+                index.add_entity(video)
+        for exercise in exercise_models.Exercise.get_all_use_cache_safe():
+            index.add_entity(exercise)
+        return index
+
+
+def full_text_search(phrase, limit=10, kind=None, searched_phrases_out=None):
+    """Search the default topic version's InvertedIndex.
+
+    Takes the arguments of and returns the same (key, title) pairs as
+    Searchable.full_text_search, but ranked by BM25.
+    """
+    return InvertedIndex.get().search(phrase, limit, kind,
+                                      searched_phrases_out)
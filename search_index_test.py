@@ -0,0 +1,79 @@
+import pickle
+
+from google.appengine.ext import db
+
+from search_index import InvertedIndex, terms
+from testutil import gae_model
+
+
+class InvertedIndexTest(gae_model.GAEModelTestCase):
+    DOCUMENTS = [
+        ("Video", "Adding fractions",
+         "Adding fractions with unlike denominators"),
+        ("Video", "Multiplying fractions",
+         "Multiplying fractions and whole numbers"),
+        ("Topic", "Fractions",
+         "Adding, subtracting, multiplying and dividing fractions, "
+         "fractions, fractions"),
+        ("Exercise", "Dividing decimals", "Dividing decimals by decimals"),
+    ]
+
+    def setUp(self):
+        super(InvertedIndexTest, self).setUp()
+        self.index = InvertedIndex()
+        for i, (kind, title, text) in enumerate(self.DOCUMENTS):
+            key = db.Key.from_path(kind, "doc%s" % i)
+            self.index.add(key, kind, title, terms(title) * 3 + terms(text))
+
+    def titles(self, results):
+        return [title for _, title in results]
+
+    def test_terms(self):
+        self.assertEqual(["ad", "fraction", "fraction"],
+                         terms("Adding the fractions, fractions"))
+        self.assertEqual([], terms("and the of"))
+
+    def test_ranks_by_bm25(self):
+        # Title matches count three times, so the video about adding
+        # fractions beats the topic mentioning adding once
+        self.assertEqual(["Adding fractions", "Fractions"],
+                         self.titles(self.index.search("adding fractions")))
+
+    def test_matches_every_term(self):
+        self.assertEqual(["Multiplying fractions"],
+                         self.titles(self.index.search("multiplying numbers")))
+        self.assertEqual([], self.index.search("adding decimals"))
+        # A term no document has matches nothing, as in the datastore
+        self.assertEqual([], self.index.search("fractions geometry"))
+        # Stop words aren't terms
+        self.assertEqual(["Dividing decimals"],
+                         self.titles(self.index.search("the decimals")))
+
+    def test_limit_and_kind(self):
+        self.assertEqual(1, len(self.index.search("fractions", limit=1)))
+        self.assertEqual(["Fractions"],
+                         self.titles(self.index.search("fractions",
+                                                       kind="Topic")))
+        self.assertEqual(["Dividing decimals"],
+                         self.titles(self.index.search(
+                             "dividing", kind=["Exercise", "Video"])))
+
+    def test_no_matches(self):
+        self.assertEqual([], self.index.search("geometry"))
+        self.assertEqual([], InvertedIndex().search("fractions"))
+
+    def test_returns_keys(self):
+        key, title = self.index.search("decimals")[0]
+        self.assertEqual(db.Key.from_path("Exercise", "doc3"), key)
+        self.assertEqual("Dividing decimals", title)
+
+    def test_searched_phrases_out(self):
+        searched = []
+        self.index.search("Adding the fractions", searched_phrases_out=searched)
+        self.assertEqual(set(["ad", "fraction"]), set(searched))
+
+    def test_pickle(self):
+        unpickled = pickle.loads(pickle.dumps(self.index, 2))
+        for phrase in ["adding fractions", "decimals", "numbers"]:
+            self.assertEqual(self.index.search(phrase),
+                             unpickled.search(phrase))
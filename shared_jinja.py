@@ -3,6 +3,11 @@ This module exposes a Jinja2 instance that is already configured and may be
 used from any application, e.g. the main app, the API app.
 """
 
+import logging
+import sys
+import time
+
+from jinja2.utils import concat
 import webapp2
 from webapp2_extras import jinja2
 
@@ -23,9 +28,84 @@ _SHARED_APP = webapp2.WSGIApplication(debug=App.is_dev_server)
 _CACHE = _Cache()
 
 
+class LazyTemplateValue(object):
+    """A template value that's only computed if a template uses it.
+
+    template_to_string calls fxn the first time the rendered template (or a
+    template it extends or includes) looks the value up, and reuses the
+    result after that. Code that needs the value itself can call get().
+    """
+    def __init__(self, fxn):
+        self.fxn = fxn
+        self.computed = False
+        self.value = None
+        self.elapsed_ms = None
+
+    def get(self):
+        if not self.computed:
+            start = time.time()
+            self.value = self.fxn()
+            self.elapsed_ms = (time.time() - start) * 1000
+            self.computed = True
+        return self.value
+
+
+def resolve(value):
+    """Return the value of value if it's a LazyTemplateValue, else value."""
+    if isinstance(value, LazyTemplateValue):
+        return value.get()
+    return value
+
+
+class _TemplateValues(dict):
+    """The variables of a rendered template, computing any lazy ones.
+
+    Jinja2 contexts look variables up with [], and pass this same dict on
+    to included templates, so every lookup goes through __getitem__.
+    """
+    def __getitem__(self, key):
+        return resolve(dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
 def get():
     return _CACHE.jinja2
 
 
+def _log_lazy_values(template_name, template_values):
+    computed = []
+    skipped = []
+    for key, value in sorted(template_values.iteritems()):
+        if isinstance(value, LazyTemplateValue):
+            if value.computed:
+                computed.append("%s %.1fms" % (key, value.elapsed_ms))
+            else:
+                skipped.append(key)
+
+    if computed or skipped:
+        logging.debug("Rendered %s computing template values (%s), "
+                      "skipping (%s)" % (template_name, ", ".join(computed),
+                                         ", ".join(skipped)))
+
+
 def template_to_string(template_name, template_values):
-    return get().render_template(template_name, **template_values)
+    environment = get().environment
+    template = environment.get_template(template_name)
+
+    # Like template.render(**template_values), but with a context that
+    # computes LazyTemplateValues as they're looked up
+    variables = _TemplateValues(template.globals)
+    variables.update(template_values)
+    context = template.new_context(variables, shared=True)
+
+    try:
+        rendered = concat(template.root_render_func(context))
+    except Exception:
+        return environment.handle_exception(sys.exc_info(), True)
+
+    _log_lazy_values(template_name, template_values)
+    return rendered
@@ -14,13 +14,30 @@ LogSummary: Keeps a variety of different types of summaries pulled
 """
 
 import datetime
+import hashlib
 import logging
 import random
+import time
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 import object_property
 
+# Activities buffered with LogSummary.buffer_entry are added to their
+# summaries by a task that runs this many seconds after the end of the
+# window they were buffered in
+BUFFER_WINDOW_SECONDS = 60
+BUFFER_FLUSH_DELAY_SECONDS = 10
+
+# Buffered activities that are never flushed are dropped after this long
+BUFFER_EXPIRATION_SECONDS = 24 * 60 * 60
+
+# Marks a buffer's counter once flush_log_summary_buffer has read it
+_FLUSHED = "flushed"
+
 
 class DailyActivityLog(db.Model):
     """ A log entry for a dashboard presented to users and coaches.
@@ -104,6 +121,9 @@ class LogSummary(db.Model):
     summary = object_property.UnvalidatedObjectProperty()
     name = db.StringProperty(required=True)
 
+    # The LogSummary.buffer_entry windows already added to this shard
+    flushed_windows = db.ListProperty(int, indexed=False)
+
     @staticmethod
     def get_start_of_period(activity, delta):
         date = activity.time_started()
@@ -130,39 +150,57 @@ class LogSummary(db.Model):
 
     @staticmethod
     def get_name_by_dates(user_data, summary_type, start, end):
-        return "%s:%s:%s:%s" % (user_data.key_email, summary_type,
+        return LogSummary.get_name_by_key_email(user_data.key_email,
+                                                summary_type, start, end)
+
+    @staticmethod
+    def get_name_by_key_email(key_email, summary_type, start, end):
+        return "%s:%s:%s:%s" % (key_email, summary_type,
                                 start.strftime("%Y-%m-%d-%H-%M"),
                                 end.strftime("%Y-%m-%d-%H-%M"))
 
-    # activity needs to have activity.time_started() and activity.time_done() functions
-    # summary_class needs to have a method .add(activity)
-    # delta is a time period in minutes
     @staticmethod
-    def add_or_update_entry(user_data, activity, summary_class, summary_type, delta=30):
+    def _update_shard(name, shard_name, user_data, activities, summary_class,
+                      summary_type, delta, window=None):
+        """Add activities to a shard. Must be run in a transaction.
 
-        if user_data is None:
-            return
+        If window is given, and the shard already has that buffer window's
+        activities, does nothing.
+        """
+        log_summary = LogSummary.get_by_key_name(shard_name)
+
+        if log_summary is None:
+            activity = activities[0]
 
-        def txn(name, shard_name, user_data, activities, summary_class, summary_type, delta):
-                log_summary = LogSummary.get_by_key_name(shard_name)
+            log_summary = LogSummary(
+                key_name=shard_name,
+                name=name,
+                user=user_data.user,
+                start=LogSummary.get_start_of_period(activity, delta),
+                end=LogSummary.get_end_of_period(activity, delta),
+                summary_type=summary_type)
 
-                if log_summary is None:
-                    activity = activities[0]
+            log_summary.summary = summary_class()
 
-                    log_summary = LogSummary(
-                        key_name=shard_name,
-                        name=name,
-                        user=user_data.user,
-                        start=LogSummary.get_start_of_period(activity, delta),
-                        end=LogSummary.get_end_of_period(activity, delta),
-                        summary_type=summary_type)
+        elif window is not None and window in log_summary.flushed_windows:
+            return
 
-                    log_summary.summary = summary_class()
+        for activity in activities:
+            log_summary.summary.add(user_data, activity)
 
-                for activity in activities:
-                    log_summary.summary.add(user_data, activity)
+        if window is not None:
+            log_summary.flushed_windows.append(window)
 
-                log_summary.put()
+        log_summary.put()
+
+    # activity needs to have activity.time_started() and activity.time_done() functions
+    # summary_class needs to have a method .add(activity)
+    # delta is a time period in minutes
+    @staticmethod
+    def add_or_update_entry(user_data, activity, summary_class, summary_type, delta=30):
+
+        if user_data is None:
+            return
 
         # if activities is a list, we assume all activities belong to
         # the same period
@@ -184,19 +222,166 @@ class LogSummary(db.Model):
         # mutually exclusive since they are operating on the same
         # entity
         try:
-            db.run_in_transaction(txn, name, shard_name, user_data, activities,
-                                  summary_class, summary_type, delta)
+            db.run_in_transaction(LogSummary._update_shard, name, shard_name,
+                                  user_data, activities, summary_class,
+                                  summary_type, delta)
         except db.TransactionFailedError:
             # if it is a transaction lock
             logging.info("increasing the number of shards to %i log summary: %s" %
                          (config.num_shards + 1, name))
             LogSummaryShardConfig.increase_shards(name, config.num_shards + 1)
             shard_name = str(config.num_shards) + ":" + name
-            db.run_in_transaction(txn, name, shard_name, user_data, activities,
-                                  summary_class, summary_type, delta)
+            db.run_in_transaction(LogSummary._update_shard, name, shard_name,
+                                  user_data, activities, summary_class,
+                                  summary_type, delta)
+
+    @staticmethod
+    def _buffer_key(name, window):
+        return "log_summary_buffer:%s:%s" % (name, window)
+
+    @staticmethod
+    def buffer_entry(key_emails, activity, summary_class, summary_type,
+                     delta=30):
+        """Queue an activity to be added to the summaries of several users.
+
+        Rather than a transaction per activity and user, activities are
+        appended to a buffer in memcache for each summary and
+        BUFFER_WINDOW_SECONDS window. The first activity in each buffer
+        schedules a flush_log_summary_buffer task, which adds all of them
+        in one transaction once the window has passed. Summaries lag
+        behind by at most BUFFER_WINDOW_SECONDS +
+        BUFFER_FLUSH_DELAY_SECONDS.
+
+        Returns the key_emails of the users whose summaries the activity
+        couldn't be buffered for, because memcache failed or the window's
+        buffer was already flushed, so callers can fall back to
+        add_or_update_entry.
+        Activities buffered in memcache are lost if they're evicted before
+        they're flushed.
+        """
+        window = int(time.time()) // BUFFER_WINDOW_SECONDS
+        start = LogSummary.get_start_of_period(activity, delta)
+        end = LogSummary.get_end_of_period(activity, delta)
+
+        names = {}
+        for key_email in key_emails:
+            name = LogSummary.get_name_by_key_email(key_email, summary_type,
+                                                    start, end)
+            names[LogSummary._buffer_key(name, window)] = (key_email, name)
+
+        # Claim the next slot in each buffer
+        slots = memcache.offset_multi(dict.fromkeys(names, 1),
+                                      initial_value=0) or {}
+
+        slot_keys = dict(("%s:%s" % (buffer_key, slot), buffer_key)
+                         for buffer_key, slot in slots.iteritems()
+                         if slot is not None)
+        not_set = memcache.set_multi(dict.fromkeys(slot_keys, activity),
+                                     time=BUFFER_EXPIRATION_SECONDS)
+        if not_set is None:
+            not_set = list(slot_keys)
+        failed = set(slot_keys[slot_key] for slot_key in not_set)
+
+        unbuffered = []
+        for buffer_key, (key_email, name) in names.iteritems():
+            slot = slots.get(buffer_key)
+            if slot is None:
+                unbuffered.append(key_email)
+                continue
+
+            # The first slot schedules the flush even if its own activity
+            # wasn't set, so the activities in the later slots are flushed
+            scheduled = slot != 1 or LogSummary._schedule_flush(
+                key_email, name, window, summary_class, summary_type, delta)
+            if not scheduled or buffer_key in failed:
+                unbuffered.append(key_email)
+
+        return unbuffered
+
+    @staticmethod
+    def _schedule_flush(key_email, name, window, summary_class, summary_type,
+                        delta):
+        """Schedule the buffer's flush. Returns False if it already ran."""
+        buffer_key = LogSummary._buffer_key(name, window)
+        task_name = "log_summary_%s" % hashlib.md5(buffer_key).hexdigest()
+        countdown = max(0, (window + 1) * BUFFER_WINDOW_SECONDS -
+                           time.time()) + BUFFER_FLUSH_DELAY_SECONDS
+        try:
+            deferred.defer(flush_log_summary_buffer, key_email, name, window,
+                           summary_class, summary_type, delta,
+                           _name=task_name,
+                           _countdown=countdown,
+                           _queue="log-summary-queue",
+                           _url="/_ah/queue/deferred_log_summary")
+        except taskqueue.TaskAlreadyExistsError:
+            logging.info("deferred task %s already exists" % task_name)
+        except taskqueue.TombstonedTaskError:
+            # The window's buffer was flushed and its counter deleted
+            # before this straggler got to it
+            logging.info("deferred task %s already ran" % task_name)
+            return False
+
+        return True
 
     @staticmethod
     def get_by_name(name):
         query = LogSummary.all()
         query.filter('name =', name)
         return query
+
+
+def flush_log_summary_buffer(key_email, name, window, summary_class,
+                             summary_type, delta):
+    """Add the activities buffered by LogSummary.buffer_entry to a summary.
+
+    Used by the deferred task buffer_entry schedules. The buffer's counter
+    is first replaced by a (_FLUSHED, count) marker, which buffer_entry
+    can't claim slots of, so activities buffered after the flush read the
+    counter aren't lost: their callers add them themselves. All of the
+    activities then go to shard 0 of the summary in a single transaction,
+    which also records the window as flushed, so the task can safely be
+    retried.
+    """
+    # Imported here to avoid a circular import
+    import user_models
+
+    buffer_key = LogSummary._buffer_key(name, window)
+    count = _close_buffer(buffer_key)
+    if not count:
+        return
+
+    slot_keys = ["%s:%s" % (buffer_key, slot)
+                 for slot in xrange(1, count + 1)]
+    buffered = memcache.get_multi(slot_keys)
+    activities = [buffered[slot_key] for slot_key in slot_keys
+                  if slot_key in buffered]
+    if len(activities) < count:
+        logging.warning("%i of %i buffered activities for %s were lost" %
+                        (count - len(activities), count, name))
+
+    user_data = user_models.UserData.get_from_db_key_email(key_email)
+    if activities and user_data is not None:
+        db.run_in_transaction(LogSummary._update_shard, name, "0:" + name,
+                              user_data, activities, summary_class,
+                              summary_type, delta, window)
+
+    # The marker is left to expire, so stragglers keep falling back
+    memcache.delete_multi(slot_keys)
+
+
+def _close_buffer(buffer_key):
+    """Stop buffer_entry claiming slots in the buffer.
+
+    Returns the number of slots claimed, or None if there's no buffer.
+    """
+    client = memcache.Client()
+    while True:
+        count = client.gets(buffer_key)
+        if count is None:
+            return None
+        if isinstance(count, tuple):
+            # Closed by an earlier try of this task
+            return count[1]
+        if client.cas(buffer_key, (_FLUSHED, count),
+                      time=BUFFER_EXPIRATION_SECONDS):
+            return count
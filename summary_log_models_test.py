@@ -0,0 +1,118 @@
+from __future__ import with_statement
+
+import datetime
+
+import mock
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+import summary_log_models
+from summary_log_models import LogSummary
+from testutil import gae_model
+import user_models
+
+
+class _Activity(object):
+    def __init__(self, minute):
+        self.minute = minute
+
+    def time_started(self):
+        return datetime.datetime(2012, 6, 1, 10, self.minute)
+
+
+class _Summary(object):
+    def __init__(self):
+        self.minutes = []
+
+    def add(self, user_data, activity):
+        self.minutes.append(activity.minute)
+
+
+class _FrozenTime(object):
+    def time(self):
+        return 1338544800.0
+
+
+class BufferedLogSummaryTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(BufferedLogSummaryTest, self).setUp()
+        self.orig_time = summary_log_models.time
+        summary_log_models.time = _FrozenTime()
+
+        self.coach = user_models.UserData.insert_for('coach',
+                                                     'coach@example.com')
+        self.window = (int(_FrozenTime().time()) //
+                       summary_log_models.BUFFER_WINDOW_SECONDS)
+        self.name = LogSummary.get_name(self.coach, "Test", _Activity(0), 60)
+
+    def tearDown(self):
+        summary_log_models.time = self.orig_time
+        super(BufferedLogSummaryTest, self).tearDown()
+
+    def buffer(self, minute):
+        return LogSummary.buffer_entry([self.coach.key_email],
+                                       _Activity(minute), _Summary, "Test", 60)
+
+    def flush(self):
+        summary_log_models.flush_log_summary_buffer(
+            self.coach.key_email, self.name, self.window, _Summary, "Test", 60)
+
+    def minutes(self):
+        log_summary = LogSummary.get_by_key_name("0:" + self.name)
+        return log_summary and log_summary.summary.minutes
+
+    def test_flush_adds_buffered_activities(self):
+        for minute in [5, 1, 30]:
+            self.assertEqual([], self.buffer(minute))
+        self.assertEqual(None, self.minutes())
+
+        self.flush()
+        self.assertEqual([5, 1, 30], self.minutes())
+
+    def test_flush_is_idempotent(self):
+        self.buffer(5)
+        self.buffer(6)
+        buffer_key = LogSummary._buffer_key(self.name, self.window)
+        buffered = memcache.get_multi(
+            [buffer_key, buffer_key + ":1", buffer_key + ":2"])
+
+        self.flush()
+        # As if the task were retried after its transaction committed
+        memcache.set_multi(buffered)
+        self.flush()
+        self.assertEqual([5, 6], self.minutes())
+
+    def test_flush_without_buffer(self):
+        self.flush()
+        self.assertEqual(None, self.minutes())
+
+    def test_straggler_after_flush_is_unbuffered(self):
+        self.buffer(5)
+        self.flush()
+
+        self.assertEqual([self.coach.key_email], self.buffer(7))
+        self.flush()
+        self.assertEqual([5], self.minutes())
+
+    def test_flush_retried_after_failed_transaction(self):
+        self.buffer(5)
+        self.buffer(6)
+
+        with mock.patch("summary_log_models.db.run_in_transaction",
+                        side_effect=db.TransactionFailedError):
+            self.assertRaises(db.TransactionFailedError, self.flush)
+        self.flush()
+        self.assertEqual([5, 6], self.minutes())
+
+    def test_first_slot_schedules_flush_when_not_set(self):
+        with mock.patch("summary_log_models.memcache.set_multi",
+                        side_effect=lambda mapping, **kwargs: list(mapping)):
+            self.assertEqual([self.coach.key_email], self.buffer(5))
+        self.assertEqual([], self.buffer(6))
+
+        taskqueue_stub = self.testbed.get_stub("taskqueue")
+        self.assertEqual(1, len(taskqueue_stub.GetTasks("log-summary-queue")))
+
+        self.flush()
+        self.assertEqual([6], self.minutes())
@@ -5,17 +5,47 @@ from secrets import *
 import base64
 import logging
 import json
-from app import App
 import urllib
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 #if App.is_dev_server:
 #    import urlfetch
 #else:
 from google.appengine.api import urlfetch
 
+# Statements wait in this pull queue until deliver_statements posts them to
+# the LRS, so no request waits on the LRS
+OUTBOX_QUEUE = "tincan-outbox"
+
+# deliver_statements runs in this queue, whose retry backoff is at least
+# LEASE_SECONDS so a retry finds the statements it failed to deliver
+DELIVERY_QUEUE = "tincan-delivery-queue"
+
+# Statements are delivered at most this many seconds after they're pushed
+DELIVERY_INTERVAL_SECONDS = 10
+
+# The most statements posted to the LRS in one request
+BATCH_SIZE = 100
+
+# How long a delivery has to post the statements it leased before they can
+# be leased again
+LEASE_SECONDS = 60
+
+# Statuses the LRS answers with when it won't take a batch of statements,
+# so retrying the same batch won't help
+REJECTED_STATUSES = [400, 409, 413]
+
+
+class DeliveryError(Exception):
+    """Some statements couldn't be delivered, so the task should retry."""
+    pass
+
+
 class TinCan():
-    testMode = False
     def __init__(self):
         self.user_email = None
         self.coach_project = False
@@ -158,35 +188,111 @@ class TinCan():
         
 
     def push(self):
+        """Queue the statement to be posted to the LRS by deliver_statements.
 
+        In a transaction the statement is only queued if it commits.
+        """
         if not self.coach_project:
             return
 
         self.log_statement()
 
-        auth_token = base64.b64encode("%s:%s" % (tincan_user, tincan_pw))
-        tincan_headers = {
-          "Authorization": "Basic %s" % auth_token,
-          "X-Experience-API-Version":"1.0.0",
-          'Content-Type': 'application/json',
-        }
+        task = taskqueue.Task(payload=json.dumps(self.statement),
+                              method="PULL")
+        taskqueue.Queue(OUTBOX_QUEUE).add(
+            task, transactional=db.is_in_transaction())
 
-        tincan_data = json.dumps(self.statement)
-        
-        if App.is_dev_server and not self.testMode:
-            res = urlfetch.post(
-                tincan_url,
-                headers = tincan_headers,
-                deadline = 60,
-                data = tincan_data
-            )
-            logging.info(res.status)
-            logging.info(res.content)
-        else:
-            res = urlfetch.fetch(url=tincan_url,
-                payload=tincan_data,
-                method=urlfetch.POST,
-                deadline=60,
-                headers=tincan_headers)
-            logging.info(res.status_code)
-            logging.info(res.content) 
+        _schedule_delivery()
+
+
+def _schedule_delivery():
+    window = int(time.time()) // DELIVERY_INTERVAL_SECONDS
+    window_key = "tincan_delivery:%s" % window
+    if (not memcache.add(window_key, True,
+                         time=DELIVERY_INTERVAL_SECONDS * 2) and
+            memcache.get(window_key)):
+        return
+    # Otherwise memcache may be down, and the task name still dedupes it
+
+    task_name = "tincan_delivery_%s" % window
+    try:
+        deferred.defer(deliver_statements,
+                       _name=task_name,
+                       _countdown=DELIVERY_INTERVAL_SECONDS,
+                       _queue=DELIVERY_QUEUE)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info("deferred task %s already exists" % task_name)
+
+
+def _post(statements):
+    """POST a list of statements to the LRS and return the status code.
+
+    Returns None if the LRS couldn't be reached.
+    """
+    auth_token = base64.b64encode("%s:%s" % (tincan_user, tincan_pw))
+    tincan_headers = {
+      "Authorization": "Basic %s" % auth_token,
+      "X-Experience-API-Version":"1.0.0",
+      'Content-Type': 'application/json',
+    }
+
+    try:
+        res = urlfetch.fetch(url=tincan_url,
+            payload=json.dumps(statements),
+            method=urlfetch.POST,
+            deadline=60,
+            headers=tincan_headers)
+    except urlfetch.Error, e:
+        logging.warning("TinCan: Can't reach the LRS: %s" % e)
+        return None
+
+    logging.info(res.status_code)
+    logging.info(res.content)
+    return res.status_code
+
+
+def _deliver(tasks):
+    """Post the statements of the outbox tasks to the LRS.
+
+    Returns the tasks that are done with: those the LRS took, and those it
+    rejected on their own, which are logged and dropped. A rejected batch
+    is split in two and each half is posted again, to find the statements
+    that are to blame.
+    """
+    status = _post([json.loads(task.payload) for task in tasks])
+
+    if status is not None and 200 <= status < 300:
+        return tasks
+
+    if status in REJECTED_STATUSES:
+        if len(tasks) == 1:
+            logging.error("TinCan: LRS rejected statement with %s: %s" %
+                          (status, tasks[0].payload))
+            return tasks
+
+        half = len(tasks) // 2
+        return _deliver(tasks[:half]) + _deliver(tasks[half:])
+
+    return []
+
+
+def deliver_statements():
+    """Post the statements waiting in the outbox to the LRS in batches.
+
+    Raises DeliveryError if any couldn't be delivered, so the task is
+    retried once their leases run out.
+    """
+    queue = taskqueue.Queue(OUTBOX_QUEUE)
+
+    while True:
+        tasks = queue.lease_tasks(LEASE_SECONDS, BATCH_SIZE)
+        if not tasks:
+            return
+
+        delivered = _deliver(tasks)
+        if delivered:
+            queue.delete_tasks(delivered)
+
+        if len(delivered) < len(tasks):
+            raise DeliveryError("%s of %s statements weren't delivered" %
+                                (len(tasks) - len(delivered), len(tasks)))
@@ -1,5 +1,6 @@
 from __future__ import with_statement
 import datetime
+import json
 import mock
 
 from google.appengine.ext import db
@@ -16,6 +17,7 @@ from user_models import Capabilities, UserData, UniqueUsername, ParentChildPair
 from user_models import _USER_KEY_PREFIX
 from testutil import testsize
 import setting_model
+import tincan
 from tincan import TinCan
 from exercise_models import StackLog, Exercise, UserExercise
 
@@ -94,3 +96,110 @@ class TinCanTest(gae_model.GAEModelTestCase):
                                           async_stack_log_put=False)
         # He's asking for a hint!
 
+
+class FakeLRS(object):
+    """A stand-in for the LRS that records the statements posted to it.
+
+    It answers with status to every post, except that it rejects batches
+    with a statement whose verb is in rejected_verbs, as a real LRS
+    rejects malformed statements.
+    """
+    def __init__(self, status=200, rejected_verbs=()):
+        self.status = status
+        self.rejected_verbs = rejected_verbs
+        self.posts = 0
+        self.statements = []
+
+    def fetch(self, url, payload, method, deadline, headers):
+        self.posts += 1
+        statements = json.loads(payload)
+
+        if self.status != 200:
+            return mock.Mock(status_code=self.status, content="")
+
+        for statement in statements:
+            if statement["verb"]["display"]["en-US"] in self.rejected_verbs:
+                return mock.Mock(status_code=400, content="Bad verb")
+
+        self.statements.extend(statements)
+        return mock.Mock(status_code=200, content="")
+
+
+class TinCanDeliveryTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(TinCanDeliveryTest, self).setUp()
+        self.patchers = [
+            mock.patch("tincan.tincan_url", "http://lrs.example.com/",
+                       create=True),
+            mock.patch("tincan.tincan_user", "user", create=True),
+            mock.patch("tincan.tincan_pw", "pw", create=True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(TinCanDeliveryTest, self).tearDown()
+
+    def push(self, verb):
+        tc = TinCan()
+        tc.user_email = "student@example.com"
+        tc.coach_project = True
+        tc.set_verb(verb)
+        tc.push()
+
+    def deliver(self, lrs):
+        with mock.patch("tincan.urlfetch.fetch", lrs.fetch):
+            tincan.deliver_statements()
+
+    def waiting(self):
+        taskqueue_stub = self.testbed.get_stub("taskqueue")
+        return len(taskqueue_stub.GetTasks(tincan.OUTBOX_QUEUE))
+
+    def verbs(self, lrs):
+        return [s["verb"]["display"]["en-US"] for s in lrs.statements]
+
+    def test_delivers_in_batches(self):
+        for i in xrange(tincan.BATCH_SIZE + 1):
+            self.push("answered")
+        self.assertEqual(tincan.BATCH_SIZE + 1, self.waiting())
+
+        lrs = FakeLRS()
+        self.deliver(lrs)
+        self.assertEqual(2, lrs.posts)
+        self.assertEqual(tincan.BATCH_SIZE + 1, len(lrs.statements))
+        self.assertEqual(0, self.waiting())
+
+    def test_drops_rejected_statements(self):
+        for verb in ["launched", "answered", "bogus", "completed"]:
+            self.push(verb)
+
+        lrs = FakeLRS(rejected_verbs=["bogus"])
+        self.deliver(lrs)
+        self.assertEqual(["answered", "completed", "launched"],
+                         sorted(self.verbs(lrs)))
+        self.assertEqual(0, self.waiting())
+
+    def test_keeps_undelivered_statements(self):
+        self.push("answered")
+        self.push("completed")
+
+        self.assertRaises(tincan.DeliveryError, self.deliver, FakeLRS(503))
+        self.assertEqual(2, self.waiting())
+
+    def test_schedules_delivery_without_memcache(self):
+        with mock.patch("tincan.memcache.add", return_value=False):
+            self.push("answered")
+            self.push("completed")
+
+        taskqueue_stub = self.testbed.get_stub("taskqueue")
+        self.assertEqual(1, len(taskqueue_stub.GetTasks(
+            tincan.DELIVERY_QUEUE)))
+
+    def test_only_pushes_coach_project_statements(self):
+        tc = TinCan()
+        tc.user_email = "student@example.com"
+        tc.set_verb("answered")
+        tc.push()
+        self.assertEqual(0, self.waiting())
@@ -15,6 +15,7 @@ A 'topic' the stuff after the # in urls like
 """
 
 import base64
+import bisect
 import datetime
 import logging
 import os
@@ -40,6 +41,7 @@ import object_property
 import pickle_util
 import request_cache
 from third_party import search
+import search_index
 import setting_model
 import templatetags
 import transaction_util
@@ -413,7 +415,7 @@ class Topic(search.Searchable, backup_model.BackupModel):
                 })
         return self
 
-    def get_library_data(self, node_dict=None):
+    def get_library_data(self, node_dict=None, first_video_and_topic=None):
         from homepage import thumbnail_link_dict
 
         if node_dict:
@@ -422,7 +424,9 @@ class Topic(search.Searchable, backup_model.BackupModel):
         else:
             children = db.get(self.child_keys)
 
-        (thumbnail_video, thumbnail_topic) = self.get_first_video_and_topic()
+        if first_video_and_topic is None:
+            first_video_and_topic = self.get_first_video_and_topic()
+        (thumbnail_video, thumbnail_topic) = first_video_and_topic
 
         ret = {
             "id": self.id,
@@ -477,8 +481,13 @@ class Topic(search.Searchable, backup_model.BackupModel):
             node_dict = dict((node.key(), node) for node in nodes)
 
             # Get the subtopic video data
-            subtopics = [t.get_library_data(node_dict=node_dict)
-                         for t in topic_children]
+            first_videos_and_topics = Topic.get_first_videos_and_topics(
+                topic_children)
+            subtopics = [t.get_library_data(
+                             node_dict=node_dict,
+                             first_video_and_topic=first_video_and_topic)
+                         for t, first_video_and_topic in
+                             zip(topic_children, first_videos_and_topics)]
             child_videos = None
         else:
             # Fetch the child videos
@@ -842,11 +851,25 @@ class Topic(search.Searchable, backup_model.BackupModel):
 
         return None
 
-    @layer_cache.cache_with_key_fxn(lambda self:
-        "topic_get_first_video_%s_v%s" % (
-            self.key(), setting_model.Setting.topic_tree_version()),
+    def _first_video_cache_key(self):
+        return "topic_get_first_video_%s_v%s" % (
+            self.key(), setting_model.Setting.topic_tree_version())
+
+    @layer_cache.cache_with_key_fxn(_first_video_cache_key,
         layer=layer_cache.Layers.Memcache)
     def get_first_video_and_topic(self):
+        return self._find_first_video_and_topic()
+
+    @staticmethod
+    @layer_cache.cache_multi_with_key_fxn(_first_video_cache_key,
+        layer=layer_cache.Layers.Memcache)
+    def get_first_videos_and_topics(topics):
+        """get_first_video_and_topic of each of topics, with one memcache
+        lookup for all of them.
+        """
+        return [topic._find_first_video_and_topic() for topic in topics]
+
+    def _find_first_video_and_topic(self):
         videos = Topic.get_cached_videos_for_topic(self)
         if videos:
             return (videos[0], self)
@@ -1260,81 +1283,16 @@ class Topic(search.Searchable, backup_model.BackupModel):
         # and its descendants children all added
         return node_dict[self.key()]
 
-    def search_tree_traversal(self, query, node_dict, path, matching_paths,
-                              matching_nodes):
-        match = False
-
-        if self.title.lower().find(query) > -1:
-            match_path = path[:]
-            match_path.append('Topic')
-            matching_paths.append(match_path)
-            match = True
-
-        for child_key in self.child_keys:
-            if child_key in node_dict:
-                child = node_dict[child_key]
-
-                if child_key.kind() == 'Topic':
-                    sub_path = path[:]
-                    sub_path.append(child.id)
-                    if child.search_tree_traversal(query, node_dict, sub_path,
-                                                   matching_paths,
-                                                   matching_nodes):
-                        match = True
-
-                else:
-                    title = getattr(child, "title",
-                                    getattr(child, "display_name", ""))
-                    id = getattr(child, "id",
-                                 getattr(child, "readable_id",
-                                         getattr(child, "name",
-                                                 child.key().id())))
-                    if (title.lower().find(query) > -1 or
-                            str(id).lower().find(query) > -1):
-                        match_path = path[:]
-                        match_path.append(id)
-                        match_path.append(child_key.kind())
-                        matching_paths.append(match_path)
-                        match = True
-                        matching_nodes.append(child)
-
-        if match:
-            matching_nodes.append(self.get_visible_data(node_dict))
-
-        return match
-
     def search_tree(self, query):
-        query = query.strip().lower()
-
-        nodes = Topic.all().filter("ancestor_keys =", self.key()).run()
+        """Find the topics and content in this tree matching query.
 
-        node_dict = dict((node.key(), node) for node in nodes)
-        node_dict[self.key()] = self  # in case the current node is
-                                      # hidden (like root is)
-
-        contentKeys = []
-        # cycle through the nodes adding its children to the
-        # contentKeys that need to be gotten
-        for key, descendant in node_dict.iteritems():
-            contentKeys.extend([c for c in descendant.child_keys
-                                if c not in node_dict and c.kind() != "Topic"])
-
-        # get all content that belongs in this tree
-        contentItems = db.get(contentKeys)
-        # add the content to the node dict
-        for content in contentItems:
-            node_dict[content.key()] = content
-
-        matching_paths = []
-        matching_nodes = []
-
-        self.search_tree_traversal(query, node_dict, [], matching_paths,
-                                   matching_nodes)
-
-        return {
-            "paths": matching_paths,
-            "nodes": matching_nodes
-        }
+        Returns a dict with "paths", for each match the topic ids leading to
+        it followed by "Topic" for a topic whose title matched, or the
+        content's id and kind for content whose title or id matched; and
+        "nodes", the matching content and every topic containing a match.
+        """
+        query = query.strip().lower()
+        return TopicSearchTable.get(self).search(self, query)
 
     @staticmethod
     @layer_cache.cache_with_key_fxn(
@@ -1833,6 +1791,190 @@ class Topic(search.Searchable, backup_model.BackupModel):
         raise Exception("Topic search data cache is missing")
 
 
+class TopicSearchTable(object):
+    """A flattened copy of a topic's tree, for Topic.search_tree.
+
+    Every place a topic or content item appears in the tree is a row, in
+    depth first order. Rows are stored in parallel lists: the item's key,
+    kind and id, the row of the topic it is in (-1 for the top topic), and
+    for topics the row after the end of their subtree. The lowercased text
+    searched for each row (a topic's title, or a content item's title and
+    id) is joined into one string, so a search is a few str.find calls,
+    and paths are rebuilt from the parent rows.
+    """
+
+    # Neither appears in titles or ids, so no match can span two rows,
+    # or a content item's title and id
+    ROW_SEPARATOR = u"\x00"
+    TITLE_ID_SEPARATOR = u"\x01"
+
+    def __init__(self):
+        self.keys = []
+        self.kinds = []
+        self.ids = []
+        self.parents = []
+        self.ends = []
+        self.text = u""
+        self.text_starts = []
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(
+        lambda topic: "topic_search_table_%s_%s_%s_%s" % (
+            topic.key(), topic.version.number, topic.version.updated_on,
+            setting_model.Setting.cached_content_add_date()),
+        layer=layer_cache.Layers.InAppMemory | layer_cache.Layers.Memcache)
+    def get(topic):
+        return TopicSearchTable.build(topic)
+
+    @staticmethod
+    def build(topic):
+        nodes = Topic.all().filter("ancestor_keys =", topic.key()).run()
+
+        node_dict = dict((node.key(), node) for node in nodes)
+        node_dict[topic.key()] = topic  # in case the current node is
+                                        # hidden (like root is)
+
+        content_keys = []
+        for descendant in node_dict.values():
+            content_keys.extend([c for c in descendant.child_keys
+                                 if c not in node_dict and
+                                 c.kind() != "Topic"])
+        for content in db.get(content_keys):
+            node_dict[content.key()] = content
+
+        table = TopicSearchTable()
+        texts = []
+        table._add_topic(topic, -1, node_dict, texts)
+
+        table.text_starts = []
+        position = 0
+        for text in texts:
+            table.text_starts.append(position)
+            position += len(text) + 1
+        table.text = TopicSearchTable.ROW_SEPARATOR.join(texts)
+        return table
+
+    def _add_row(self, key, kind, id, parent, text, texts):
+        self.keys.append(key)
+        self.kinds.append(kind)
+        self.ids.append(id)
+        self.parents.append(parent)
+        self.ends.append(len(self.keys))
+        texts.append(text)
+        return len(self.keys) - 1
+
+    def _add_topic(self, topic, parent, node_dict, texts):
+        row = self._add_row(topic.key(), "Topic", topic.id, parent,
+                            topic.title.lower(), texts)
+
+        for child_key in topic.child_keys:
+            if child_key not in node_dict:
+                continue
+            child = node_dict[child_key]
+
+            if child_key.kind() == "Topic":
+                self._add_topic(child, row, node_dict, texts)
+            else:
+                title = getattr(child, "title",
+                                getattr(child, "display_name", ""))
+                id = getattr(child, "id",
+                             getattr(child, "readable_id",
+                                     getattr(child, "name",
+                                             child.key().id())))
+                self._add_row(child_key, child_key.kind(), id, row,
+                              title.lower() +
+                              TopicSearchTable.TITLE_ID_SEPARATOR +
+                              unicode(id).lower(),
+                              texts)
+
+        self.ends[row] = len(self.keys)
+
+    def _matching_rows(self, query):
+        if (TopicSearchTable.ROW_SEPARATOR in query or
+                TopicSearchTable.TITLE_ID_SEPARATOR in query):
+            return []
+
+        rows = []
+        position = self.text.find(query)
+        while position > -1:
+            row = bisect.bisect_right(self.text_starts, position) - 1
+            rows.append(row)
+            if row + 1 >= len(self.text_starts):
+                break
+            position = self.text.find(query, self.text_starts[row + 1])
+        return rows
+
+    def _path(self, row):
+        """The ids of the topics leading to row, including row itself."""
+        path = []
+        while self.parents[row] != -1:
+            path.append(self.ids[row])
+            row = self.parents[row]
+        path.reverse()
+        return path
+
+    def search(self, topic, query):
+        """Search the tree of topic, whose table this is, for query."""
+        matching_rows = self._matching_rows(query)
+
+        paths = []
+        matching_topic_rows = set()
+        content_rows = []
+        for row in matching_rows:
+            if self.kinds[row] == "Topic":
+                paths.append(self._path(row) + ["Topic"])
+                matching_topic_rows.add(row)
+            else:
+                paths.append(self._path(self.parents[row]) +
+                             [self.ids[row], self.kinds[row]])
+                content_rows.append(row)
+
+            parent = self.parents[row]
+            while parent != -1 and parent not in matching_topic_rows:
+                matching_topic_rows.add(parent)
+                parent = self.parents[parent]
+
+        # Matching content is listed as it's reached, and topics once all
+        # of their subtree has been, innermost first
+        events = ([(row, 1, row) for row in content_rows] +
+                  [(self.ends[row], 0, -row) for row in matching_topic_rows])
+        events.sort()
+
+        node_dict = self._get_nodes(topic, content_rows, matching_topic_rows)
+        nodes = []
+        for _, is_content, row in events:
+            if is_content:
+                nodes.append(node_dict[self.keys[row]])
+            else:
+                nodes.append(node_dict[self.keys[-row]].get_visible_data(
+                    node_dict))
+
+        return {
+            "paths": paths,
+            "nodes": nodes
+        }
+
+    def _get_nodes(self, topic, content_rows, topic_rows):
+        """Get the matching entities and the children of matching topics."""
+        node_dict = {topic.key(): topic}
+
+        keys = set(self.keys[row] for row in content_rows)
+        keys.update(self.keys[row] for row in topic_rows)
+        keys.discard(topic.key())
+        for entity in db.get(list(keys)):
+            node_dict[entity.key()] = entity
+
+        child_keys = set()
+        for row in topic_rows:
+            child_keys.update(node_dict[self.keys[row]].child_keys)
+        child_keys = [key for key in child_keys if key not in node_dict]
+        for child in db.get(child_keys):
+            if child:
+                node_dict[child.key()] = child
+
+        return node_dict
+
+
 class UserTopic(backup_model.BackupModel):
     user = db.UserProperty()
     seconds_watched = db.IntegerProperty(default=0)
@@ -1848,7 +1990,11 @@ class UserTopic(backup_model.BackupModel):
 
     @staticmethod
     def get_key_name(topic, user_data):
-        return user_data.key_email + ":" + topic.key().name()
+        return UserTopic.get_key_name_for_topic_key(topic.key(), user_data)
+
+    @staticmethod
+    def get_key_name_for_topic_key(topic_key, user_data):
+        return user_data.key_email + ":" + topic_key.name()
 
     @staticmethod
     def get_for_topic_and_user_data(topic, user_data, insert_if_missing=False):
@@ -2001,6 +2147,9 @@ def _preload_default_version_autocomplete_data(version_number, run_code):
     autocomplete.topic_title_dicts(version.number)
     logging.info("preloaded topic autocomplete")
 
+    search_index.InvertedIndex.get(version.number)
+    logging.info("preloaded search index")
+
     # Sync all topic exercise badges with upcoming version
     badges.topic_exercise_badges.sync_with_topic_version(version)
     logging.info("synced topic exercise badges")
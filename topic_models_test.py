@@ -0,0 +1,152 @@
+import os
+
+from google.appengine.ext import db
+
+import exercise_models
+from testutil import gae_model
+import topic_models
+import video_models
+
+
+def _recursive_search(topic, query):
+    """Topic.search_tree as it was before TopicSearchTable."""
+    nodes = topic_models.Topic.all().filter("ancestor_keys =",
+                                            topic.key()).run()
+    node_dict = dict((node.key(), node) for node in nodes)
+    node_dict[topic.key()] = topic
+
+    content_keys = []
+    for descendant in node_dict.values():
+        content_keys.extend([c for c in descendant.child_keys
+                             if c not in node_dict and c.kind() != "Topic"])
+    for content in db.get(content_keys):
+        node_dict[content.key()] = content
+
+    matching_paths = []
+    matching_nodes = []
+    _traverse(topic, query, node_dict, [], matching_paths, matching_nodes)
+    return {"paths": matching_paths, "nodes": matching_nodes}
+
+
+def _traverse(topic, query, node_dict, path, matching_paths, matching_nodes):
+    match = False
+
+    if topic.title.lower().find(query) > -1:
+        matching_paths.append(path + ["Topic"])
+        match = True
+
+    for child_key in topic.child_keys:
+        if child_key not in node_dict:
+            continue
+        child = node_dict[child_key]
+
+        if child_key.kind() == "Topic":
+            if _traverse(child, query, node_dict, path + [child.id],
+                         matching_paths, matching_nodes):
+                match = True
+        else:
+            title = getattr(child, "title",
+                            getattr(child, "display_name", ""))
+            id = getattr(child, "id",
+                         getattr(child, "readable_id",
+                                 getattr(child, "name", child.key().id())))
+            if (title.lower().find(query) > -1 or
+                    str(id).lower().find(query) > -1):
+                matching_paths.append(path + [id, child_key.kind()])
+                matching_nodes.append(child)
+                match = True
+
+    if match:
+        matching_nodes.append(topic.get_visible_data(node_dict))
+
+    return match
+
+
+class TopicSearchTableTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(TopicSearchTableTest, self).setUp(db_consistency_probability=1)
+
+        # Task queues want HTTP_HOST to be set.
+        os.environ.setdefault('HTTP_HOST', 'localhost')
+
+        # root
+        #  \- Math
+        #      |- Algebra: Adding fractions, Solving equations
+        #      \- Geometry: Adding fractions, Triangles, fractions_1
+        #  \- Art History: Triangles in art
+        self.version = topic_models.TopicVersion.create_new_version()
+        root = self.root()
+        math = topic_models.Topic.insert(title="Math", parent=root,
+                                         version=self.version)
+        algebra = topic_models.Topic.insert(title="Algebra", parent=math,
+                                            version=self.version)
+        geometry = topic_models.Topic.insert(title="Geometry", parent=math,
+                                             version=self.version)
+        art = topic_models.Topic.insert(title="Art History",
+                                        parent=self.root(),
+                                        version=self.version)
+
+        fractions = make_video("Adding fractions", "adding-fractions")
+        algebra.add_child(fractions)
+        algebra.add_child(make_video("Solving equations", "equations"))
+        geometry.add_child(fractions)
+        geometry.add_child(make_video("Triangles", "triangles"))
+        geometry.add_child(make_exercise("fractions_1"))
+        art.add_child(make_video("Triangles in art", "art-triangles"))
+
+    def root(self):
+        return topic_models.Topic.get_root(self.version)
+
+    def assertSearchesMatch(self, query):
+        table_result = self.root().search_tree(query)
+        walk_result = _recursive_search(self.root(), query.strip().lower())
+
+        self.assertEqual(walk_result["paths"], table_result["paths"])
+        self.assertEqual([describe(node) for node in walk_result["nodes"]],
+                         [describe(node) for node in table_result["nodes"]])
+        return table_result
+
+    def test_matches_recursive_walk(self):
+        for query in ["fractions", "triangles", "geometry", "math", "a",
+                      "  Adding ", "adding-fractions", "nothing at all"]:
+            self.assertSearchesMatch(query)
+
+    def test_content_in_several_topics(self):
+        result = self.assertSearchesMatch("adding")
+        self.assertEqual(
+            [["math", "algebra", "adding-fractions", "Video"],
+             ["math", "geometry", "adding-fractions", "Video"]],
+            result["paths"])
+
+    def test_topic_edit_invalidates_table(self):
+        self.assertEqual([], self.root().search_tree("calculus")["paths"])
+
+        geometry = topic_models.Topic.get_by_id("geometry", self.version)
+        geometry.update(title="Calculus")
+
+        result = self.assertSearchesMatch("calculus")
+        self.assertEqual([["math", "geometry", "Topic"]], result["paths"])
+
+        math = topic_models.Topic.get_by_id("math", self.version)
+        topic_models.Topic.insert(title="Calculus 2", parent=math,
+                                  version=self.version)
+        self.assertEqual(2, len(self.assertSearchesMatch("calculus")["paths"]))
+
+
+def describe(node):
+    """The key of a search result node, and the children of a topic's."""
+    return node.key(), getattr(node, "children", None)
+
+
+def make_video(title, readable_id):
+    video = video_models.Video(title=title, readable_id=readable_id,
+                               youtube_id=readable_id)
+    video.put()
+    return video
+
+
+def make_exercise(name):
+    exercise = exercise_models.Exercise(name=name, prerequisites=[],
+                                        covers=[], author=None, live=True)
+    exercise.put()
+    return exercise
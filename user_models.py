@@ -1734,6 +1734,28 @@ class UserNotificationGroup(db.Model):
         """Return identifying key for an entity tied to specified user_data."""
         return "UserNotificationGroup:%s" % user_data.user_id
 
+    @staticmethod
+    def _prefetched_key(key_name):
+        return "UserNotificationGroup.prefetched_%s" % key_name
+
+    @staticmethod
+    def prefetch_for_user_data(user_data):
+        """Start getting the UserNotificationGroup associated with user_data.
+
+        Returns a function that waits for it and caches it for the next
+        get_for_user_data call in this request, so other datastore calls can
+        run while it's fetched.
+        """
+        key_name = UserNotificationGroup.key_for_user_data(user_data)
+        rpc = db.get_async(db.Key.from_path("UserNotificationGroup",
+                                            key_name))
+
+        def finish():
+            # Only used once, since the group may be changed and put after
+            request_cache.set(UserNotificationGroup._prefetched_key(key_name),
+                              [rpc.get_result()])
+        return finish
+
     @staticmethod
     def get_for_user_data(user_data):
         """Return the UserNotificationGroup associated with user_data.
@@ -1741,7 +1763,12 @@ class UserNotificationGroup(db.Model):
         This will return an empty UserNotificationGroup if none exists yet."""
         key_name = UserNotificationGroup.key_for_user_data(user_data)
 
-        group = UserNotificationGroup.get_by_key_name(key_name)
+        prefetched = request_cache.get(
+            UserNotificationGroup._prefetched_key(key_name))
+        if prefetched:
+            group = prefetched.pop()
+        else:
+            group = UserNotificationGroup.get_by_key_name(key_name)
 
         # If no UserNotificationGroup exists yet, return an empty one.
         if not group:
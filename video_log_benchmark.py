@@ -0,0 +1,235 @@
+"""Count the RPCs VideoLog.add_entry makes, before and after batching.
+
+legacy_add_entry is the old add_entry. It got or inserted the UserVideo
+and each UserTopic one by one, got the topics in a separate call, put each
+UserTopic on its own and let GoalList.update_goals put the goals. It's
+kept here so the two can be compared. add_entry gets the UserVideo, the
+video's topics and the user's UserTopics in one batch, and puts everything
+it changes in one more.
+
+benchmark() logs a watch of a video the user hasn't seen and another of
+the same video with each, and prints the RPCs each made by service and
+method. /api/v1/user/videos/<youtube_id>/log makes the same other RPCs
+either way, so only add_entry is counted.
+
+Both write the video progress they log, so run this against the test db
+(see testutil/make_test_db.py), from the dev server's interactive console:
+
+    import video_log_benchmark
+    video_log_benchmark.benchmark()
+"""
+
+import datetime
+import logging
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+import consts
+import gae_bingo.gae_bingo
+import goals.models
+import points
+from tincan import TinCan
+import user_models
+import video_models
+
+# Counts of RPCs by "service.method" while count_rpcs runs, else None
+_rpc_counts = None
+
+
+def _count_rpc(service, call, request, response):
+    if _rpc_counts is not None:
+        name = "%s.%s" % (service, call)
+        _rpc_counts[name] = _rpc_counts.get(name, 0) + 1
+
+
+def count_rpcs(fxn, *args, **kwargs):
+    """Call fxn and return a dict of the number of RPCs it made by
+    "service.method", and the time it took in seconds.
+    """
+    global _rpc_counts
+
+    # Appending is a no-op if the hook is already there
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        "video_log_benchmark", _count_rpc)
+
+    _rpc_counts = {}
+    start = time.time()
+    try:
+        fxn(*args, **kwargs)
+        return _rpc_counts, time.time() - start
+    finally:
+        _rpc_counts = None
+
+
+def legacy_add_entry(user_data, video, seconds_watched, last_second_watched,
+                     detect_cheat=True):
+    import badges.last_action_cache
+    UserVideo = video_models.UserVideo
+    UserVideoCss = video_models.UserVideoCss
+
+    user_video = UserVideo.get_for_video_and_user_data(video, user_data, insert_if_missing=True)
+
+    # Cap seconds_watched at duration of video
+    seconds_watched = max(0, min(seconds_watched, video.duration))
+
+    video_points_previous = points.VideoPointCalculator(user_video)
+
+    action_cache = badges.last_action_cache.LastActionCache.get_for_user_data(user_data)
+
+    last_video_log = action_cache.get_last_video_log()
+
+    if (detect_cheat and
+            last_video_log and
+            last_video_log.key_for_video() != video.key()):
+        dt_now = datetime.datetime.now()
+        other_video_time = last_video_log.time_watched
+        this_video_time = dt_now - datetime.timedelta(seconds=seconds_watched)
+        if other_video_time > this_video_time:
+            logging.warning("Detected overlapping video logs " +
+                            "(user may be watching multiple videos?)")
+            return (None, None, 0, False)
+
+    video_log = video_models.VideoLog()
+    video_log.user = user_data.user
+    video_log.video = video
+    video_log.video_title = video.title
+    video_log.youtube_id = video.youtube_id
+    video_log.seconds_watched = seconds_watched
+    video_log.last_second_watched = last_second_watched
+
+    if seconds_watched > 0:
+        import badges.util_badges
+        import topic_models
+
+        if user_video.seconds_watched == 0:
+            gae_bingo.gae_bingo.bingo([
+                "video_started_binary", # Core metric
+                "video_started_count",]) # Core metric
+
+            user_data.uservideocss_version += 1
+            UserVideoCss.set_started(user_data, user_video.video, user_data.uservideocss_version)
+
+        user_video.seconds_watched += seconds_watched
+        user_data.total_seconds_watched += seconds_watched
+
+        # Update seconds_watched of all associated topics
+        video_topics = db.get(video.topic_string_keys)
+
+        first_topic = True
+        for topic in video_topics:
+            user_topic = topic_models.UserTopic.get_for_topic_and_user_data(topic, user_data, insert_if_missing=True)
+            user_topic.title = topic.standalone_title
+            user_topic.seconds_watched += seconds_watched
+            user_topic.last_watched = datetime.datetime.now()
+            user_topic.put()
+
+            video_log.playlist_titles.append(user_topic.title)
+
+            if first_topic:
+                action_cache.push_video_log(video_log)
+
+            badges.util_badges.update_with_user_topic(
+                    user_data,
+                    user_topic,
+                    include_other_badges=first_topic,
+                    action_cache=action_cache)
+
+            first_topic = False
+
+    user_video.last_second_watched = last_second_watched
+    user_video.last_watched = datetime.datetime.now()
+    user_video.duration = video.duration
+
+    user_data.record_activity(user_video.last_watched)
+
+    video_points_total = points.VideoPointCalculator(user_video)
+    video_points_received = video_points_total - video_points_previous
+
+    just_finished_video = False
+    if not user_video.completed and video_points_total >= consts.VIDEO_POINTS_BASE:
+        just_finished_video = True
+        user_video.completed = True
+        user_data.videos_completed = -1
+        TinCan.create_media(user_data, "completed", video, user_video)
+
+        user_data.uservideocss_version += 1
+        UserVideoCss.set_completed(user_data, user_video.video, user_data.uservideocss_version)
+
+        gae_bingo.gae_bingo.bingo([
+            'struggling_videos_finished',
+            'video_completed_binary', # Core metric
+            'video_completed_count' # Core metric
+            ])
+
+    video_log.is_video_completed = user_video.completed
+
+    goals_updated = goals.models.GoalList.update_goals(user_data,
+        lambda goal: goal.just_watched_video(user_data, user_video, just_finished_video))
+
+    if video_points_received > 0:
+        video_log.points_earned = video_points_received
+        user_data.add_points(video_points_received)
+        TinCan.create_media(user_data, "progressed", video, user_video)
+
+    db.put([user_video, user_data])
+
+    deferred.defer(video_models._commit_video_log, video_log,
+                   _queue="video-log-queue",
+                   _url="/_ah/queue/deferred_videolog")
+
+    if user_data is not None and user_data.coaches:
+        video_models.buffer_log_summary_coaches(video_log, user_data.coaches)
+
+    return (user_video, video_log, video_points_total, goals_updated)
+
+
+def _total(counts):
+    return sum(counts.itervalues())
+
+
+def benchmark(user_data=None, videos=None, seconds_watched=30):
+    """Log a first and a second watch of a video with legacy_add_entry and
+    with add_entry.
+
+    Defaults to the first non-phantom user and the first two videos in a
+    topic that they haven't watched, one for each. Returns the RPC counts
+    and time of each watch, and prints them side by side.
+    """
+    if user_data is None:
+        user_data = [u for u in user_models.UserData.all().fetch(100)
+                     if not u.is_phantom][0]
+    if videos is None:
+        videos = [v for v in video_models.Video.all().fetch(100)
+                  if v.topic_string_keys and
+                      not video_models.UserVideo.get_for_video_and_user_data(
+                          v, user_data)][:2]
+
+    implementations = [("legacy", legacy_add_entry),
+                       ("batched", video_models.VideoLog.add_entry)]
+    names = []
+    results = {}
+    for watch in ["first", "second"]:
+        for (implementation, add_entry), video in zip(implementations,
+                                                      videos):
+            name = "%s %s" % (implementation, watch)
+            names.append(name)
+            # Start each from the stored UserData, not one cached by the last
+            user_data = db.get(user_data.key())
+            results[name] = count_rpcs(add_entry, user_data, video,
+                                       seconds_watched, seconds_watched,
+                                       detect_cheat=False)
+
+    calls = sorted(set().union(*[results[column][0] for column in names]))
+    row = "%-40s" + " %15s" * len(names)
+    print row % tuple([""] + names)
+    for call in calls:
+        print row % tuple([call] + [results[column][0].get(call, 0)
+                                    for column in names])
+    print row % tuple(["total"] + [_total(results[column][0])
+                                   for column in names])
+    print row % tuple(["time"] + ["%.1fms" % (1000.0 * results[column][1])
+                                  for column in names])
+    return results
@@ -522,6 +522,23 @@ def commit_log_summary_coaches(activity_log, coaches):
         summary_log_models.LogSummary.add_or_update_entry(user_models.UserData.get_from_db_key_email(coach), activity_log, classtime.ClassDailyActivitySummary, summary_log_models.LogSummaryTypes.CLASS_DAILY_ACTIVITY, 1440)
 
 
+def buffer_log_summary_coaches(activity_log, coaches):
+    """Buffer an activity for its coaches' log summaries.
+
+    Any coaches whose summaries it couldn't be buffered for get it the old
+    way, with a deferred commit_log_summary_coaches.
+    """
+    unbuffered = summary_log_models.LogSummary.buffer_entry(
+        coaches, activity_log, classtime.ClassDailyActivitySummary,
+        summary_log_models.LogSummaryTypes.CLASS_DAILY_ACTIVITY, 1440)
+
+    if unbuffered:
+        # Making a separate queue for the log summaries so we can clearly see how much they are getting used
+        deferred.defer(commit_log_summary_coaches, activity_log, unbuffered,
+                       _queue="log-summary-queue",
+                       _url="/_ah/queue/deferred_log_summary")
+
+
 class VideoLog(backup_model.BackupModel):
     user = db.UserProperty()
     video = db.ReferenceProperty(Video)
@@ -572,17 +589,54 @@ class VideoLog(backup_model.BackupModel):
     @staticmethod
     def add_entry(user_data, video, seconds_watched, last_second_watched, detect_cheat=True):
 
-        # TODO(csilvers): get rid of circular dependency here
+        # TODO(csilvers): get rid of circular dependencies here
         import badges.last_action_cache
-        user_video = UserVideo.get_for_video_and_user_data(video, user_data, insert_if_missing=True)
+        import badges.util_badges
+        import topic_models
 
         # Cap seconds_watched at duration of video
         seconds_watched = max(0, min(seconds_watched, video.duration))
 
-        video_points_previous = points.VideoPointCalculator(user_video)
+        # Get the UserVideo and, if any of the video was watched, its topics
+        # and the user's UserTopics for them in one batch, while the
+        # LastActionCache and current goals are fetched
+        user_video_key_name = UserVideo.get_key_name(video, user_data)
+        topic_keys = []
+        user_topic_key_names = []
+        if seconds_watched > 0:
+            topic_keys = [db.Key(key) for key in video.topic_string_keys]
+            user_topic_key_names = [
+                topic_models.UserTopic.get_key_name_for_topic_key(key,
+                                                                  user_data)
+                for key in topic_keys]
+
+        entities_rpc = db.get_async(
+            [db.Key.from_path(UserVideo.kind(), user_video_key_name)] +
+            topic_keys +
+            [db.Key.from_path(topic_models.UserTopic.kind(), key_name)
+             for key_name in user_topic_key_names])
+        finish_goals_prefetch = (
+            goals.models.GoalList.prefetch_current_goals(user_data))
 
         action_cache = badges.last_action_cache.LastActionCache.get_for_user_data(user_data)
 
+        entities = entities_rpc.get_result()
+        finish_goals_prefetch()
+
+        user_video = entities[0]
+        video_topics = entities[1:len(topic_keys) + 1]
+        user_topics = entities[len(topic_keys) + 1:]
+
+        if not user_video:
+            TinCan.create_media(user_data, "launched", video)
+            user_video = UserVideo(
+                key_name=user_video_key_name,
+                user=user_data.user,
+                video=video,
+                duration=video.duration)
+
+        video_points_previous = points.VideoPointCalculator(user_video)
+
         last_video_log = action_cache.get_last_video_log()
 
         # If the last video logged is not this video and the times being credited
@@ -607,11 +661,10 @@ class VideoLog(backup_model.BackupModel):
         video_log.seconds_watched = seconds_watched
         video_log.last_second_watched = last_second_watched
 
-        if seconds_watched > 0:
-            # TODO(csilvers): get rid of circular dependencies here
-            import badges.util_badges
-            import topic_models
+        # Everything this changes is put at once at the end
+        changed_user_topics = []
 
+        if seconds_watched > 0:
             if user_video.seconds_watched == 0:
                 gae_bingo.gae_bingo.bingo([
                     "video_started_binary", # Core metric
@@ -624,26 +677,35 @@ class VideoLog(backup_model.BackupModel):
             user_data.total_seconds_watched += seconds_watched
 
             # Update seconds_watched of all associated topics
-            video_topics = db.get(video.topic_string_keys)
+            badge_review = badges.util_badges.BadgeReview(user_data,
+                                                          action_cache)
 
             first_topic = True
-            for topic in video_topics:
-                user_topic = topic_models.UserTopic.get_for_topic_and_user_data(topic, user_data, insert_if_missing=True)
+            for topic, user_topic, user_topic_key_name in zip(
+                    video_topics, user_topics, user_topic_key_names):
+                if not topic:
+                    continue
+
+                if not user_topic:
+                    user_topic = topic_models.UserTopic(
+                        key_name=user_topic_key_name,
+                        title=topic.standalone_title,
+                        topic_key_name=topic.key().name(),
+                        user=user_data.user)
+
                 user_topic.title = topic.standalone_title
                 user_topic.seconds_watched += seconds_watched
                 user_topic.last_watched = datetime.datetime.now()
-                user_topic.put()
+                changed_user_topics.append(user_topic)
 
                 video_log.playlist_titles.append(user_topic.title)
 
                 if first_topic:
                     action_cache.push_video_log(video_log)
 
-                badges.util_badges.update_with_user_topic(
-                        user_data,
-                        user_topic,
-                        include_other_badges=first_topic,
-                        action_cache=action_cache)
+                badge_review.award_with_context(user_topic=user_topic)
+                if first_topic:
+                    badge_review.award_with_no_context()
 
                 first_topic = False
 
@@ -675,14 +737,16 @@ class VideoLog(backup_model.BackupModel):
         video_log.is_video_completed = user_video.completed
 
         goals_updated = goals.models.GoalList.update_goals(user_data,
-            lambda goal: goal.just_watched_video(user_data, user_video, just_finished_video))
+            lambda goal: goal.just_watched_video(user_data, user_video, just_finished_video),
+            put=False)
 
         if video_points_received > 0:
             video_log.points_earned = video_points_received
             user_data.add_points(video_points_received)
             TinCan.create_media(user_data, "progressed", video, user_video)
 
-        db.put([user_video, user_data])
+        db.put([user_video, user_data] + changed_user_topics +
+               (goals_updated or []))
 
         # Defer the put of VideoLog for now, as we think it might be causing hot tablets
         # and want to shift it off to an automatically-retrying task queue.
@@ -693,10 +757,7 @@ class VideoLog(backup_model.BackupModel):
 
 
         if user_data is not None and user_data.coaches:
-            # Making a separate queue for the log summaries so we can clearly see how much they are getting used
-            deferred.defer(commit_log_summary_coaches, video_log, user_data.coaches,
-                _queue="log-summary-queue",
-                _url="/_ah/queue/deferred_log_summary")
+            buffer_log_summary_coaches(video_log, user_data.coaches)
 
         return (user_video, video_log, video_points_total, goals_updated)
 
@@ -1,8 +1,14 @@
+import os
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
+import goals.models
+import request_cache
+from testutil import gae_model
+import topic_models
+import user_models
 import video_models
 from mock import patch
 
@@ -24,3 +30,112 @@ class VideoSubtitlesTest(unittest.TestCase):
         json = subs.load_json()
         self.assertIsNone(json)
         self.assertEqual(warn.call_count, 1, 'logging.warn() not called')
+
+
+class VideoLogAddEntryTest(gae_model.GAEModelTestCase):
+    def setUp(self):
+        super(VideoLogAddEntryTest, self).setUp(db_consistency_probability=1)
+
+        # Task queues want HTTP_HOST to be set.
+        os.environ.setdefault('HTTP_HOST', 'localhost')
+
+        self.user_data = user_models.UserData.insert_for(
+            'student', 'student@example.com')
+
+        version = topic_models.TopicVersion.create_new_version()
+        root = topic_models.Topic.get_root(version)
+        self.topics = [
+            topic_models.Topic.insert(title="Algebra", parent=root,
+                                      version=version),
+            topic_models.Topic.insert(title="Geometry",
+                                      parent=topic_models.Topic.get_root(
+                                          version),
+                                      version=version),
+        ]
+
+        self.video = video_models.Video(
+            title="Adding fractions", readable_id="adding-fractions",
+            youtube_id="adding-fractions", duration=600)
+        self.video.topic_string_keys = [str(topic.key())
+                                        for topic in self.topics]
+        self.video.put()
+
+        self.goal = goals.models.Goal(
+            parent=self.user_data, title="Fractions",
+            objectives=[goals.models.GoalObjectiveWatchVideo(
+                self.video, self.user_data)])
+        self.goal.put()
+        self.user_data.has_current_goals = True
+        self.user_data.put()
+
+        self.patchers = [
+            patch("badges.util_badges.BadgeReview"),
+            patch("video_models.TinCan"),
+            patch("video_models.gae_bingo.gae_bingo.bingo"),
+        ]
+        self.badge_review_class = self.patchers[0].start()
+        for patcher in self.patchers[1:]:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        request_cache.flush()
+        super(VideoLogAddEntryTest, self).tearDown()
+
+    def watch(self, seconds_watched, last_second_watched):
+        # Each watch is logged by its own request
+        request_cache.flush()
+        self.badge_review_class.reset_mock()
+        user_data = user_models.UserData.get_from_user_id('student')
+        return video_models.VideoLog.add_entry(user_data, self.video,
+                                               seconds_watched,
+                                               last_second_watched,
+                                               detect_cheat=False)
+
+    def user_topic(self, topic):
+        return topic_models.UserTopic.get_by_key_name(
+            topic_models.UserTopic.get_key_name_for_topic_key(
+                topic.key(), self.user_data))
+
+    def assert_watched(self, seconds_watched, last_second_watched):
+        user_video = video_models.UserVideo.get_for_video_and_user_data(
+            self.video, self.user_data)
+        self.assertEqual(seconds_watched, user_video.seconds_watched)
+        self.assertEqual(last_second_watched, user_video.last_second_watched)
+        self.assertEqual(600, user_video.duration)
+
+        for topic in self.topics:
+            user_topic = self.user_topic(topic)
+            self.assertEqual(seconds_watched, user_topic.seconds_watched)
+            self.assertEqual(topic.standalone_title, user_topic.title)
+            self.assertEqual(topic.key().name(), user_topic.topic_key_name)
+
+        user_data = user_models.UserData.get_from_user_id('student')
+        self.assertEqual(seconds_watched, user_data.total_seconds_watched)
+
+        goal = goals.models.Goal.get(self.goal.key())
+        self.assertEqual(user_video.progress, goal.objectives[0].progress)
+
+        badge_review = self.badge_review_class.return_value
+        self.assertEqual(1, self.badge_review_class.call_count)
+        self.assertEqual(
+            [topic.standalone_title for topic in self.topics],
+            [kwargs["user_topic"].title for (_, kwargs) in
+             badge_review.award_with_context.call_args_list])
+        self.assertEqual(1, badge_review.award_with_no_context.call_count)
+
+    def test_first_and_second_watch(self):
+        user_video, video_log, _, goals_updated = self.watch(100, 100)
+        self.assertEqual(100, video_log.seconds_watched)
+        self.assertEqual(["Algebra", "Geometry"], video_log.playlist_titles)
+        self.assertEqual([self.goal.key()],
+                         [goal.key() for goal in goals_updated])
+        self.assert_watched(100, 100)
+
+        user_video, video_log, _, goals_updated = self.watch(200, 300)
+        self.assertEqual(200, video_log.seconds_watched)
+        self.assertEqual(["Algebra", "Geometry"], video_log.playlist_titles)
+        self.assertEqual(1, len(goals_updated))
+        self.assert_watched(300, 300)
+        self.assertTrue(0 < user_video.progress < 1)